@@ -0,0 +1,89 @@
+"""
+Throughput of the ASGI middlewares.
+
+Requests are passed straight to the ASGI callables in a single event loop,
+without any server, so the numbers show the cost of the middlewares only.
+
+Usage::
+
+    poetry run python benchmarks/asgi.py
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+from kw.platform import asgi, settings
+from kw.platform.utils import SunsetRegistry
+
+NUMBER = 50000
+
+VALID = b"mambo/1a (Kiwi.com dev)"
+
+
+async def app(scope, receive, send):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b"OK"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+def scope(user_agent, path="/"):
+    headers = [
+        (b"host", b"example.com"),
+        (b"accept", b"application/json"),
+        (b"accept-encoding", b"gzip, deflate"),
+        (b"connection", b"keep-alive"),
+        (b"x-request-id", b"0d3f8a8c-3c3b-4c1e-9a1c-6b0b6d1f4c2a"),
+        (b"user-agent", user_agent),
+    ]
+    return {"type": "http", "method": "GET", "path": path, "headers": headers}
+
+
+async def run(asgi_app, request_scope):
+    before_time = time.time()
+    for _ in range(NUMBER):
+        await asgi_app(request_scope, receive, send)
+    return NUMBER / (time.time() - before_time)
+
+
+def main():
+    settings.update(
+        slowdown_datetime="2000-01-01T00:00:00",
+        restrict_datetime="2000-01-02T00:00:00",
+        enable_restriction_of_requests=True,
+    )
+    sunsets = SunsetRegistry()
+    sunsets.register("/old", when=datetime(2030, 1, 1))
+
+    cases = [
+        ("no middleware", app, scope(VALID)),
+        ("user_agent_middleware", asgi.user_agent_middleware(app), scope(VALID)),
+        ("refused", asgi.user_agent_middleware(app), scope(b"invalid")),
+        ("sunset_middleware", asgi.sunset_middleware(app, sunsets), scope(VALID)),
+        (
+            "sunset_middleware, /old",
+            asgi.sunset_middleware(app, sunsets),
+            scope(VALID, "/old"),
+        ),
+    ]
+    loop = asyncio.get_event_loop()
+    for name, asgi_app, request_scope in cases:
+        rate = loop.run_until_complete(run(asgi_app, request_scope))
+        print("{:<26} {:>10.0f} requests/s".format(name, rate))
+
+
+if __name__ == "__main__":
+    main()
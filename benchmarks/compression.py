@@ -0,0 +1,127 @@
+"""
+Bytes on the wire and CPU cost of response encodings negotiated by
+:class:`kw.platform.requests.KiwiSession`.
+
+A local stand-in server returns a search response with 200 itineraries in every
+encoding the session can decode, ``br`` and ``zstd`` with the ``brotli`` and
+``zstandard`` packages installed. For each encoding, the script prints the size of
+the body on the wire, the CPU time of compressing it and the CPU time of a request,
+which includes sending the pre-compressed body by the server and decoding it by
+the client.
+
+Usage::
+
+    poetry run python benchmarks/compression.py
+"""
+
+import json
+import threading
+import time
+import timeit
+import zlib
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from kw.platform import compression
+from kw.platform.requests import KiwiSession
+
+from serialization import PAYLOADS
+
+NUMBER = 200
+
+USER_AGENT = "benchmark/1.0.0 (Kiwi.com dev)"
+
+COMPRESSORS = {
+    "identity": lambda data: data,
+    "gzip": compression.gzip_compress,
+    "deflate": lambda data: zlib.compress(data, compression.GZIP_LEVEL),
+}
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    pass
+else:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=5)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    pass
+else:
+    COMPRESSORS["zstd"] = zstandard.ZstdCompressor(level=3).compress
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def stand_in_server(bodies):
+    def app(environ, start_response):
+        encoding = environ.get("HTTP_ACCEPT_ENCODING", "identity")
+        body = bodies[encoding]
+        headers = [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+        ]
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        start_response("200 OK", headers)
+        return [body]
+
+    server = make_server("127.0.0.1", 0, app, handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def cpu_time(func, number):
+    before = time.process_time()
+    for _ in range(number):
+        func()
+    return (time.process_time() - before) / number
+
+
+def main():
+    data = json.dumps(PAYLOADS["search"]).encode("utf-8")
+    session = KiwiSession()
+    supported = ["identity"] + [
+        encoding.strip()
+        for encoding in session.headers["Accept-Encoding"].split(",")
+        if encoding.strip() in COMPRESSORS
+    ]
+    bodies = {encoding: COMPRESSORS[encoding](data) for encoding in supported}
+    server = stand_in_server(bodies)
+    url = "http://127.0.0.1:{}/search".format(server.server_port)
+
+    print("search ({} bytes), {} requests".format(len(data), NUMBER))
+    try:
+        for encoding in supported:
+            compress = cpu_time(lambda: COMPRESSORS[encoding](data), NUMBER)
+
+            def fetch():
+                headers = {"Accept-Encoding": encoding, "User-Agent": USER_AGENT}
+                response = session.get(url, headers=headers)
+                assert response.content == data
+
+            fetch()
+            request = cpu_time(fetch, NUMBER)
+            wall = timeit.timeit(fetch, number=NUMBER)
+            print(
+                "    {:<8} {:>7} bytes   compress {:>8.1f} us   "
+                "request cpu {:>8.1f} us   wall {:>8.1f} us".format(
+                    encoding,
+                    len(bodies[encoding]),
+                    compress * 1e6,
+                    request * 1e6,
+                    wall / NUMBER * 1e6,
+                )
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
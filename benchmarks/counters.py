@@ -0,0 +1,38 @@
+"""
+Update cost of counters shared across processes vs in-process counters.
+
+Usage::
+
+    poetry run python benchmarks/counters.py
+"""
+
+import os
+import shutil
+import tempfile
+import timeit
+
+from kw.platform import counters
+
+NUMBER = 200000
+
+
+def per_call(func):
+    return timeit.timeit(func, number=NUMBER) / NUMBER * 1e9
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        local = counters.LocalCounters()
+        shared = counters.SharedCounters(os.path.join(directory, "counters"))
+        for name, instance in [("LocalCounters", local), ("SharedCounters", shared)]:
+            instance.incr("user_agent.invalid")
+            incr = per_call(lambda: instance.incr("user_agent.invalid"))
+            get = per_call(lambda: instance.get("user_agent.invalid"))
+            print("{:<16} incr {:>7.0f} ns   get {:>8.0f} ns".format(name, incr, get))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
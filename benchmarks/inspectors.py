@@ -0,0 +1,115 @@
+"""
+Cost of ``report_to_sentry`` on header-heavy responses.
+
+Compares the single-pass inspector pipeline with the previous implementation,
+which is reproduced below, on :mod:`requests` responses and on responses with
+:mod:`multidict` headers as used by :mod:`aiohttp`. Reports are captured by
+a no-op function.
+
+Usage::
+
+    poetry run python benchmarks/inspectors.py
+"""
+
+import timeit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from kw.platform import utils
+
+NUMBER = 20000
+
+LINK = ", ".join(
+    '<https://api.example.com/items?page={}>; rel="page-{}"'.format(i, i)
+    for i in range(20)
+)
+
+
+def legacy_report_to_sentry(response, sunset_header=True, deprecated_usage_header=True):
+    if sunset_header:
+        sunset_warning = ""
+
+        if "Sunset" in response.headers:
+            sunset_warning += (
+                "The Sunset header found in the HTTP response: "
+                "{}".format(response.headers["Sunset"])
+            )
+        if "sunset" in response.links:
+            if sunset_warning:
+                sunset_warning += ", additional info: "
+            else:
+                sunset_warning += (
+                    "The Sunset Link relation type found in the HTTP response: "
+                )
+            sunset_warning += str(response.links["sunset"]["url"])
+
+        if sunset_warning:
+            utils.capture_message(sunset_warning, level="warning")
+
+    if deprecated_usage_header:
+        deprecated_usage_warning = response.headers.get("Deprecated-Usage")
+
+        if deprecated_usage_warning:
+            utils.capture_message(deprecated_usage_warning, level="warning")
+
+
+def headers(**extra):
+    values = [("X-Header-{}".format(i), "value-{}".format(i)) for i in range(40)]
+    values.extend(extra.items())
+    return values
+
+
+class MultiDictResponse(object):
+    """Response with headers and ``links`` like :class:`aiohttp.ClientResponse`."""
+
+    def __init__(self, values):
+        from multidict import CIMultiDict, CIMultiDictProxy
+
+        self.headers = CIMultiDictProxy(CIMultiDict(values))
+
+    @property
+    def links(self):
+        links = {}
+        for link in requests.utils.parse_header_links(self.headers.get("Link", "")):
+            links[link.get("rel") or link["url"]] = link
+        return links
+
+
+def requests_response(values):
+    response = requests.Response()
+    response.headers = CaseInsensitiveDict(values)
+    return response
+
+
+def main():
+    utils.capture_message = lambda message, level: None
+    sampler = utils.ReportSampler(rates=1.0)
+    cases = [
+        ("no reported header", headers()),
+        ("Link without sunset", headers(Link=LINK)),
+        ("Sunset", headers(Sunset="Sat, 31 Dec 2022 23:59:59 GMT", Link=LINK)),
+    ]
+    for case, values in cases:
+        print(case)
+        for kind, factory in [
+            ("requests", requests_response),
+            ("multidict", MultiDictResponse),
+        ]:
+            response = factory(values)
+            legacy = timeit.timeit(
+                lambda: legacy_report_to_sentry(response), number=NUMBER
+            )
+            pipeline = timeit.timeit(
+                lambda: utils.report_to_sentry(response, sampler=sampler),
+                number=NUMBER,
+            )
+            print(
+                "    {:<10} previous {:>7.2f} us   pipeline {:>7.2f} us".format(
+                    kind, legacy / NUMBER * 1e6, pipeline / NUMBER * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
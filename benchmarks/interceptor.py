@@ -0,0 +1,78 @@
+"""
+Per-call overhead of the monkey patches of HTTP clients.
+
+Compares the single :class:`kw.platform.wrappers.Interceptor` frame running
+the User-Agent, deadline and Sentry hooks with the same hooks applied as stacked
+:mod:`wrapt` wrappers, as the patches were applied before. The wrapped function
+is a stand-in of ``Session.request`` returning a prepared response without any
+I/O, so only the cost of the wrappers is measured.
+
+Usage::
+
+    poetry run python benchmarks/interceptor.py
+"""
+
+import timeit
+
+import requests
+import wrapt
+
+from kw.platform import wrappers
+
+NUMBER = 100000
+
+USER_AGENT = "benchmark/1.0.0 (Kiwi.com dev)"
+
+RESPONSE = requests.Response()
+RESPONSE.status_code = 200
+RESPONSE.headers["Content-Type"] = "application/json"
+
+
+def request(method, url, **kwargs):
+    return RESPONSE
+
+
+def stacked():
+    func = request
+    for wrapper in (
+        wrappers.add_deadline(),
+        wrappers.add_user_agent(USER_AGENT),
+        wrappers.add_sentry_handler(),
+    ):
+        func = wrapt.FunctionWrapper(func, wrapper)
+    return func
+
+
+def intercepted():
+    interceptor = wrappers.Interceptor(__name__, "request")
+    interceptor.add_hook("deadline", pre=wrappers.deadline_hook())
+    interceptor.add_hook("user_agent", pre=wrappers.user_agent_hook(USER_AGENT))
+    interceptor.add_hook("sentry", post=wrappers.sentry_hook())
+    return wrapt.FunctionWrapper(request, interceptor)
+
+
+def main():
+    variants = [
+        ("unpatched", request),
+        ("stacked wrapt", stacked()),
+        ("interceptor", intercepted()),
+    ]
+    baseline = None
+    for name, func in variants:
+        seconds = timeit.timeit(
+            lambda: func("GET", "https://kiwi.com", headers={}), number=NUMBER
+        )
+        per_call = seconds / NUMBER * 1e6
+        if baseline is None:
+            baseline = per_call
+            print("{:<14} {:>6.2f} us".format(name, per_call))
+        else:
+            print(
+                "{:<14} {:>6.2f} us   overhead {:>6.2f} us".format(
+                    name, per_call, per_call - baseline
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Refusals per second of requests with invalid User-Agent.
+
+Compares responses serialized once by :func:`kw.platform.utils.refusal` with
+responses built on every request as before, in the WSGI middleware and in
+the aiohttp helper.
+
+Usage::
+
+    poetry run python benchmarks/refusals.py
+"""
+
+import timeit
+
+import webob.exc
+
+from kw.platform import serialization, settings, utils, wsgi
+
+NUMBER = 20000
+
+
+def simple_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"OK"]
+
+
+def start_response(status, headers, exc_info=None):
+    return lambda data: None
+
+
+def environ():
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/",
+        "HTTP_USER_AGENT": "invalid",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.url_scheme": "http",
+    }
+
+
+def webob_refusal(environ, start_response):
+    message = settings.current().restrict_user_agent_message
+    return webob.exc.HTTPBadRequest(message)(environ, start_response)
+
+
+def report(name, seconds):
+    print("{:<36} {:>10.0f} refusals/s".format(name, NUMBER / seconds))
+
+
+def bench_wsgi():
+    app = wsgi.user_agent_middleware(simple_app)
+    report(
+        "wsgi, cached JSON",
+        timeit.timeit(lambda: app(environ(), start_response), number=NUMBER),
+    )
+    report(
+        "wsgi, webob error page",
+        timeit.timeit(lambda: webob_refusal(environ(), start_response), number=NUMBER),
+    )
+
+
+def bench_aiohttp():
+    try:
+        from aiohttp import web
+        from kw.platform.aiohttp.utils import refusal_response
+    except ImportError:
+        return
+
+    def json_response():
+        message = settings.current().restrict_user_agent_message
+        return web.json_response(
+            status=400, data={"message": message}, dumps=serialization.dumps
+        )
+
+    report("aiohttp, cached JSON", timeit.timeit(refusal_response, number=NUMBER))
+    report("aiohttp, json_response", timeit.timeit(json_response, number=NUMBER))
+
+
+def bench_refusal():
+    report("utils.refusal, cached", timeit.timeit(utils.refusal, number=NUMBER))
+
+
+if __name__ == "__main__":
+    settings.update(
+        slowdown_datetime="2000-01-01T00:00:00",
+        restrict_datetime="2000-01-02T00:00:00",
+        enable_restriction_of_requests=True,
+    )
+    bench_refusal()
+    bench_wsgi()
+    bench_aiohttp()
@@ -0,0 +1,69 @@
+"""
+Throughput of the installed JSON backends on payloads handled by the library.
+
+* ``refusal``, the body of a refused request,
+* ``record``, a single record of a streamed JSON lines response,
+* ``search``, a response with 200 itineraries of about 180 kB.
+
+Usage::
+
+    poetry run python benchmarks/serialization.py
+"""
+
+import timeit
+
+from kw.platform import serialization
+
+NUMBER = 200
+
+
+def itinerary(index):
+    return {
+        "id": "{:08x}_{}".format(index * 7919, index),
+        "flyFrom": "PRG",
+        "flyTo": "BCN",
+        "price": 100 + index % 50,
+        "currency": "EUR",
+        "availability": {"seats": index % 9 or None},
+        "route": [
+            {
+                "id": "{}_{}".format(index, leg),
+                "airline": "FR",
+                "flight_no": 1000 + leg,
+                "local_departure": "2020-01-0{}T06:15:00.000Z".format(leg + 1),
+                "local_arrival": "2020-01-0{}T09:05:00.000Z".format(leg + 1),
+                "bags_recheck_required": False,
+                "guarantee": leg > 0,
+            }
+            for leg in range(3)
+        ],
+        "deep_link": "https://www.kiwi.com/deep?from=PRG&to=BCN&booking_token="
+        + "x" * 180,
+    }
+
+
+PAYLOADS = {
+    "refusal": {"message": "Invalid User-Agent: does not comply with KW-RFC-22"},
+    "record": itinerary(0),
+    "search": {"currency": "EUR", "data": [itinerary(i) for i in range(200)]},
+}
+
+
+def main():
+    for name, payload in sorted(PAYLOADS.items()):
+        text = serialization.dumps(payload)
+        data = text.encode("utf-8")
+        print("{} ({} bytes)".format(name, len(data)))
+        number = NUMBER if len(data) > 10000 else NUMBER * 100
+        for backend in serialization.BACKENDS:
+            dumps = timeit.timeit(lambda: backend.dumps(payload), number=number)
+            loads = timeit.timeit(lambda: backend.loads(data), number=number)
+            print(
+                "    {:<8} dumps {:>10.1f} us   loads {:>10.1f} us".format(
+                    backend.name, dumps / number * 1e6, loads / number * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Throughput of :func:`kw.platform.utils.validate_many` over millions of strings.
+
+Compares it with creating a :class:`kw.platform.utils.UserAgentValidator` for every
+string, on a log-like stream where a few thousand distinct User-Agents repeat.
+
+Usage::
+
+    poetry run python benchmarks/validate_many.py [number of strings]
+"""
+
+import random
+import sys
+import time
+
+from kw.platform.utils import UserAgentValidator, validate_many
+
+
+def user_agents(count, distinct=5000, seed=22):
+    rng = random.Random(seed)
+    pool = []
+    for i in range(distinct):
+        if i % 4:
+            pool.append("service-{}/{}.{} (Kiwi.com production)".format(i, i % 7, i))
+        else:
+            pool.append("python-requests/2.{}".format(i))
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def measure(name, func, values):
+    before_time = time.time()
+    func(values)
+    seconds = time.time() - before_time
+    print(
+        "{:<20} {:>8.2f} s {:>12.0f} strings/s".format(
+            name, seconds, len(values) / seconds
+        )
+    )
+
+
+def main(count):
+    values = user_agents(count)
+    print("{} strings, {} distinct".format(len(values), len(set(values))))
+    measure("validate_many", validate_many, values)
+    measure(
+        "UserAgentValidator",
+        lambda vs: [UserAgentValidator(v).is_valid for v in vs],
+        values,
+    )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000000)
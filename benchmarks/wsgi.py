@@ -0,0 +1,85 @@
+"""
+Per-request overhead of the WSGI ``user_agent_middleware``.
+
+Compares the plain WSGI middleware reading the environ with the previous
+implementation built on :func:`webob.dec.wsgify`, which is reproduced below.
+Requests are passed straight to the WSGI callables, without any server.
+
+Usage::
+
+    poetry run python benchmarks/wsgi.py
+"""
+
+import timeit
+
+import webob.exc
+from webob.dec import wsgify
+
+from kw.platform import settings, utils, wsgi
+
+NUMBER = 20000
+
+VALID = "mambo/1a (Kiwi.com dev)"
+
+
+def _legacy_validate_user_agent(req, app):
+    user_agent = utils.UserAgentValidator(req.user_agent)
+    utils.record_validation(user_agent)
+    if user_agent.restrict:
+        message = user_agent.settings.restrict_user_agent_message
+        return webob.exc.HTTPBadRequest(message)
+    return app
+
+
+#: ``user_agent_middleware`` before it stopped using webob.
+legacy_user_agent_middleware = wsgify.middleware(_legacy_validate_user_agent)
+
+
+def simple_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"OK"]
+
+
+def start_response(status, headers, exc_info=None):
+    return lambda data: None
+
+
+def environ(user_agent):
+    return {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": "/",
+        "HTTP_USER_AGENT": user_agent,
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.url_scheme": "http",
+    }
+
+
+def per_request(app, user_agent):
+    def call():
+        for _ in app(environ(user_agent), start_response):
+            pass
+
+    return timeit.timeit(call, number=NUMBER) / NUMBER * 1e6
+
+
+def main():
+    apps = [
+        ("no middleware", simple_app),
+        ("wsgify", legacy_user_agent_middleware(simple_app)),
+        ("plain WSGI", wsgi.user_agent_middleware(simple_app)),
+    ]
+    settings.update(
+        slowdown_datetime="2000-01-01T00:00:00",
+        restrict_datetime="2000-01-02T00:00:00",
+        enable_restriction_of_requests=True,
+    )
+    for case, user_agent in [("valid User-Agent", VALID), ("refused", "invalid")]:
+        print(case)
+        for name, app in apps:
+            print("    {:<14} {:>8.2f} us".format(name, per_request(app, user_agent)))
+
+
+if __name__ == "__main__":
+    main()
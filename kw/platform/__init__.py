@@ -11,7 +11,7 @@ __email__ = "bence@kiwi.com"
 __license__ = "Blue Oak License"
 __copyright__ = "Copyright (c) 2019 Kiwi.com"
 
-from .monkey import patch
+from .monkey import patch, unpatch
 
 
-__all__ = ["patch"]
+__all__ = ["patch", "unpatch"]
@@ -1,10 +1,23 @@
+import abc
 import sys
+import threading
 
 
 PY2 = sys.version_info[0] == 2
 PY35_AND_LESS = sys.version_info[:2] <= (3, 5)
 
 
+if PY2:
+    string_types = (basestring,)  # noqa: F821 pylint: disable=undefined-variable
+
+else:
+    string_types = (str,)
+
+
+#: Base class of abstract classes working on both Python 2 and 3.
+ABC = abc.ABCMeta("ABC", (object,), {"__slots__": ()})
+
+
 if PY35_AND_LESS:
     ModuleNotFoundError = ImportError  # pylint: disable=redefined-builtin
 
@@ -12,4 +25,43 @@ else:
     ModuleNotFoundError = ModuleNotFoundError
 
 
-__all__ = ("ModuleNotFoundError",)
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+
+    class ContextVar(object):
+        """Thread-local replacement of :class:`contextvars.ContextVar`.
+
+        Unlike the real one, values are not isolated between asyncio tasks.
+        """
+
+        _MISSING = object()
+
+        def __init__(self, name, default=_MISSING):
+            self.name = name
+            self._default = default
+            self._local = threading.local()
+
+        def get(self, *default):
+            value = getattr(self._local, "value", self._MISSING)
+            if value is not self._MISSING:
+                return value
+            if default:
+                return default[0]
+            if self._default is not self._MISSING:
+                return self._default
+            raise LookupError(self)
+
+        def set(self, value):
+            token = getattr(self._local, "value", self._MISSING)
+            self._local.value = value
+            return token
+
+        def reset(self, token):
+            if token is self._MISSING:
+                del self._local.value
+            else:
+                self._local.value = token
+
+
+__all__ = ("ABC", "ContextVar", "ModuleNotFoundError", "string_types")
@@ -10,26 +10,52 @@ from ..utils import ensure_module_is_available
 
 required_module = "aiohttp"
 if ensure_module_is_available(required_module):
-    from . import utils, monkey
-    from .middlewares import user_agent_middleware
+    from . import admission, lag, utils, monkey
+    from .lag import LOOP_LAG_KEY, LoopLagMonitor
+    from .middlewares import (
+        adaptive_user_agent_middleware,
+        admission_middleware,
+        compression_middleware,
+        deadline_middleware,
+        profiling_middleware,
+        sunset_middleware,
+        track_loop_lag,
+        user_agent_middleware,
+    )
     from .monkey import (
         construct_user_agent,
         patch,
+        patch_with_deadline,
         patch_with_sentry,
         patch_with_user_agent,
+        unpatch,
     )
-    from .utils import mandatory_user_agent
+    from .utils import mandatory_user_agent, prometheus_handler
     from .session import KiwiClientSession
 
     __all__ = [
+        "adaptive_user_agent_middleware",
+        "admission",
+        "admission_middleware",
+        "compression_middleware",
         "construct_user_agent",
+        "deadline_middleware",
         "patch",
+        "patch_with_deadline",
         "patch_with_sentry",
         "patch_with_user_agent",
         "mandatory_user_agent",
         "monkey",
+        "profiling_middleware",
+        "prometheus_handler",
+        "sunset_middleware",
+        "track_loop_lag",
+        "unpatch",
         "user_agent_middleware",
         "KiwiClientSession",
+        "LOOP_LAG_KEY",
+        "LoopLagMonitor",
+        "lag",
         "utils",
     ]
 else:
@@ -0,0 +1,130 @@
+"""
+Admission Control
+=================
+"""
+
+import asyncio
+import collections
+import time
+
+from .. import counters, metrics
+
+
+#: Priority of requests with User-Agent compliant with KW-RFC-22.
+COMPLIANT = 0
+
+#: Priority of requests with invalid User-Agent.
+NON_COMPLIANT = 1
+
+_NAMES = {COMPLIANT: "compliant", NON_COMPLIANT: "non_compliant"}
+
+
+class AdmissionRejected(Exception):
+    """The request has not been admitted, the queue is full or the wait timed out.
+
+    :ivar reason: ``queue_full`` or ``timeout``.
+    """
+
+    def __init__(self, reason):
+        super().__init__("Request not admitted: {}".format(reason))
+        self.reason = reason
+
+
+class AdmissionQueue:
+    """Limit of concurrently handled requests with a queue for excess requests.
+
+    Waiting requests are admitted in the order of their priority, requests from
+    compliant callers first, then requests with invalid User-Agent. Each priority
+    has its own limit of waiting requests and its own timeout.
+
+    :param max_concurrency: Maximum number of requests handled at once.
+    :param compliant_queue: (optional) maximum number of waiting compliant
+        requests, ``100`` by default.
+    :param non_compliant_queue: (optional) maximum number of waiting non-compliant
+        requests, ``10`` by default.
+    :param compliant_timeout: (optional) seconds a compliant request waits,
+        ``5`` by default.
+    :param non_compliant_timeout: (optional) seconds a non-compliant request
+        waits, ``1`` by default.
+    """
+
+    def __init__(
+        self,
+        max_concurrency,
+        compliant_queue=100,
+        non_compliant_queue=10,
+        compliant_timeout=5.0,
+        non_compliant_timeout=1.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.limits = {COMPLIANT: compliant_queue, NON_COMPLIANT: non_compliant_queue}
+        self.timeouts = {
+            COMPLIANT: compliant_timeout,
+            NON_COMPLIANT: non_compliant_timeout,
+        }
+        self.in_flight = 0
+        self._waiters = {
+            COMPLIANT: collections.deque(),
+            NON_COMPLIANT: collections.deque(),
+        }
+
+    def queued(self, priority=None):
+        """Return the number of waiting requests, of the priority if provided."""
+        if priority is not None:
+            return len(self._waiters[priority])
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def acquire(self, priority):
+        """Wait until the request can be handled.
+
+        :param priority: :obj:`COMPLIANT` or :obj:`NON_COMPLIANT`.
+        :raises AdmissionRejected: If the queue of the priority is full or the wait
+            timed out.
+        """
+        if self.in_flight < self.max_concurrency and not self.queued():
+            self.in_flight += 1
+            return
+
+        waiters = self._waiters[priority]
+        if len(waiters) >= self.limits[priority]:
+            self._reject(priority, "queue_full")
+
+        waiter = asyncio.get_event_loop().create_future()
+        waiters.append(waiter)
+        before_time = time.time()
+        try:
+            await asyncio.wait_for(waiter, self.timeouts[priority])
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot has been handed over right before the cancellation
+                self.release()
+            else:
+                self._remove(waiters, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(priority, "timeout")
+            raise
+        finally:
+            metrics.observe("admission.wait_seconds", time.time() - before_time)
+
+    def release(self):
+        """Hand the slot of a finished request over to the next waiting request."""
+        for priority in (COMPLIANT, NON_COMPLIANT):
+            waiters = self._waiters[priority]
+            while waiters:
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    @staticmethod
+    def _remove(waiters, waiter):
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def _reject(priority, reason):
+        counters.incr("admission.{}.{}".format(_NAMES[priority], reason))
+        raise AdmissionRejected(reason)
@@ -0,0 +1,192 @@
+"""
+Event Loop Lag
+==============
+"""
+
+import asyncio
+import sys
+import threading
+import traceback
+from bisect import bisect_left
+
+from aiohttp import web
+
+from ..utils import ReportSampler
+
+
+#: Upper bounds of histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+SLOW_CALLBACK = "slow_callback"
+
+
+class LagHistogram:
+    """Histogram of measured lags with fixed buckets.
+
+    :ivar counts: Number of measurements per bucket, the last one counts
+        measurements above the highest bound.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _current_task(loop):
+    current_task = getattr(asyncio, "current_task", None)
+    if current_task is None:  # Python < 3.7
+        current_task = asyncio.Task.current_task
+    try:
+        return current_task(loop)
+    except RuntimeError:
+        return None
+
+
+class LoopLagMonitor:
+    """Measure scheduling lag of the event loop of an application.
+
+    Every ``interval`` seconds the monitor schedules a wake-up and measures how late
+    it happened. The lag is recorded in :attr:`histogram`, stored in :attr:`lag`
+    and passed to all listeners, e.g. :meth:`kw.platform.load.LoadMonitor.record_lag`.
+
+    If ``slow_threshold`` is set, a watchdog thread checks whether the loop is
+    blocked for longer than the threshold. The stack of the code blocking the loop
+    is reported to Sentry, at most once per blocking call, sampled by ``sampler``.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.lag import LoopLagMonitor
+
+        app = web.Application()
+        lag_monitor = LoopLagMonitor(interval=0.5, slow_threshold=0.2)
+        lag_monitor.setup(app)
+
+    :param interval: (optional) seconds between measurements, ``0.5`` by default.
+    :param slow_threshold: (optional) seconds after which a blocked loop is
+        reported, :obj:`None` (disabled) by default.
+    :param buckets: (optional) upper bounds of histogram buckets in seconds.
+    :param sampler: (optional) :class:`kw.platform.utils.ReportSampler` for reports
+        of a blocked loop, reports 10 % of them by default.
+    """
+
+    def __init__(
+        self, interval=0.5, slow_threshold=None, buckets=DEFAULT_BUCKETS, sampler=None
+    ):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.histogram = LagHistogram(buckets)
+        self.sampler = sampler or ReportSampler(rates=0.1)
+        #: Latest measured lag in seconds.
+        self.lag = 0.0
+        self._listeners = []
+        self._loop = None
+        self._loop_thread_id = None
+        self._wake_up_at = None
+        self._reported = False
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def add_listener(self, listener):
+        """Call ``listener`` with every measured lag in seconds."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def setup(self, app):
+        """Run the monitor while the application is running.
+
+        :type app: :class:`aiohttp.web.Application`
+        """
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+
+    def record(self, lag):
+        self.lag = lag
+        self.histogram.observe(lag)
+        for listener in self._listeners:
+            listener(lag)
+
+    async def _on_startup(self, app):
+        self.start()
+
+    async def _on_cleanup(self, app):
+        self.stop()
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._measure())
+        if self.slow_threshold is not None:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="kw-loop-lag-watchdog"
+            )
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _measure(self):
+        while True:
+            before_time = self._loop.time()
+            self._wake_up_at = before_time + self.interval
+            await asyncio.sleep(self.interval)
+            self._wake_up_at = None
+            self._reported = False
+            self.record(max(self._loop.time() - before_time - self.interval, 0.0))
+
+    def _watch(self):
+        while not self._stopped.wait(self.slow_threshold / 2):
+            self.check_blocked()
+
+    def check_blocked(self):
+        """Report the stack of the event loop thread if the loop is blocked.
+
+        :return: Whether the blocked loop has been reported.
+        """
+        wake_up_at = self._wake_up_at
+        if wake_up_at is None or self._reported:
+            return False
+
+        blocked_for = self._loop.time() - wake_up_at
+        if blocked_for < self.slow_threshold:
+            return False
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return False
+
+        self._reported = True
+        self.sampler.sample(
+            SLOW_CALLBACK,
+            "Event loop blocked for more than {:.3f}s by {!r}:\n{}".format(
+                blocked_for,
+                _current_task(self._loop),
+                "".join(traceback.format_stack(frame)),
+            ),
+            level="warning",
+        )
+        return True
+
+
+try:
+    #: Key of the :class:`LoopLagMonitor` of an application created by
+    #: :func:`kw.platform.aiohttp.middlewares.track_loop_lag`.
+    LOOP_LAG_KEY = web.AppKey("kw_platform_loop_lag", LoopLagMonitor)
+except AttributeError:  # aiohttp < 3.9
+    LOOP_LAG_KEY = "kw_platform_loop_lag"
@@ -9,7 +9,18 @@ import time
 
 from aiohttp import web
 
-from .. import settings, utils
+from .. import counters, deadline, profiling, serialization, settings, slowdown, utils
+from . import admission
+from .lag import LOOP_LAG_KEY, LoopLagMonitor
+from .utils import add_headers, refusal_response
+
+
+# Keys of the request shared by the User-Agent and admission middlewares
+_USER_AGENT = "kw_user_agent"
+_ADMISSION_WAIT = "kw_admission_wait"
+
+# Stored under _USER_AGENT for requests skipping the validation
+_BYPASSED = object()
 
 
 @web.middleware
@@ -39,18 +50,344 @@ async def user_agent_middleware(request, handler):
         (in the time frame when requests with invalid user-agent are being delayed).
         This can increase busyness and overload a service.
     """
-    user_agent = utils.UserAgentValidator(request.headers.get("User-Agent"))
+    user_agent = utils.validate_request(
+        request.method, request.path, request.headers.get("User-Agent")
+    )
+    if user_agent is None:
+        request[_USER_AGENT] = _BYPASSED
+        return await handler(request)
+    request[_USER_AGENT] = user_agent
+    return await _validate_user_agent(request, handler, user_agent)
+
 
+async def _validate_user_agent(request, handler, user_agent, monitor=None):
     if user_agent.restrict:
-        return web.json_response(
-            status=400, data={"message": settings.KIWI_RESTRICT_USER_AGENT_MESSAGE}
-        )
+        return refusal_response(user_agent.settings)
+
+    delay_before = slowdown.delays_before_handler()
+    if delay_before:
+        route = _route_key(request)
+        if user_agent.slowdown:
+            delay = slowdown.estimate_delay(route)
+            slowdown.record_delay(delay)
+            await asyncio.sleep(delay)
 
     before_time = time.time()
-    response = await handler(request)
-    request_duration = time.time() - before_time
+    if monitor is not None:
+        monitor.request_started()
+    try:
+        response = await handler(request)
+    finally:
+        request_duration = time.time() - before_time
+        if monitor is not None:
+            monitor.request_finished(request_duration)
+    # Waiting for an admission slot is not a part of the handler's duration
+    request_duration -= request.get(_ADMISSION_WAIT, 0.0)
+
+    if delay_before:
+        slowdown.durations.record(route, request_duration)
+    elif user_agent.slowdown:
+        size = response.content_length or 0
+        if slowdown.held_bytes.acquire(size):
+            slowdown.record_delay(request_duration)
+            try:
+                await asyncio.sleep(request_duration)
+            finally:
+                slowdown.held_bytes.release(size)
+        else:
+            counters.incr("user_agent.slowdown_skipped")
+
+    return response
+
+
+def _route_key(request):
+    resource = request.match_info.route.resource
+    path = request.path if resource is None else resource.canonical
+    return "{} {}".format(request.method, path)
+
+
+def adaptive_user_agent_middleware(monitor):
+    """Create a middleware validating User-Agent header based on server load.
+
+    Works as :func:`user_agent_middleware`, except requests with invalid User-Agent
+    header are slowed down or refused only when the load tracked by the monitor
+    crosses its thresholds, the dates from settings are not used. Requests handled
+    by the middleware are recorded in the monitor.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.middlewares import (
+            adaptive_user_agent_middleware,
+            track_loop_lag,
+        )
+        from kw.platform.load import LoadMonitor
+
+        monitor = LoadMonitor(restrict_in_flight=100, slowdown_lag=0.1)
+        app = web.Application(middlewares=[adaptive_user_agent_middleware(monitor)])
+        track_loop_lag(app, monitor)
+
+    :param monitor: Monitor of the server load.
+    :type monitor: :class:`kw.platform.load.LoadMonitor`
+    """
+
+    @web.middleware
+    async def middleware(request, handler):
+        user_agent = utils.validate_request(
+            request.method, request.path, request.headers.get("User-Agent"), monitor
+        )
+        if user_agent is None:
+            request[_USER_AGENT] = _BYPASSED
+            return await handler(request)
+        request[_USER_AGENT] = user_agent
+        return await _validate_user_agent(request, handler, user_agent, monitor)
+
+    return middleware
+
+
+def admission_middleware(queue):
+    """Create a middleware limiting concurrently handled requests.
+
+    Excess requests wait in the queue, requests with User-Agent compliant with
+    KW-RFC-22 are admitted before requests with invalid User-Agent. Requests which
+    do not fit into the queue or wait too long are refused with ``HTTP 503``.
+    Requests skipping the User-Agent validation, e.g. health checks, skip the queue
+    as well, see :mod:`kw.platform.bypass`.
+
+    Put the middleware after :func:`user_agent_middleware`, so the slot is taken
+    only while the handler runs and requests being slowed down do not occupy it.
+    The outcome of the validation is then reused, the User-Agent header is not
+    validated twice, and the time spent in the queue is excluded from the delay
+    of slowed down requests and from the durations of routes used in the
+    :obj:`kw.platform.slowdown.BEFORE` mode.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.admission import AdmissionQueue
+        from kw.platform.aiohttp.middlewares import (
+            admission_middleware,
+            user_agent_middleware,
+        )
+
+        queue = AdmissionQueue(max_concurrency=50, non_compliant_timeout=0.5)
+        app = web.Application(
+            middlewares=[user_agent_middleware, admission_middleware(queue)]
+        )
+
+    :param queue: Queue of the requests.
+    :type queue: :class:`kw.platform.aiohttp.admission.AdmissionQueue`
+    """
+
+    @web.middleware
+    async def middleware(request, handler):
+        user_agent = request.get(_USER_AGENT)
+        if user_agent is None:
+            # Used without the User-Agent middleware, which counts bypassed requests
+            user_agent = _validate_for_admission(request)
+        if user_agent is _BYPASSED:
+            return await handler(request)
+
+        if user_agent.is_valid:
+            priority = admission.COMPLIANT
+        else:
+            priority = admission.NON_COMPLIANT
+
+        before_time = time.time()
+        try:
+            await queue.acquire(priority)
+        except admission.AdmissionRejected:
+            return web.json_response(
+                status=503,
+                data={"message": "Service overloaded, try again later"},
+                dumps=serialization.dumps,
+            )
+        request[_ADMISSION_WAIT] = time.time() - before_time
+        try:
+            return await handler(request)
+        finally:
+            queue.release()
+
+    return middleware
+
+
+def _validate_for_admission(request):
+    start = profiling.clock() if profiling.enabled else None
+    try:
+        header = request.headers.get("User-Agent")
+        if utils.is_bypassed(request.method, request.path, header, count=False):
+            return _BYPASSED
+        return utils.UserAgentValidator(header)
+    finally:
+        if start is not None:
+            profiling.add(profiling.VALIDATE, profiling.clock() - start)
+
+
+def track_loop_lag(app, monitor, interval=0.5):
+    """Feed the lag of the event loop to the load monitor while the app is running.
+
+    The lag monitor is stored in the app under
+    :obj:`kw.platform.aiohttp.lag.LOOP_LAG_KEY`. For more control over
+    the measurement, use :class:`kw.platform.aiohttp.lag.LoopLagMonitor` directly.
+
+    :param app: Application to track.
+    :type app: :class:`aiohttp.web.Application`
+    :param monitor: Monitor of the server load.
+    :type monitor: :class:`kw.platform.load.LoadMonitor`
+    :param interval: (optional) seconds between measurements, ``0.5`` by default.
+    :rtype: :class:`kw.platform.aiohttp.lag.LoopLagMonitor`
+    """
+    lag_monitor = LoopLagMonitor(interval=interval)
+    lag_monitor.add_listener(monitor.record_lag)
+    lag_monitor.setup(app)
+    app[LOOP_LAG_KEY] = lag_monitor
+    return lag_monitor
+
+
+def sunset_middleware(registry):
+    """Create a middleware adding the ``Sunset`` HTTP header to deprecated routes.
+
+    Routes are looked up in the registry by the canonical path of their resource,
+    e.g. ``/users/{id}``. The headers are also added to HTTP exceptions raised
+    by the handler, e.g. :class:`aiohttp.web.HTTPGone`.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.middlewares import sunset_middleware
+        from kw.platform.utils import SunsetRegistry
+
+        sunsets = SunsetRegistry()
+        sunsets.register("/users/{id}", when=datetime(2020, 8, 1, 10, 0, 0))
+
+        app = web.Application(middlewares=[sunset_middleware(sunsets)])
+
+    :param registry: Registry of deprecated routes.
+    :type registry: :class:`kw.platform.utils.SunsetRegistry`
+    """
+
+    def add_sunset(request, response):
+        resource = request.match_info.route.resource
+        if resource is not None:
+            headers = registry.get(resource.canonical)
+            if headers:
+                add_headers(response, headers)
+        return response
+
+    @web.middleware
+    async def middleware(request, handler):
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            # Deprecated routes often answer with 404 or 410 by raising
+            add_sunset(request, e)
+            raise
+        return add_sunset(request, response)
+
+    return middleware
+
+
+@web.middleware
+async def deadline_middleware(request, handler):
+    """Set the deadline of the request for outgoing requests made by the handler.
+
+    The budget is read from the header :obj:`settings.KIWI_DEADLINE_HEADER`,
+    :obj:`settings.KIWI_DEFAULT_REQUEST_BUDGET` is used if it is missing.
+    See :mod:`kw.platform.deadline`.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.middlewares import deadline_middleware
+
+        app = web.Application(middlewares=[deadline_middleware])
+    """
+    seconds = deadline.budget_from_header(
+        request.headers.get(settings.KIWI_DEADLINE_HEADER)
+    )
+    token = deadline.set_deadline(seconds)
+    try:
+        return await handler(request)
+    finally:
+        deadline.reset_deadline(token)
+
+
+def compression_middleware(threshold=1024):
+    """Create a middleware compressing responses larger than the threshold.
+
+    Responses are compressed with ``gzip``, or ``deflate`` if the client does not
+    accept ``gzip``, see :meth:`aiohttp.web.StreamResponse.enable_compression`.
+    Compressed request bodies are decoded by :mod:`aiohttp` itself. Streamed
+    responses and responses with ``Content-Encoding`` already set are left
+    untouched.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.middlewares import compression_middleware
+
+        app = web.Application(middlewares=[compression_middleware(threshold=2048)])
+
+    :param threshold: (optional) minimum size of compressed bodies in bytes,
+        ``1024`` by default.
+    """
+
+    @web.middleware
+    async def middleware(request, handler):
+        response = await handler(request)
+
+        if (
+            isinstance(response, web.Response)
+            and not response.prepared
+            and isinstance(response.body, bytes)
+            and len(response.body) >= threshold
+            and "Content-Encoding" not in response.headers
+        ):
+            accepted = request.headers.get("Accept-Encoding", "").lower()
+            for coding in (web.ContentCoding.gzip, web.ContentCoding.deflate):
+                if coding.value in accepted:
+                    response.enable_compression(coding)
+                    break
+
+        return response
+
+    return middleware
+
+
+@web.middleware
+async def profiling_middleware(request, handler):
+    """Send time spent inside the library in the ``Server-Timing`` header.
+
+    Does nothing unless the profiling is enabled, see :mod:`kw.platform.profiling`.
+    Put the middleware first, so the time of other middlewares is included.
+
+    Usage::
+
+        from aiohttp import web
+
+        from kw.platform.aiohttp.middlewares import (
+            profiling_middleware,
+            user_agent_middleware,
+        )
+
+        app = web.Application(
+            middlewares=[profiling_middleware, user_agent_middleware]
+        )
+    """
+    if not profiling.enabled:
+        return await handler(request)
 
-    if user_agent.slowdown:
-        await asyncio.sleep(request_duration)
+    token = profiling.start_request()
+    try:
+        response = await handler(request)
+    finally:
+        timings = profiling.finish_request(token)
 
+    if timings and not response.prepared:
+        add_headers(response, [("Server-Timing", profiling.server_timing(timings))])
     return response
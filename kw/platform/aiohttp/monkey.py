@@ -4,23 +4,30 @@ Monkey Patching
 """
 
 import aiohttp
-import wrapt
 
 from .. import wrappers
-from ..utils import construct_user_agent, report_to_sentry
+from ..utils import construct_user_agent
+from .session import _apply_deadline
 
 
-def _add_sentry_handler(sunset_header=True, deprecated_usage_header=True):
-    async def _check_headers(func, instance, args, kwargs):
+class AsyncInterceptor(wrappers.Interceptor):
+    """Interceptor of coroutine functions.
+
+    Works as :class:`kw.platform.wrappers.Interceptor`, post-response hooks are
+    called with the awaited result.
+    """
+
+    async def __call__(self, func, instance, args, kwargs):
+        for hook in self._pre_hooks:
+            hook(instance, kwargs)
         response = await func(*args, **kwargs)
-        report_to_sentry(
-            response,
-            sunset_header=sunset_header,
-            deprecated_usage_header=deprecated_usage_header,
-        )
+        for hook in self._post_hooks:
+            hook(instance, response)
         return response
 
-    return _check_headers
+
+#: Interceptor of :meth:`aiohttp.ClientSession._request` running hooks of all patches.
+interceptor = AsyncInterceptor("aiohttp", "ClientSession._request")
 
 
 def patch_with_user_agent(user_agent=None):
@@ -36,12 +43,11 @@ def patch_with_user_agent(user_agent=None):
     if user_agent is None:
         user_agent = construct_user_agent
 
-    wrapt.wrap_function_wrapper(
-        "aiohttp", "ClientSession._request", wrappers.add_user_agent(user_agent)
-    )
+    interceptor.add_hook("user_agent", pre=wrappers.user_agent_hook(user_agent))
+    interceptor.patch()
 
 
-def patch_with_sentry(sunset_header=True, deprecated_usage_header=True):
+def patch_with_sentry(sunset_header=True, deprecated_usage_header=True, sampler=None):
     """Patch :meth:`aiohttp.ClientSession._request` to create events in Sentry.
 
     If the HTTP response contains, for example, the ``Sunset`` HTTP header,
@@ -57,14 +63,31 @@ def patch_with_sentry(sunset_header=True, deprecated_usage_header=True):
         header, :obj:`True` by default.
     :param deprecated_usage_header: (optional) Whether to report the presence of the
         ``Deprecated-Usage`` header, :obj:`True` by default.
+    :param sampler: (optional) :class:`kw.platform.utils.ReportSampler` deciding
+        which events are sent to Sentry, :obj:`kw.platform.utils.report_sampler`
+        by default.
     """
-    wrapt.wrap_function_wrapper(
-        "aiohttp",
-        "ClientSession._request",
-        _add_sentry_handler(
-            sunset_header=sunset_header, deprecated_usage_header=deprecated_usage_header
+    interceptor.add_hook(
+        "sentry",
+        post=wrappers.sentry_hook(
+            sunset_header=sunset_header,
+            deprecated_usage_header=deprecated_usage_header,
+            sampler=sampler,
         ),
     )
+    interceptor.patch()
+
+
+def patch_with_deadline():
+    """Patch :meth:`aiohttp.ClientSession._request` to respect the request deadline.
+
+    Within a deadline set by :mod:`kw.platform.deadline`, the timeout of requests
+    is limited to the remaining budget, the budget is forwarded in the deadline
+    header and :exc:`kw.platform.deadline.DeadlineExceeded` is raised without
+    sending the request once the budget is exhausted.
+    """
+    interceptor.add_hook("deadline", pre=_apply_deadline)
+    interceptor.patch()
 
 
 def patch():
@@ -74,6 +97,7 @@ def patch():
 
     * :func:`kw.platform.aiohttp.patch.patch_with_user_agent`
     * :func:`kw.platform.aiohttp.patch.patch_with_sentry`
+    * :func:`kw.platform.aiohttp.patch.patch_with_deadline`
     """
     if getattr(aiohttp, "__kiwi_platform_patch", False):
         # Already patched, skip
@@ -81,6 +105,17 @@ def patch():
 
     patch_with_user_agent()
     patch_with_sentry()
+    patch_with_deadline()
 
     # Mark module as patched
     setattr(aiohttp, "__kiwi_platform_patch", True)
+
+
+def unpatch():
+    """Remove all patches of :mod:`aiohttp` module.
+
+    Restores the original :meth:`aiohttp.ClientSession._request`.
+    """
+    interceptor.unpatch()
+    if hasattr(aiohttp, "__kiwi_platform_patch"):
+        delattr(aiohttp, "__kiwi_platform_patch")
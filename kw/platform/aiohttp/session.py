@@ -3,13 +3,148 @@ Session
 =======
 """
 
+import collections
+import functools
 import warnings
 
 import aiohttp
+from multidict import CIMultiDict
 
+from .. import serialization
+from ..compression import accept_encoding, compress_request
+from ..deadline import apply_deadline
+from ..streaming import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_RECORD_SIZE,
+    JSONArrayDecoder,
+    NDJSONDecoder,
+)
 from ..utils import add_user_agent_header, construct_user_agent, report_to_sentry
 
 
+try:
+    from aiohttp.compression_utils import HAS_BROTLI
+except ImportError:  # aiohttp < 3.9
+    from aiohttp.http_parser import HAS_BROTLI
+
+try:
+    from aiohttp.compression_utils import HAS_ZSTD
+except ImportError:  # aiohttp < 3.12
+    HAS_ZSTD = False
+
+#: Value of the ``Accept-Encoding`` header with encodings :mod:`aiohttp` can decode.
+ACCEPT_ENCODING = accept_encoding(
+    ["gzip", "deflate"]
+    + (["br"] if HAS_BROTLI else [])
+    + (["zstd"] if HAS_ZSTD else [])
+)
+
+
+def limit_client_timeout(timeout, seconds, default=None):
+    """Limit :mod:`aiohttp` timeout to the remaining budget.
+
+    :param timeout: Timeout of the request, :class:`aiohttp.ClientTimeout`
+        or seconds.
+    :param seconds: Remaining budget in seconds.
+    :param default: (optional) timeout used if the request has none,
+        usually the timeout of the session.
+    :rtype: :class:`aiohttp.ClientTimeout`
+    """
+    if timeout is None:
+        timeout = default
+    if timeout is None:
+        return aiohttp.ClientTimeout(total=seconds)
+    if not isinstance(timeout, aiohttp.ClientTimeout):
+        return aiohttp.ClientTimeout(total=min(timeout, seconds))
+    return aiohttp.ClientTimeout(
+        total=seconds if timeout.total is None else min(timeout.total, seconds),
+        connect=timeout.connect,
+        sock_read=timeout.sock_read,
+        sock_connect=timeout.sock_connect,
+    )
+
+
+def _apply_deadline(session, kwargs):
+    default = getattr(session, "timeout", None)
+    apply_deadline(kwargs, functools.partial(limit_client_timeout, default=default))
+
+
+class KiwiClientResponse(aiohttp.ClientResponse):
+    """Response parsing JSON with :mod:`kw.platform.serialization`."""
+
+    async def json(self, *, encoding=None, loads=None, content_type="application/json"):
+        """Read and decode the JSON body of the response.
+
+        Works as :meth:`aiohttp.ClientResponse.json`, the body is parsed by
+        :func:`kw.platform.serialization.loads` by default.
+        """
+        if loads is None:
+            loads = serialization.loads
+        return await super().json(
+            encoding=encoding, loads=loads, content_type=content_type
+        )
+
+
+class RecordStream(object):
+    """Asynchronous iterator over records decoded from a streamed response.
+
+    Created by :meth:`KiwiClientSession.stream_ndjson` and
+    :meth:`KiwiClientSession.stream_json_array`. The request is sent on the first
+    iteration and the response is released once all records are read. Use the
+    stream as a context manager to release the response when the iteration
+    stops early.
+
+    Usage::
+
+        async with client.stream_ndjson("GET", url) as bookings:
+            async for booking in bookings:
+                process(booking)
+    """
+
+    def __init__(self, request, decoder, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._request = request
+        self._decoder = decoder
+        self._chunk_size = chunk_size
+        self._response = None
+        self._records = collections.deque()
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            if self._response is None:
+                self._response = await self._request()
+                self._response.raise_for_status()
+
+            while not self._records:
+                if self._done:
+                    raise StopAsyncIteration
+                chunk = await self._response.content.read(self._chunk_size)
+                if chunk:
+                    self._records.extend(self._decoder.feed(chunk))
+                else:
+                    self._records.extend(self._decoder.close())
+                    self._done = True
+        except BaseException:
+            self.close()
+            raise
+
+        return self._records.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        """Release the response."""
+        if self._response is not None:
+            self._response.release()
+
+
 with warnings.catch_warnings():
     # Ignore aiohttp warning discouraging inheritance until there is a better
     # way to do this. See https://github.com/aio-libs/aiohttp/issues/3695
@@ -24,11 +159,111 @@ with warnings.catch_warnings():
 
             async with KiwiClientSession() as client:
                 await client.get('https://kiwi.com')
+
+        Within a deadline set by :mod:`kw.platform.deadline`, the timeout of
+        requests is limited to the remaining budget, which is forwarded in the
+        deadline header.
+
+        Responses are requested in the best encoding :mod:`aiohttp` can decode,
+        request bodies larger than :obj:`compress_threshold` are gzipped,
+        see :mod:`kw.platform.compression`.
+
+        Responses are :class:`KiwiClientResponse` and JSON bodies of requests are
+        serialized by :mod:`kw.platform.serialization` unless ``response_class``
+        or ``json_serialize`` are passed to the session.
+
+        Reports to Sentry are sampled by :obj:`sampler`, a
+        :class:`kw.platform.utils.ReportSampler` which can be overridden
+        in a subclass.
         """
 
+        #: Sampler of events reported to Sentry,
+        #: :obj:`kw.platform.utils.report_sampler` if :obj:`None`.
+        sampler = None
+
+        #: Minimum size of compressed request bodies in bytes,
+        #: :obj:`kw.platform.settings.KIWI_COMPRESS_REQUEST_THRESHOLD` if :obj:`None`.
+        compress_threshold = None
+
+        def __init__(self, *args, **kwargs):
+            kwargs.setdefault("response_class", KiwiClientResponse)
+            kwargs.setdefault("json_serialize", serialization.dumps)
+            super().__init__(*args, **kwargs)
+
         async def _request(self, *args, **kwargs):
-            headers = kwargs.setdefault("headers", {})
+            _apply_deadline(self, kwargs)
+            compress_request(
+                kwargs, self.compress_threshold, dumps=self._json_serialize
+            )
+            # Copied, so a headers dict shared by several requests is left untouched
+            headers = kwargs["headers"] = CIMultiDict(kwargs.get("headers") or {})
+            if not ("Accept-Encoding" in self.headers or "Accept-Encoding" in headers):
+                headers["Accept-Encoding"] = ACCEPT_ENCODING
             add_user_agent_header(headers, construct_user_agent)
             response = await super()._request(*args, **kwargs)
-            report_to_sentry(response, sunset_header=True, deprecated_usage_header=True)
+            report_to_sentry(
+                response,
+                sunset_header=True,
+                deprecated_usage_header=True,
+                sampler=self.sampler,
+            )
             return response
+
+        def stream_ndjson(
+            self,
+            method,
+            url,
+            *,
+            max_record_size=DEFAULT_MAX_RECORD_SIZE,
+            max_body_size=None,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            **kwargs
+        ):
+            """Iterate over JSON lines of the response without reading it whole.
+
+            Responses with an error status raise
+            :exc:`aiohttp.ClientResponseError`. See :mod:`kw.platform.streaming`.
+
+            Usage::
+
+                async with client.stream_ndjson("GET", url) as bookings:
+                    async for booking in bookings:
+                        process(booking)
+
+            :param method: HTTP method.
+            :param url: URL of the request.
+            :param max_record_size: (optional) maximum size of a line in bytes,
+                :obj:`kw.platform.streaming.DEFAULT_MAX_RECORD_SIZE` by default.
+            :param max_body_size: (optional) maximum size of the body in bytes,
+                no limit by default.
+            :param chunk_size: (optional) size of chunks read from the response.
+            :param kwargs: Other arguments of :meth:`request`.
+            :rtype: :class:`RecordStream`
+            """
+            return RecordStream(
+                functools.partial(self._request, method, url, **kwargs),
+                NDJSONDecoder(max_record_size, max_body_size),
+                chunk_size,
+            )
+
+        def stream_json_array(
+            self,
+            method,
+            url,
+            *,
+            max_record_size=DEFAULT_MAX_RECORD_SIZE,
+            max_body_size=None,
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            **kwargs
+        ):
+            """Iterate over items of a JSON array without reading the response whole.
+
+            Works as :meth:`stream_ndjson`, ``max_record_size`` limits size of items.
+
+            :rtype: :class:`RecordStream`
+            """
+            return RecordStream(
+                functools.partial(self._request, method, url, **kwargs),
+                JSONArrayDecoder(max_record_size, max_body_size),
+                chunk_size,
+            )
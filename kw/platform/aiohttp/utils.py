@@ -9,8 +9,42 @@ from functools import wraps
 
 from aiohttp import web
 
-from .. import settings
-from ..utils import UserAgentValidator, httpdate
+from .. import metrics, slowdown
+from ..utils import deprecations, refusal, render_sunset_headers, validate_request
+
+
+def refusal_response(snapshot=None):
+    """Create the response to a request refused because of invalid User-Agent.
+
+    The body and headers are pre-serialized, see :func:`kw.platform.utils.refusal`.
+
+    :param snapshot: (optional) :class:`kw.platform.settings.Snapshot` with the
+        message, the current settings by default.
+    :rtype: :class:`aiohttp.web.Response`
+    """
+    cached = refusal(snapshot)
+    response = web.Response(status=400, body=cached.body, headers=cached.headers)
+    if cached.close:
+        response.force_close()
+    return response
+
+
+def add_headers(response, headers):
+    """Add rendered headers to aiohttp response object.
+
+    The ``Link`` header is appended to the already present one.
+
+    :param response: Response object to update.
+    :type response: :class:`aiohttp.web.Response`
+    :param headers: Iterable of ``(name, value)`` pairs.
+    :rtype: :class:`aiohttp.web.Response`
+    """
+    for name, value in headers:
+        if name == "Link" and response.headers.get("Link"):
+            value = "{},{}".format(response.headers["Link"], value)
+        response.headers[name] = value
+
+    return response
 
 
 def set_sunset(response, when=None, info_url=None):
@@ -24,17 +58,7 @@ def set_sunset(response, when=None, info_url=None):
     :type info_url: str
     :rtype: :class:`aiohttp.web.Response`
     """
-    if info_url:
-        link = '<{}>;rel="sunset"'.format(info_url)
-        response.headers["Link"] = (
-            "{},{}".format(response.headers["Link"], link)
-            if response.headers.get("Link")
-            else link
-        )
-    if when:
-        response.headers["Sunset"] = httpdate(when)
-
-    return response
+    return add_headers(response, render_sunset_headers(when, info_url))
 
 
 def sunset(when=None, info_url=None):
@@ -57,17 +81,66 @@ def sunset(when=None, info_url=None):
     if when is None and info_url is None:
         raise TypeError("function takes at least one argument (0 given)")
 
+    headers = render_sunset_headers(when, info_url)
+
     def wrapper(view):
         @wraps(view)
         async def sunset_view(*args, **kwargs):
             response = await view(*args, **kwargs)
-            return set_sunset(response, when=when, info_url=info_url)
+            return add_headers(response, headers)
 
         return sunset_view
 
     return wrapper
 
 
+def deprecated_usage(message, parameters=(), registry=None, name=None):
+    """A decorator for deprecating views or their parameters.
+
+    Adds the ``Deprecated-Usage`` HTTP header to responses of requests using
+    the deprecated API and counts the calling services, see
+    :class:`kw.platform.utils.DeprecationRegistry`.
+
+    Usage::
+
+        @deprecated_usage("Parameter 'sort' is deprecated", parameters=["sort"])
+        async def users(request):
+            return web.json_response(data=[])
+
+        deprecations.usage()  # [("app.views.users", "mambo", 42, 0)]
+
+    :param message: Value of the ``Deprecated-Usage`` header.
+    :param parameters: (optional) names of deprecated query parameters,
+        the whole view is deprecated if empty.
+    :param registry: (optional) :class:`kw.platform.utils.DeprecationRegistry`,
+        :obj:`kw.platform.utils.deprecations` by default.
+    :param name: (optional) key of the view in the registry, the module and the
+        qualified name of the view function by default, e.g. ``app.views.users``.
+    :raises ValueError: If the key is already registered.
+    """
+    registry = deprecations if registry is None else registry
+
+    def wrapper(view):
+        key = name or "{}.{}".format(view.__module__, view.__qualname__)
+        if key in registry:
+            raise ValueError("View {!r} is already registered".format(key))
+        registry.register(key, message, parameters)
+
+        @wraps(view)
+        async def deprecated_view(request, *args, **kwargs):
+            response = await view(request, *args, **kwargs)
+            headers = registry.match(
+                key, request.query, request.headers.get("User-Agent")
+            )
+            if headers:
+                add_headers(response, headers)
+            return response
+
+        return deprecated_view
+
+    return wrapper
+
+
 def mandatory_user_agent(handler):
     """A decorator for the validation that the request to the decorated handler
     is compliant with KW-RFC-22. See
@@ -83,19 +156,43 @@ def mandatory_user_agent(handler):
 
     @wraps(handler)
     async def wrapped(request, *args, **kwargs):
-        user_agent = UserAgentValidator(request.headers.get("User-Agent"))
+        user_agent = validate_request(
+            request.method, request.path, request.headers.get("User-Agent")
+        )
+        if user_agent is None:
+            return await handler(request, *args, **kwargs)
         if user_agent.restrict:
-            return web.json_response(
-                status=400, data={"message": settings.KIWI_RESTRICT_USER_AGENT_MESSAGE}
-            )
+            return refusal_response(user_agent.settings)
 
         before_time = time.time()
         response = await handler(request, *args, **kwargs)
         request_duration = time.time() - before_time
 
         if user_agent.slowdown:
+            slowdown.record_delay(request_duration)
             await asyncio.sleep(request_duration)
 
         return response
 
     return wrapped
+
+
+def prometheus_handler():
+    """Create a handler exposing the metrics of the library in the Prometheus format.
+
+    See :mod:`kw.platform.metrics`.
+
+    Usage::
+
+        from kw.platform.aiohttp.utils import prometheus_handler
+
+        app.router.add_get("/metrics", prometheus_handler())
+    """
+    metrics.enable()
+
+    async def handler(request):
+        response = web.Response(body=metrics.render_prometheus().encode("utf-8"))
+        response.headers["Content-Type"] = metrics.PROMETHEUS_CONTENT_TYPE
+        return response
+
+    return handler
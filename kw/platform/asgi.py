@@ -0,0 +1,142 @@
+"""
+ASGI
+====
+
+Middlewares for ASGI applications, e.g. built with Starlette or FastAPI.
+
+The middlewares work directly with the ASGI ``scope`` and messages, so they do not
+depend on any framework.
+"""
+
+import asyncio
+import time
+
+from . import slowdown, utils
+
+
+def _get_header(scope, name):
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _encode_headers(refusal):
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in refusal.headers
+    ]
+    if refusal.close:
+        headers.append((b"connection", b"close"))
+    return tuple(headers)
+
+
+_refusal_headers = (None, ())
+
+
+async def _refuse_request(send, snapshot):
+    global _refusal_headers
+    refusal = utils.refusal(snapshot)
+    cached, headers = _refusal_headers
+    if cached is not refusal:
+        headers = _encode_headers(refusal)
+        _refusal_headers = (refusal, headers)
+
+    # Fresh messages, other middlewares may modify them
+    await send({"type": "http.response.start", "status": 400, "headers": list(headers)})
+    await send({"type": "http.response.body", "body": refusal.body})
+
+
+def user_agent_middleware(app):
+    """Validate client's User-Agent header and modify response based on that.
+
+    If the User-Agent header is invalid, there are three possible outcomes:
+
+    1. The current time is less then :obj:`settings.KIWI_REQUESTS_SLOWDOWN_DATETIME`,
+       do nothing in this case.
+    2. The current time is less then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
+       slow down the response twice the normal responce time.
+    3. The current time is more then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
+       refuse the request, return ``HTTP 400`` to the client.
+
+    Usage::
+
+        from starlette.applications import Starlette
+
+        from kw.platform.asgi import user_agent_middleware
+
+        app = user_agent_middleware(Starlette())
+
+    The last message of the response body is held back by :meth:`asyncio.sleep()`
+    when the request is being slowed down, so the worker is not blocked.
+
+    :param app: ASGI application.
+    """
+
+    async def middleware(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+
+        user_agent = utils.validate_request(
+            scope.get("method"), scope["path"], _get_header(scope, b"user-agent")
+        )
+        if user_agent is None:
+            return await app(scope, receive, send)
+        if user_agent.restrict:
+            return await _refuse_request(send, user_agent.settings)
+        if not user_agent.slowdown:
+            return await app(scope, receive, send)
+
+        before_time = time.time()
+
+        async def slowdown_send(message):
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                delay = time.time() - before_time
+                slowdown.record_delay(delay)
+                await asyncio.sleep(delay)
+            await send(message)
+
+        return await app(scope, receive, slowdown_send)
+
+    return middleware
+
+
+def sunset_middleware(app, registry):
+    """Add the ``Sunset`` HTTP header to responses of deprecated routes.
+
+    Routes are looked up in the registry by the ``path`` of the request.
+
+    Usage::
+
+        from kw.platform.asgi import sunset_middleware
+        from kw.platform.utils import SunsetRegistry
+
+        sunsets = SunsetRegistry()
+        sunsets.register("/v1/users", when=datetime(2020, 8, 1, 10, 0, 0))
+
+        app = sunset_middleware(app, sunsets)
+
+    :param app: ASGI application.
+    :param registry: Registry of deprecated routes.
+    :type registry: :class:`kw.platform.utils.SunsetRegistry`
+    """
+
+    async def middleware(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+
+        headers = registry.get_raw(scope["path"])
+        if not headers:
+            return await app(scope, receive, send)
+
+        async def sunset_send(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", ())) + list(headers)
+            await send(message)
+
+        return await app(scope, receive, sunset_send)
+
+    return middleware
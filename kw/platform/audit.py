@@ -0,0 +1,283 @@
+"""
+Audit
+=====
+
+Offline audit of ``KW-RFC-22`` compliance of callers recorded in access logs.
+
+Run it with ``python -m kw.platform.audit``, for example::
+
+    python -m kw.platform.audit --at 2019-08-01T13:00:00 access.log access.log.1.gz
+
+Log files are read line by line, plain files are split into chunks which are
+processed by a pool of processes, gzipped files are processed one per process.
+Every distinct User-Agent is validated only once, by
+:func:`kw.platform.utils.validate_many`.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+from collections import Counter
+from multiprocessing import Pool
+
+from dateutil.parser import parse
+
+from . import settings
+from .utils import validate_many
+
+
+#: Default pattern of the User-Agent in log lines, matches the last quoted field,
+#: as in the combined log format of nginx or Apache.
+DEFAULT_PATTERN = r'"(?P<user_agent>[^"]*)"\s*$'
+
+#: Default size of chunks of plain files processed at once, in bytes.
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _is_gzip(path):
+    with open(path, "rb") as f:
+        return f.read(2) == _GZIP_MAGIC
+
+
+def _read_lines(path, start=None, end=None):
+    """Yield lines starting in the ``[start, end)`` byte range of the file."""
+    if start is None:
+        opener = gzip.open if _is_gzip(path) else open
+        with opener(path, "rb") as f:
+            for line in f:
+                yield line
+        return
+
+    with open(path, "rb") as f:
+        if start:
+            # Skip the line which started in the previous chunk
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line
+
+
+def split_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split a log file into ``(path, start, end)`` tasks.
+
+    Gzipped files can not be split, they are processed as a whole.
+    """
+    if _is_gzip(path):
+        return [(path, None, None)]
+    size = os.path.getsize(path)
+    return [
+        (path, start, min(start + chunk_size, size))
+        for start in range(0, size, chunk_size)
+    ] or [(path, 0, 0)]
+
+
+def count_user_agents(task, pattern=DEFAULT_PATTERN):
+    """Count User-Agent strings in a part of a log file.
+
+    :param task: ``(path, start, end)`` tuple, see :func:`split_file`.
+    :param pattern: Regular expression matching the User-Agent in log lines, either
+        in the ``user_agent`` group or in the first group.
+    :return: Counter of User-Agent strings and the number of lines which did not
+        match the pattern.
+    """
+    regex = re.compile(pattern.encode("utf-8"))
+    group = "user_agent" if "user_agent" in regex.groupindex else 1
+    user_agents = Counter()
+    unmatched = 0
+    for line in _read_lines(*task):
+        match = regex.search(line)
+        if match is None:
+            unmatched += 1
+            continue
+        user_agents[match.group(group)] += 1
+    return user_agents, unmatched
+
+
+def _count_user_agents(args):
+    return count_user_agents(*args)
+
+
+class AuditResult(object):
+    """User-Agent strings found in access logs and their validation.
+
+    :ivar user_agents: Counter of requests per User-Agent string.
+    :ivar unmatched: Number of log lines without User-Agent.
+    """
+
+    def __init__(self, user_agents, unmatched=0):
+        self.user_agents = user_agents
+        self.unmatched = unmatched
+        self.total = sum(user_agents.values())
+        self._valid = {}
+        self._callers = {}
+        results = validate_many(user_agents)
+        for index, user_agent in enumerate(user_agents):
+            valid = results.is_valid(index)
+            self._valid[user_agent] = valid
+            self._callers[user_agent] = results.names[index] if valid else user_agent
+
+    @property
+    def non_compliant(self):
+        return sum(
+            count
+            for user_agent, count in self.user_agents.items()
+            if not self._valid[user_agent]
+        )
+
+    def callers(self):
+        """Return requests per caller.
+
+        Compliant callers are identified by the service name, non-compliant ones
+        by the whole User-Agent.
+
+        :return: List of ``(caller, compliant, non_compliant)`` tuples sorted by
+            the total number of requests.
+        """
+        callers = {}
+        for user_agent, count in self.user_agents.items():
+            counts = callers.setdefault(self._callers[user_agent], [0, 0])
+            counts[0 if self._valid[user_agent] else 1] += count
+        return sorted(
+            ((caller, ok, not_ok) for caller, (ok, not_ok) in callers.items()),
+            key=lambda caller: caller[1] + caller[2],
+            reverse=True,
+        )
+
+    def enforcement(self, when, slowdown_datetime, restrict_datetime):
+        """Return shares of requests which would be slowed down and refused.
+
+        :param when: Datetime of the enforcement.
+        :param slowdown_datetime: Datetime when slowing down of requests starts.
+        :param restrict_datetime: Datetime when refusing of requests starts.
+        :return: Tuple of shares of slowed down and refused requests.
+        """
+        if not self.total or when < slowdown_datetime:
+            return 0.0, 0.0
+        share = float(self.non_compliant) / self.total
+        if when < restrict_datetime:
+            return share, 0.0
+        return 0.0, share
+
+
+def audit(paths, pattern=DEFAULT_PATTERN, chunk_size=DEFAULT_CHUNK_SIZE, jobs=None):
+    """Count and validate User-Agent strings in log files.
+
+    :param paths: Paths to plain or gzipped log files.
+    :param pattern: (optional) regular expression matching the User-Agent,
+        see :func:`count_user_agents`.
+    :param chunk_size: (optional) size of chunks of plain files in bytes.
+    :param jobs: (optional) number of processes, number of CPUs by default.
+        Use ``1`` to process the files in the current process.
+    :rtype: :class:`AuditResult`
+    """
+    tasks = [(task, pattern) for path in paths for task in split_file(path, chunk_size)]
+    user_agents = Counter()
+    unmatched = 0
+
+    if jobs == 1:
+        results = map(_count_user_agents, tasks)
+        pool = None
+    else:
+        pool = Pool(processes=jobs)
+        results = pool.imap_unordered(_count_user_agents, tasks)
+
+    try:
+        for task_user_agents, task_unmatched in results:
+            user_agents.update(task_user_agents)
+            unmatched += task_unmatched
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return AuditResult(
+        Counter(
+            {
+                user_agent.decode("utf-8", "replace"): count
+                for user_agent, count in user_agents.items()
+            }
+        ),
+        unmatched=unmatched,
+    )
+
+
+def _percent(part, total):
+    return 100.0 * part / total if total else 0.0
+
+
+def main(argv=None, stdout=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m kw.platform.audit",
+        description="Audit KW-RFC-22 compliance of callers recorded in access logs.",
+    )
+    parser.add_argument("paths", nargs="+", help="plain or gzipped log files")
+    parser.add_argument(
+        "--pattern",
+        default=DEFAULT_PATTERN,
+        help="regular expression matching the User-Agent in the 'user_agent' group",
+    )
+    parser.add_argument(
+        "--at",
+        action="append",
+        default=[],
+        type=parse,
+        help="datetime to report the share of slowed down and refused requests for",
+    )
+    parser.add_argument(
+        "--slowdown-datetime",
+        type=parse,
+        default=settings.current().slowdown_datetime,
+    )
+    parser.add_argument(
+        "--restrict-datetime",
+        type=parse,
+        default=settings.current().restrict_datetime,
+    )
+    parser.add_argument("--top", type=int, default=50, help="number of callers")
+    parser.add_argument("--jobs", type=int, default=None, help="number of processes")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="size of chunks of plain files in bytes",
+    )
+    args = parser.parse_args(argv)
+
+    result = audit(
+        args.paths, pattern=args.pattern, chunk_size=args.chunk_size, jobs=args.jobs
+    )
+
+    write = (stdout or sys.stdout).write
+    write("Requests: {}\n".format(result.total))
+    write("Lines without User-Agent: {}\n".format(result.unmatched))
+    write(
+        "Non-compliant requests: {} ({:.2f} %)\n".format(
+            result.non_compliant, _percent(result.non_compliant, result.total)
+        )
+    )
+    for when in args.at:
+        slowdown, restrict = result.enforcement(
+            when, args.slowdown_datetime, args.restrict_datetime
+        )
+        write(
+            "At {}: {:.2f} % slowed down, {:.2f} % refused\n".format(
+                when.isoformat(), 100 * slowdown, 100 * restrict
+            )
+        )
+
+    write("\n{:>12} {:>12}  {}\n".format("compliant", "non-compliant", "caller"))
+    for caller, compliant, non_compliant in result.callers()[: args.top]:
+        write("{:>12} {:>12}  {}\n".format(compliant, non_compliant, caller))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
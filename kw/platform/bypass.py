@@ -0,0 +1,140 @@
+"""
+Bypass Rules
+============
+
+Requests which skip the validation of the User-Agent header, e.g. health checks,
+metrics scrapes or internal load balancers.
+
+Rules are configured by :obj:`settings.KIWI_USER_AGENT_BYPASS`, a comma-separated
+list of:
+
+* exact paths, e.g. ``/healthz``,
+* path prefixes ending with ``*``, e.g. ``/metrics/*``,
+* HTTP methods, e.g. ``OPTIONS``,
+* User-Agent prefixes starting with ``ua:``, e.g. ``ua:kube-probe/``.
+
+Usage::
+
+    KIWI_USER_AGENT_BYPASS="/healthz,/metrics/*,OPTIONS,ua:kube-probe/"
+
+The rules are compiled once, a request is matched in time proportional to the
+length of its path and User-Agent header.
+"""
+
+from collections import Counter
+
+from . import counters
+
+
+_END = ""
+_USER_AGENT_PREFIX = "ua:"
+
+
+def _add_to_trie(trie, key, rule):
+    node = trie
+    for char in key:
+        node = node.setdefault(char, {})
+    node[_END] = rule
+
+
+def _longest_prefix(trie, value):
+    """Return the rule of the longest prefix of the value in the trie."""
+    rule = None
+    node = trie
+    for char in value:
+        node = node.get(char)
+        if node is None:
+            break
+        rule = node.get(_END, rule)
+    return rule
+
+
+class BypassRules(object):
+    """Compiled rules of requests skipping the validation of the User-Agent header.
+
+    Numbers of requests matched by each rule are counted in :attr:`hits`.
+
+    :param paths: (optional) exact paths.
+    :param prefixes: (optional) path prefixes.
+    :param methods: (optional) HTTP methods.
+    :param user_agents: (optional) prefixes of User-Agent headers.
+    """
+
+    def __init__(self, paths=(), prefixes=(), methods=(), user_agents=()):
+        self._paths = {path: path for path in paths}
+        self._methods = {method.upper(): method.upper() for method in methods}
+        self._prefixes = {}
+        for prefix in prefixes:
+            _add_to_trie(self._prefixes, prefix, prefix + "*")
+        self._user_agents = {}
+        for user_agent in user_agents:
+            _add_to_trie(self._user_agents, user_agent, _USER_AGENT_PREFIX + user_agent)
+
+        self.rules = (
+            list(paths)
+            + [prefix + "*" for prefix in prefixes]
+            + list(self._methods)
+            + [_USER_AGENT_PREFIX + user_agent for user_agent in user_agents]
+        )
+        #: Number of matched requests per rule.
+        self.hits = Counter()
+
+    @classmethod
+    def parse(cls, value):
+        """Compile rules from a comma-separated list, see :mod:`kw.platform.bypass`.
+
+        :param value: List of rules, e.g. ``"/healthz,/metrics/*,OPTIONS"``.
+        :rtype: :class:`BypassRules`
+        """
+        paths, prefixes, methods, user_agents = [], [], [], []
+        for rule in value.split(","):
+            rule = rule.strip()
+            if not rule:
+                continue
+            if rule.startswith(_USER_AGENT_PREFIX):
+                user_agents.append(rule.replace(_USER_AGENT_PREFIX, "", 1))
+            elif rule.endswith("*"):
+                prefixes.append(rule[:-1])
+            elif rule.startswith("/"):
+                paths.append(rule)
+            else:
+                methods.append(rule)
+        return cls(paths, prefixes, methods, user_agents)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    __nonzero__ = __bool__
+
+    def __str__(self):
+        return ",".join(self.rules)
+
+    def __repr__(self):
+        return "{}.parse({!r})".format(type(self).__name__, str(self))
+
+    def match(self, method, path, user_agent=None, count=True):
+        """Return the rule matching the request.
+
+        Exact paths take precedence over methods, path prefixes and User-Agent
+        prefixes, the longest prefix wins.
+
+        :param method: HTTP method of the request.
+        :param path: Path of the request.
+        :param user_agent: (optional) User-Agent header of the request.
+        :param count: (optional) whether to count the match in :attr:`hits`,
+            ``True`` by default.
+        :return: The matched rule or :obj:`None`.
+        """
+        if not self.rules:
+            return None
+
+        rule = self._paths.get(path) or self._methods.get(method)
+        if rule is None:
+            rule = _longest_prefix(self._prefixes, path)
+        if rule is None and user_agent:
+            rule = _longest_prefix(self._user_agents, user_agent)
+
+        if rule is not None and count:
+            self.hits[rule] += 1
+            counters.incr("user_agent.bypassed")
+        return rule
@@ -0,0 +1,101 @@
+"""
+Compression
+===========
+
+Negotiation of compressed HTTP bodies between services.
+
+:class:`kw.platform.requests.KiwiSession` and
+:class:`kw.platform.aiohttp.KiwiClientSession` advertise in the ``Accept-Encoding``
+header every encoding the installed HTTP library can decode, preferring
+``zstd`` and ``br`` (with ``zstandard`` and ``brotli`` packages installed) over
+``gzip``. Responses are decoded by the library incrementally as they are read, so
+streamed responses keep memory bounded.
+
+Request bodies larger than :obj:`settings.KIWI_COMPRESS_REQUEST_THRESHOLD` bytes
+are sent gzipped by the sessions. For aiohttp servers, see
+:func:`kw.platform.aiohttp.middlewares.compression_middleware`.
+"""
+
+import json
+import zlib
+
+from . import settings
+from ._compat import string_types
+
+
+#: Encodings in the order of preference.
+ENCODINGS = ("zstd", "br", "gzip", "deflate")
+
+#: Compression level of request bodies, a balance between size and CPU cost.
+GZIP_LEVEL = 6
+
+
+def accept_encoding(supported):
+    """Build the ``Accept-Encoding`` header value from the supported encodings.
+
+    :param supported: Names of encodings the client can decode.
+    :return: Encodings ordered by :obj:`ENCODINGS`, e.g. ``"br, gzip, deflate"``.
+    """
+    supported = {encoding.strip().lower() for encoding in supported}
+    return ", ".join(encoding for encoding in ENCODINGS if encoding in supported)
+
+
+def gzip_compress(data, level=GZIP_LEVEL):
+    """Compress the data into the ``gzip`` format.
+
+    :param data: Bytes to compress.
+    :param level: (optional) compression level, :obj:`GZIP_LEVEL` by default.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_request(kwargs, threshold=None, dumps=json.dumps):
+    """Gzip the body of an outgoing request if it is large enough.
+
+    Bodies passed as bytes, text or JSON are compressed, other bodies like forms
+    or files are left untouched, as well as requests with ``Content-Encoding``
+    already set.
+
+    :param kwargs: Keyword arguments of the request, modified in place. The headers
+        are copied, so a headers dict shared by several requests is left untouched.
+    :param threshold: (optional) minimum size of compressed bodies in bytes,
+        :obj:`settings.KIWI_COMPRESS_REQUEST_THRESHOLD` if :obj:`None`.
+    :param dumps: (optional) function serializing the ``json`` argument, which is
+        replaced by serialized ``data`` when compression is enabled.
+    """
+    if threshold is None:
+        threshold = settings.KIWI_COMPRESS_REQUEST_THRESHOLD
+    if threshold is None:
+        return
+
+    headers = kwargs["headers"] = _copy_headers(kwargs.get("headers"))
+    if _has_header(headers, "Content-Encoding"):
+        return
+
+    body = kwargs.get("data")
+    if body is None and kwargs.get("json") is not None:
+        # Serialize only once, the body is sent as data even if not compressed
+        body = dumps(kwargs.pop("json"))
+        if not _has_header(headers, "Content-Type"):
+            headers["Content-Type"] = "application/json"
+    if isinstance(body, string_types) and not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    if body is not None:
+        kwargs["data"] = body
+    if not isinstance(body, bytes) or len(body) < threshold:
+        return
+
+    headers["Content-Encoding"] = "gzip"
+    kwargs["data"] = gzip_compress(body)
+
+
+def _copy_headers(headers):
+    if headers is None:
+        return {}
+    return headers.copy() if hasattr(headers, "copy") else dict(headers)
+
+
+def _has_header(headers, name):
+    name = name.lower()
+    return any(key.lower() == name for key in headers)
@@ -0,0 +1,346 @@
+"""
+Counters
+========
+
+Counters of events observed by the library, e.g. requests with invalid User-Agent
+or reported ``Sunset`` headers.
+
+By default, the counters are kept in memory of each process. Servers which fork
+worker processes, e.g. gunicorn, can switch to :class:`SharedCounters` to aggregate
+the counts across all workers without any external service::
+
+    from kw.platform import counters
+
+    counters.use(counters.SharedCounters("/tmp/kiwi-platform-counters"))
+
+    counters.snapshot()  # {"user_agent.invalid": 42, ...}
+"""
+
+import errno
+import mmap
+import os
+import struct
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class LocalCounters(Counter):
+    """Counters kept in memory of the current process."""
+
+    def incr(self, key, amount=1):
+        self[key] += amount
+
+    def get(self, key, default=0):
+        return super(LocalCounters, self).get(key, default)
+
+    def snapshot(self):
+        return dict(self)
+
+
+_MAGIC = b"KWCNTR01"
+_HEADER = struct.Struct("8sII")
+_VALUE = struct.Struct("q")
+_KEY_SIZE = 64
+
+#: Key counting increments of keys which do not fit into :class:`SharedCounters`.
+DROPPED_KEY = "counters.dropped"
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class SharedCounters(object):
+    """Counters shared by processes through a memory-mapped file.
+
+    The file consists of fixed-size slots, one per worker process. Every process
+    claims its own slot on first use and only ever writes there, so increments do
+    not need any locking between processes. Reads sum the slots of all processes.
+    Slots of dead processes are reused together with their counts, so totals are
+    preserved across restarts of workers.
+
+    The counters can be created before the server forks its workers, each process
+    maps the file and claims its slot lazily after the fork.
+
+    The last key is reserved for :obj:`DROPPED_KEY`, increments of keys which do not
+    fit, either because all other keys are taken or because the key is longer than
+    63 bytes in UTF-8, are counted there instead of failing the request.
+
+    :param path: Path to the file, created if it does not exist.
+    :param max_keys: (optional) maximum number of distinct keys including
+        :obj:`DROPPED_KEY`, ``64`` by default.
+    :param max_workers: (optional) maximum number of processes, ``128`` by default.
+    """
+
+    def __init__(self, path, max_keys=64, max_workers=128):
+        if fcntl is None:
+            raise RuntimeError("SharedCounters are not supported on this platform")
+
+        self.path = path
+        self.max_keys = max_keys
+        self.max_workers = max_workers
+        self._dropped = max_keys - 1
+        self._keys_offset = _HEADER.size
+        self._slots_offset = self._keys_offset + max_keys * _KEY_SIZE
+        self._slot_size = _VALUE.size * (1 + max_keys)
+        self._size = self._slots_offset + max_workers * self._slot_size
+        self._pid = None
+        self._lock = threading.Lock()
+        self._fd = None
+        self._mmap = None
+        self._slot_offset = None
+        self._indexes = {}
+
+    def _attach(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        if self._pid is not None:
+            # The lock might have been held by another thread during fork
+            self._lock = threading.Lock()
+        with self._lock:
+            if self._pid == pid:
+                return
+            if self._mmap is not None:
+                # Copies inherited from the parent process
+                self._mmap.close()
+                os.close(self._fd)
+                self._fd, self._mmap = None, None
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size < self._size:
+                    os.ftruncate(fd, self._size)
+                mm = mmap.mmap(fd, self._size)
+                magic, max_keys, max_workers = _HEADER.unpack_from(mm, 0)
+                if magic != _MAGIC:
+                    _HEADER.pack_into(mm, 0, _MAGIC, self.max_keys, self.max_workers)
+                elif (max_keys, max_workers) != (self.max_keys, self.max_workers):
+                    raise ValueError(
+                        "{!r} has been created with different dimensions".format(
+                            self.path
+                        )
+                    )
+                self._slot_offset = self._claim_slot(mm, pid)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+            self._fd, self._mmap, self._indexes = fd, mm, {}
+            self._pid = pid
+
+    def _claim_slot(self, mm, pid):
+        for slot in range(self.max_workers):
+            offset = self._slots_offset + slot * self._slot_size
+            (slot_pid,) = _VALUE.unpack_from(mm, offset)
+            if slot_pid == 0 or not _is_alive(slot_pid):
+                _VALUE.pack_into(mm, offset, pid)
+                return offset
+        raise ValueError("No free slot in {!r}".format(self.path))
+
+    @contextmanager
+    def _flock(self, operation):
+        # Threads share the lock of the file, so they are serialized by the mutex
+        with self._lock:
+            fcntl.flock(self._fd, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _index(self, key, create=True):
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+
+        encoded = key.encode("utf-8")
+        with self._flock(fcntl.LOCK_EX if create else fcntl.LOCK_SH):
+            if key == DROPPED_KEY:
+                index = self._dropped
+            elif len(encoded) < _KEY_SIZE:
+                index = self._find_key(encoded, create)
+            if index is None:
+                if not create:
+                    return None
+                index = self._dropped
+            if index == self._dropped and create:
+                self._write_key(index, DROPPED_KEY.encode("utf-8"))
+
+        self._indexes[key] = index
+        return index
+
+    def _find_key(self, encoded, create):
+        for index in range(self._dropped):
+            name = self._key_at(index)
+            if name == encoded:
+                return index
+            if not name:
+                if create:
+                    self._write_key(index, encoded)
+                    return index
+                return None
+        return None
+
+    def _write_key(self, index, encoded):
+        """Write the name of a key, the file has to be locked exclusively."""
+        start = self._keys_offset + index * _KEY_SIZE
+        end = start + len(encoded)
+        self._mmap[start:end] = encoded
+
+    def _key_at(self, index):
+        start = self._keys_offset + index * _KEY_SIZE
+        end = start + _KEY_SIZE
+        return self._mmap[start:end].rstrip(b"\0")
+
+    def _keys(self):
+        keys = []
+        with self._flock(fcntl.LOCK_SH):
+            for index in range(self.max_keys):
+                name = self._key_at(index)
+                if name:
+                    keys.append((name.decode("utf-8"), index))
+        return keys
+
+    def _sum(self, index):
+        total = 0
+        offset = self._slots_offset + _VALUE.size * (1 + index)
+        for _ in range(self.max_workers):
+            total += _VALUE.unpack_from(self._mmap, offset)[0]
+            offset += self._slot_size
+        return total
+
+    def incr(self, key, amount=1):
+        self._attach()
+        offset = self._slot_offset + _VALUE.size * (1 + self._index(key))
+        with self._lock:
+            (value,) = _VALUE.unpack_from(self._mmap, offset)
+            _VALUE.pack_into(self._mmap, offset, value + amount)
+
+    def get(self, key, default=0):
+        """Return the sum of the counter across all processes."""
+        self._attach()
+        index = self._index(key, create=False)
+        if index is None or (index == self._dropped and key != DROPPED_KEY):
+            return default
+        return self._sum(index)
+
+    def snapshot(self):
+        """Return sums of all counters across all processes."""
+        self._attach()
+        return {key: self._sum(index) for key, index in self._keys()}
+
+
+class SpaceSaving(object):
+    """Track the most frequent keys in constant memory.
+
+    Implements the space-saving algorithm: at most ``capacity`` keys are tracked,
+    an unknown key replaces the key with the lowest count and inherits its count
+    as the estimation error. Counts are never underestimated and keys occurring more
+    often than ``1 / capacity`` of all additions are guaranteed to be tracked.
+    Every addition takes constant time.
+
+    :param capacity: (optional) number of tracked keys, ``100`` by default.
+    """
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # key -> [count, error]
+            self._entries = {}
+            # count -> keys with that count
+            self._buckets = {}
+            self._min_count = 0
+
+    def _bucket_add(self, count, key):
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._buckets[count] = set()
+        bucket.add(key)
+
+    def _bucket_remove(self, count, key):
+        bucket = self._buckets[count]
+        bucket.discard(key)
+        if not bucket:
+            del self._buckets[count]
+
+    def add(self, key):
+        """Count an occurrence of the key."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                count = entry[0]
+                self._bucket_remove(count, key)
+                self._bucket_add(count + 1, key)
+                entry[0] = count + 1
+                if count == self._min_count and count not in self._buckets:
+                    self._min_count = count + 1
+            elif len(self._entries) < self.capacity:
+                self._entries[key] = [1, 0]
+                self._bucket_add(1, key)
+                self._min_count = 1
+            else:
+                min_count = self._min_count
+                evicted = next(iter(self._buckets[min_count]))
+                self._bucket_remove(min_count, evicted)
+                del self._entries[evicted]
+                self._entries[key] = [min_count + 1, min_count]
+                self._bucket_add(min_count + 1, key)
+                if min_count not in self._buckets:
+                    self._min_count = min_count + 1
+
+    def top(self, k=None):
+        """Return the most frequent keys.
+
+        :param k: (optional) number of keys to return, all tracked keys by default.
+        :return: List of ``(key, count, error)`` tuples sorted by count, the true
+            count of the key is between ``count - error`` and ``count``.
+        """
+        with self._lock:
+            entries = [
+                (key, count, error) for key, (count, error) in self._entries.items()
+            ]
+        entries.sort(key=lambda entry: entry[1], reverse=True)
+        return entries[:k] if k is not None else entries
+
+
+_counters = LocalCounters()
+
+#: The most frequent User-Agent headers of requests with invalid User-Agent,
+#: fed by the middlewares.
+offenders = SpaceSaving()
+
+
+def use(counters):
+    """Set the counters used by the library.
+
+    :param counters: :class:`LocalCounters` or :class:`SharedCounters`.
+    """
+    global _counters
+    _counters = counters
+
+
+def incr(key, amount=1):
+    _counters.incr(key, amount)
+
+
+def get(key, default=0):
+    return _counters.get(key, default)
+
+
+def snapshot():
+    """Return values of all counters used by the library."""
+    return _counters.snapshot()
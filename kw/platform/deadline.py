@@ -0,0 +1,124 @@
+"""
+Deadlines
+=========
+
+Propagation of request deadlines between services.
+
+Incoming requests get a deadline either from the header
+:obj:`settings.KIWI_DEADLINE_HEADER` with the remaining budget in milliseconds, or
+from :obj:`settings.KIWI_DEFAULT_REQUEST_BUDGET`. Outgoing requests made by the Kiwi
+sessions or the patched libraries while handling the request then:
+
+* use the remaining budget as their timeout, unless a shorter one is provided,
+* forward the remaining budget in the deadline header,
+* fail fast with :exc:`DeadlineExceeded` when the budget is exhausted.
+
+The deadline is stored in a context variable, so it follows the request through
+threads of WSGI servers as well as asyncio tasks.
+"""
+
+import time
+
+from . import metrics, settings
+from ._compat import ContextVar
+
+
+_deadline = ContextVar("kw_platform_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The time budget of the current request has been exhausted."""
+
+
+def set_deadline(seconds):
+    """Set the deadline of the current context.
+
+    :param seconds: Remaining budget in seconds, :obj:`None` for no deadline.
+    :return: Token for :func:`reset_deadline`.
+    """
+    return _deadline.set(None if seconds is None else time.time() + seconds)
+
+
+def reset_deadline(token):
+    """Restore the deadline from before :func:`set_deadline`."""
+    _deadline.reset(token)
+
+
+def remaining():
+    """Return the remaining budget of the current context in seconds.
+
+    :return: Seconds, :obj:`None` if there is no deadline.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def parse_header(value, default=None):
+    """Parse the remaining budget in seconds from the deadline header.
+
+    :param value: Value of the header in milliseconds or :obj:`None`.
+    :param default: (optional) budget used if the value is missing or invalid.
+    """
+    if not value:
+        return default
+    try:
+        return max(int(value), 0) / 1000.0
+    except ValueError:
+        return default
+
+
+def budget_from_header(value):
+    """Return the budget of an incoming request with the given deadline header."""
+    return parse_header(value, default=settings.KIWI_DEFAULT_REQUEST_BUDGET)
+
+
+def requests_timeout(timeout, seconds):
+    """Limit :mod:`requests` timeout to the remaining budget."""
+    if timeout is None:
+        return seconds
+    if isinstance(timeout, tuple):
+        return tuple(seconds if t is None else min(t, seconds) for t in timeout)
+    if isinstance(timeout, (int, float)):
+        return min(timeout, seconds)
+    return timeout
+
+
+def _with_header(headers, name, value):
+    """Return a copy of the headers with the header replaced by the value."""
+    if headers is None:
+        headers = {}
+    elif hasattr(headers, "copy"):
+        headers = headers.copy()
+    else:
+        headers = dict(headers)
+    for key in [key for key in headers if key.lower() == name.lower()]:
+        del headers[key]
+    headers[name] = value
+    return headers
+
+
+def apply_deadline(kwargs, limit_timeout=requests_timeout):
+    """Update keyword arguments of an outgoing request according to the deadline.
+
+    :param kwargs: Keyword arguments of the request, modified in place. The headers
+        are copied, so a headers dict shared by several requests is left untouched.
+    :param limit_timeout: (optional) function limiting the ``timeout`` argument to
+        the remaining budget, :func:`requests_timeout` by default.
+    :raises DeadlineExceeded: If the budget has been exhausted.
+    """
+    seconds = remaining()
+    if seconds is None:
+        return
+    if seconds <= 0:
+        metrics.incr("deadline.exceeded")
+        raise DeadlineExceeded(
+            "Deadline of the request exceeded by {:.3f}s".format(-seconds)
+        )
+
+    kwargs["headers"] = _with_header(
+        kwargs.get("headers"), settings.KIWI_DEADLINE_HEADER, str(int(seconds * 1000))
+    )
+
+    kwargs["timeout"] = limit_timeout(kwargs.get("timeout"), seconds)
@@ -0,0 +1,30 @@
+"""
+HTTP Client
+===========
+
+Patches of the HTTP client of the standard library, :mod:`http.client`
+(``httplib`` on Python 2).
+
+All HTTP libraries built on top of it, like :mod:`urllib.request`, :mod:`urllib3`
+or :mod:`requests`, are covered by a single low-level hook. Requests handled by
+the patches of :mod:`kw.platform.requests` or :mod:`kw.platform.urllib3` or by
+a Kiwi session are skipped, so responses are not reported twice.
+"""
+
+from .monkey import (
+    construct_user_agent,
+    patch,
+    patch_with_sentry,
+    patch_with_user_agent,
+    unpatch,
+)
+
+
+__all__ = [
+    "construct_user_agent",
+    "monkey",
+    "patch",
+    "patch_with_sentry",
+    "patch_with_user_agent",
+    "unpatch",
+]
@@ -0,0 +1,179 @@
+"""
+Monkey Patching
+===============
+"""
+
+import re
+from collections import namedtuple
+
+from .. import wrappers
+from ..utils import construct_user_agent
+
+
+try:
+    import http.client as httplib
+except ImportError:  # Python 2
+    import httplib
+
+
+class _HeaderInterceptor(wrappers.Interceptor):
+    """Interceptor of :meth:`http.client.HTTPConnection.putheader`.
+
+    Works as :class:`kw.platform.wrappers.Interceptor`, except pre-request hooks are
+    called with ``(connection, args)`` and return the positional arguments
+    ``(header, *values)`` of the call.
+    """
+
+    def __call__(self, func, instance, args, kwargs):
+        for hook in self._pre_hooks:
+            args = hook(instance, args)
+        return func(*args, **kwargs)
+
+
+#: Interceptor of :meth:`http.client.HTTPConnection.putheader` replacing
+#: the default User-Agent.
+header_interceptor = _HeaderInterceptor(httplib.__name__, "HTTPConnection.putheader")
+
+#: Interceptor of :meth:`http.client.HTTPConnection.endheaders` adding User-Agent.
+request_interceptor = wrappers.Interceptor(
+    httplib.__name__, "HTTPConnection.endheaders"
+)
+
+#: Interceptor of :meth:`http.client.HTTPConnection.getresponse` reporting headers.
+response_interceptor = wrappers.Interceptor(
+    httplib.__name__, "HTTPConnection.getresponse"
+)
+
+#: Default User-Agent headers of Python HTTP libraries, replaced by the patch.
+DEFAULT_USER_AGENT_RE = re.compile(
+    r"^(python-urllib3?|python-requests)/", re.IGNORECASE
+)
+
+# Attribute of connections which have sent User-Agent in the current request
+_USER_AGENT_SENT = "_kw_platform_user_agent_sent"
+
+# Python 2 responses have headers in `msg` only
+_Response = namedtuple("_Response", ["headers"])
+
+
+def _text(value):
+    return value.decode("latin-1") if isinstance(value, bytes) else str(value)
+
+
+def _construct(user_agent):
+    return user_agent() if callable(user_agent) else user_agent
+
+
+def _replace_user_agent_hook(user_agent):
+    def _replace_default(connection, args):
+        if len(args) < 2 or _text(args[0]).lower() != "user-agent":
+            return args
+        connection.__dict__[_USER_AGENT_SENT] = True
+        if wrappers.handled("user_agent"):
+            return args
+        if not DEFAULT_USER_AGENT_RE.match(_text(args[1])):
+            return args
+        value = _construct(user_agent)
+        return (args[0], value) if value else args
+
+    return _replace_default
+
+
+def _user_agent_hook(user_agent):
+    def _add_header(connection, kwargs):
+        if connection.__dict__.pop(_USER_AGENT_SENT, False):
+            return
+        if wrappers.handled("user_agent"):
+            return
+        value = _construct(user_agent)
+        if value:
+            connection.putheader("User-Agent", value)
+            connection.__dict__.pop(_USER_AGENT_SENT, None)
+
+    return _add_header
+
+
+def _sentry_hook(sunset_header, deprecated_usage_header, sampler):
+    hook = wrappers.sentry_hook(sunset_header, deprecated_usage_header, sampler)
+
+    def _check_headers(connection, response):
+        if wrappers.handled("sentry"):
+            return
+        hook(connection, _Response(getattr(response, "headers", None) or response.msg))
+
+    return _check_headers
+
+
+def patch_with_user_agent(user_agent=None):
+    """Patch :mod:`http.client` connections with User-Agent.
+
+    In case `User-Agent` header has not been provided directly to request,
+    or it is the default one of :mod:`urllib.request`, :mod:`urllib3` or
+    :mod:`requests`, add `User-Agent` string constructed by
+    :func:`kw.platform.utils.construct_user_agent` as `User-Agent` header.
+
+    The header is replaced through the public ``putheader`` method of connections.
+    Requests handled by the User-Agent patches of :mod:`kw.platform.requests` or
+    :mod:`kw.platform.urllib3` or by a Kiwi session are left untouched, as well as
+    all requests if the User-Agent can not be constructed, so the patch never fails
+    requests of other libraries, e.g. of the Sentry transport.
+
+    :param user_agent: (optional) User-Agent string that will be used as
+        `User-Agent` header.
+    """
+    if user_agent is None:
+        user_agent = construct_user_agent
+
+    header_interceptor.add_hook("user_agent", pre=_replace_user_agent_hook(user_agent))
+    header_interceptor.patch()
+    request_interceptor.add_hook("user_agent", pre=_user_agent_hook(user_agent))
+    request_interceptor.patch()
+
+
+def patch_with_sentry(sunset_header=True, deprecated_usage_header=True, sampler=None):
+    """Patch :mod:`http.client` connections to create events in Sentry.
+
+    Works as :func:`kw.platform.requests.patch_with_sentry`. Responses reported
+    by the Sentry patches of :mod:`kw.platform.requests` or
+    :mod:`kw.platform.urllib3` or by a Kiwi session are skipped.
+
+    :param sunset_header: (optional) Whether to report the presence of the ``Sunset``
+        header, :obj:`True` by default.
+    :param deprecated_usage_header: (optional) Whether to report the presence of the
+        ``Deprecated-Usage`` header, :obj:`True` by default.
+    :param sampler: (optional) :class:`kw.platform.utils.ReportSampler` deciding
+        which events are sent to Sentry, :obj:`kw.platform.utils.report_sampler`
+        by default.
+    """
+    response_interceptor.add_hook(
+        "sentry", post=_sentry_hook(sunset_header, deprecated_usage_header, sampler)
+    )
+    response_interceptor.patch()
+
+
+def patch():
+    """Apply all patches for :mod:`http.client` module.
+
+    This will automatically apply:
+
+    * :func:`kw.platform.httplib.monkey.patch_with_user_agent`
+    * :func:`kw.platform.httplib.monkey.patch_with_sentry`
+    """
+    if getattr(httplib, "__kiwi_platform_patch", False):
+        # Already patched, skip
+        return
+
+    patch_with_user_agent()
+    patch_with_sentry()
+
+    # Mark module as patched
+    setattr(httplib, "__kiwi_platform_patch", True)
+
+
+def unpatch():
+    """Remove all patches of :mod:`http.client` module."""
+    header_interceptor.unpatch()
+    request_interceptor.unpatch()
+    response_interceptor.unpatch()
+    if hasattr(httplib, "__kiwi_platform_patch"):
+        delattr(httplib, "__kiwi_platform_patch")
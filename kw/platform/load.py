@@ -0,0 +1,114 @@
+"""
+Load
+====
+
+Tracking of server load for the adaptive validation of requests.
+"""
+
+import threading
+
+
+#: Let requests from non-compliant clients pass.
+PASS = 0
+#: Slow down requests from non-compliant clients.
+SLOWDOWN = 1
+#: Refuse requests from non-compliant clients.
+RESTRICT = 2
+
+
+class LoadMonitor(object):
+    """Derive the enforcement level for non-compliant clients from server load.
+
+    The monitor tracks the number of requests being handled, an exponentially
+    weighted moving average of their duration and, if fed by
+    :meth:`record_lag`, the lag of the event loop. The :attr:`level` escalates
+    as soon as any signal reaches its threshold and relaxes only once all
+    signals drop below ``hysteresis`` times the thresholds of the current level,
+    which prevents flapping between levels.
+
+    Thresholds set to :obj:`None` are ignored.
+
+    Usage::
+
+        from kw.platform.load import LoadMonitor
+
+        monitor = LoadMonitor(slowdown_in_flight=50, restrict_in_flight=100)
+
+    :param slowdown_in_flight: (optional) number of requests being handled.
+    :param restrict_in_flight: (optional) number of requests being handled.
+    :param slowdown_latency: (optional) average duration of requests in seconds.
+    :param restrict_latency: (optional) average duration of requests in seconds.
+    :param slowdown_lag: (optional) lag of the event loop in seconds.
+    :param restrict_lag: (optional) lag of the event loop in seconds.
+    :param hysteresis: (optional) fraction of thresholds signals must drop below
+        to relax the level, ``0.8`` by default.
+    :param smoothing: (optional) weight of the latest duration in the average,
+        ``0.1`` by default.
+    """
+
+    def __init__(
+        self,
+        slowdown_in_flight=None,
+        restrict_in_flight=None,
+        slowdown_latency=None,
+        restrict_latency=None,
+        slowdown_lag=None,
+        restrict_lag=None,
+        hysteresis=0.8,
+        smoothing=0.1,
+    ):
+        self._thresholds = {
+            SLOWDOWN: (slowdown_in_flight, slowdown_latency, slowdown_lag),
+            RESTRICT: (restrict_in_flight, restrict_latency, restrict_lag),
+        }
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        #: Number of requests being handled.
+        self.in_flight = 0
+        #: Moving average of durations of requests in seconds.
+        self.latency = 0.0
+        #: Latest lag of the event loop in seconds.
+        self.lag = 0.0
+        #: Current enforcement level, one of :obj:`PASS`, :obj:`SLOWDOWN`
+        #: and :obj:`RESTRICT`.
+        self.level = PASS
+        self._lock = threading.Lock()
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+            self._update()
+
+    def request_finished(self, duration):
+        """Record a finished request.
+
+        :param duration: Duration of the request in seconds.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self.latency += self.smoothing * (duration - self.latency)
+            self._update()
+
+    def record_lag(self, lag):
+        """Record the lag of the event loop.
+
+        :param lag: Lag in seconds.
+        """
+        with self._lock:
+            self.lag = lag
+            self._update()
+
+    def _level_for(self, factor):
+        signals = (self.in_flight, self.latency, self.lag)
+        for level in (RESTRICT, SLOWDOWN):
+            for signal, threshold in zip(signals, self._thresholds[level]):
+                if threshold is not None and signal >= threshold * factor:
+                    return level
+        return PASS
+
+    def _update(self):
+        level = self._level_for(1.0)
+        if level < self.level:
+            # Relax only when all signals are clearly below the thresholds
+            level = min(self.level, self._level_for(self.hysteresis))
+        self.level = level
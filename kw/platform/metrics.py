@@ -0,0 +1,259 @@
+"""
+Metrics
+=======
+
+Export of decisions made by the library, e.g. validations of the User-Agent header,
+slowdowns, refusals or reports of the ``Sunset`` header.
+
+Counters are kept in :mod:`kw.platform.counters`, histograms in this module.
+Metrics which are only useful for monitoring, e.g. the number of all validated
+requests or histograms of delays, are recorded once an exporter is configured,
+until then :func:`incr` and :func:`observe` return right away.
+
+Two exporters are available, the Prometheus text format, see
+:func:`kw.platform.aiohttp.utils.prometheus_handler` and
+:func:`kw.platform.wsgi.prometheus_app`, and a StatsD emitter
+sending aggregated values over UDP, see :class:`StatsDEmitter`.
+
+Usage::
+
+    from kw.platform import metrics
+
+    emitter = metrics.StatsDEmitter("localhost", 8125).start()
+
+Histograms are kept in memory of each process, also with
+:class:`kw.platform.counters.SharedCounters`.
+"""
+
+import re
+import socket
+import threading
+from bisect import bisect_left
+
+from . import counters
+
+
+#: Upper bounds of histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#: Prefix of names of exported metrics.
+PREFIX = "kiwi_platform"
+
+#: Maximum size of a StatsD datagram in bytes, fits into the MTU of most networks.
+MAX_DATAGRAM_SIZE = 1432
+
+_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class Histogram(object):
+    """Histogram of observed values with fixed buckets.
+
+    :param buckets: (optional) upper bounds of buckets, :obj:`DEFAULT_BUCKETS`
+        by default.
+    :ivar counts: Number of observations per bucket, the last one counts
+        observations above the highest bound.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Return a consistent copy of ``(counts, count, sum)``."""
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+
+_enabled = False
+_histograms = {}
+_lock = threading.Lock()
+
+
+def enable():
+    """Start recording the metrics only used by exporters.
+
+    Called by the exporters, there is no need to call it directly.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def incr(key, amount=1):
+    """Increment a counter in :mod:`kw.platform.counters` if metrics are enabled."""
+    if _enabled:
+        counters.incr(key, amount)
+
+
+def observe(key, value):
+    """Add a value to a histogram if metrics are enabled.
+
+    :param key: Name of the histogram, e.g. ``user_agent.delay_seconds``.
+    :param value: Observed value.
+    """
+    if _enabled:
+        histogram(key).observe(value)
+
+
+def histogram(key, buckets=DEFAULT_BUCKETS):
+    """Return the histogram, created with the buckets on first use.
+
+    :rtype: :class:`Histogram`
+    """
+    try:
+        return _histograms[key]
+    except KeyError:
+        with _lock:
+            return _histograms.setdefault(key, Histogram(buckets))
+
+
+def histograms():
+    """Return a copy of all histograms by their names."""
+    with _lock:
+        return dict(_histograms)
+
+
+def _metric_name(key):
+    return "{}_{}".format(PREFIX, _NAME_RE.sub("_", key))
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus():
+    """Render all counters and histograms in the Prometheus text format.
+
+    :rtype: str
+    """
+    lines = []
+    for key, value in sorted(counters.snapshot().items()):
+        name = _metric_name(key) + "_total"
+        lines.append("# TYPE {} counter".format(name))
+        lines.append("{} {}".format(name, value))
+
+    for key, hist in sorted(histograms().items()):
+        name = _metric_name(key)
+        counts, count, total = hist.snapshot()
+        lines.append("# TYPE {} histogram".format(name))
+        cumulative = 0
+        for bound, bucket_count in zip(hist.buckets, counts):
+            cumulative += bucket_count
+            lines.append(
+                '{}_bucket{{le="{}"}} {}'.format(
+                    name, _format_value(float(bound)), cumulative
+                )
+            )
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, count))
+        lines.append("{}_sum {}".format(name, _format_value(total)))
+        lines.append("{}_count {}".format(name, count))
+
+    return "\n".join(lines) + "\n"
+
+
+#: Content type of :func:`render_prometheus`.
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StatsDEmitter(object):
+    """Send counters and histograms to StatsD in batches over UDP.
+
+    Values are aggregated in the process, every ``interval`` seconds the increments
+    of counters since the last flush are sent as StatsD counters, histograms as
+    counters ``<name>.count`` and ``<name>.sum``. Lines are packed into datagrams
+    of at most :obj:`MAX_DATAGRAM_SIZE` bytes.
+
+    :param host: StatsD host.
+    :param port: (optional) StatsD port, ``8125`` by default.
+    :param prefix: (optional) prefix of metric names.
+    :param interval: (optional) seconds between flushes, ``10`` by default.
+    """
+
+    def __init__(self, host, port=8125, prefix=PREFIX, interval=10.0):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.interval = interval
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sent = {}
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kw-statsd-emitter")
+        self._thread.daemon = True
+        enable()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the emitter after sending the remaining values."""
+        self._stopped.set()
+        self.flush()
+
+    def _collect(self):
+        values = dict(counters.snapshot())
+        for key, hist in histograms().items():
+            _, count, total = hist.snapshot()
+            values[key + ".count"] = count
+            values[key + ".sum"] = total
+
+        lines = []
+        for key, value in sorted(values.items()):
+            delta = value - self._sent.get(key, 0)
+            if delta:
+                lines.append(
+                    "{}.{}:{}|c".format(self.prefix, key, _format_value(delta))
+                )
+            self._sent[key] = value
+        return lines
+
+    def _batches(self, lines):
+        batch, size = [], 0
+        for line in lines:
+            line = line.encode("utf-8")
+            if batch and size + len(line) + 1 > MAX_DATAGRAM_SIZE:
+                yield b"\n".join(batch)
+                batch, size = [], 0
+            batch.append(line)
+            size += len(line) + 1
+        if batch:
+            yield b"\n".join(batch)
+
+    def flush(self):
+        """Send increments since the last flush.
+
+        :return: Number of sent datagrams.
+        """
+        with self._flush_lock:
+            sent = 0
+            for datagram in self._batches(self._collect()):
+                try:
+                    self._socket.sendto(datagram, self.address)
+                except socket.error:
+                    continue
+                sent += 1
+            return sent
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
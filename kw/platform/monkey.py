@@ -8,9 +8,17 @@ import threading
 
 
 # Define modules and which of them should be patched automatically.
-_PATCH_MODULES = {"requests": False, "aiohttp": False}
+_PATCH_MODULES = {
+    "requests": False,
+    "aiohttp": False,
+    "urllib3": False,
+    "httplib": False,
+}
 _PATCHED_MODULES = set()
 
+# Serializes patching and unpatching of all modules
+_lock = threading.RLock()
+
 
 def _import_module(module_name):
     path = "kw.platform." + module_name
@@ -18,7 +26,7 @@ def _import_module(module_name):
 
 
 def _patch_module(module_name):
-    with threading.Lock():
+    with _lock:
         if module_name in _PATCHED_MODULES:
             return False
 
@@ -29,6 +37,18 @@ def _patch_module(module_name):
         return True
 
 
+def _unpatch_module(module_name):
+    with _lock:
+        if module_name not in _PATCHED_MODULES:
+            return False
+
+        module = _import_module(module_name)
+        module.unpatch()
+
+        _PATCHED_MODULES.discard(module_name)
+        return True
+
+
 def patch(**patch_modules):
     """Patch specified modules.
 
@@ -39,6 +59,10 @@ def patch(**patch_modules):
         Possible options are:
 
         * requests
+        * aiohttp
+        * urllib3
+        * httplib, patches :mod:`http.client` used by most synchronous
+          HTTP libraries
 
     Usage::
 
@@ -50,3 +74,32 @@ def patch(**patch_modules):
     for module_name in modules:
         if module_name in _PATCH_MODULES.keys():
             _patch_module(module_name)
+
+
+def unpatch(**unpatch_modules):
+    """Remove patches of specified modules, or of all modules if none is specified.
+
+    :param unpatch_modules: keyword arguments of modules that should be unpatched,
+        see :func:`patch`.
+
+    Usage::
+
+        from kw.platform.monkey import unpatch
+
+        unpatch(requests=True)
+    """
+    with _lock:
+        modules = [m for m, should_unpatch in unpatch_modules.items() if should_unpatch]
+        if not unpatch_modules:
+            modules = list(_PATCHED_MODULES)
+        for module_name in modules:
+            _unpatch_module(module_name)
+
+
+def status():
+    """Return which modules are patched.
+
+    :return: Dictionary of module names and whether they are patched.
+    """
+    with _lock:
+        return {name: name in _PATCHED_MODULES for name in _PATCH_MODULES}
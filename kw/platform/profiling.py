@@ -0,0 +1,138 @@
+"""
+Profiling
+=========
+
+Opt-in measurement of time spent inside this library per request.
+
+When enabled by :obj:`settings.KIWI_PROFILING` or :func:`enable`, the library
+measures the time spent in:
+
+* ``kw-validate``, the validation of the User-Agent header by the middlewares,
+* ``kw-slowdown``, sleeping of requests which are being slowed down,
+* ``kw-user-agent-header``, adding of the User-Agent header to outgoing requests,
+* ``kw-sentry``, reporting of response headers to Sentry.
+
+The profiling middlewares of aiohttp and WSGI, ``profiling_middleware``, collect
+the timings of each request in a context variable, send them in the
+``Server-Timing`` header of the response and add them to :func:`totals` of the
+process. Timings measured outside of a profiled request are only added to the
+totals.
+
+When disabled, every measured place of the library costs a single check of
+:obj:`enabled`, the places check it themselves instead of using :func:`timed`.
+"""
+
+import threading
+from functools import wraps
+from timeit import default_timer
+
+from . import settings
+from ._compat import ContextVar
+
+
+#: Whether the profiling is enabled.
+enabled = bool(settings.KIWI_PROFILING)
+
+#: Clock used for the measurements.
+clock = default_timer
+
+VALIDATE = "kw-validate"
+SLOWDOWN = "kw-slowdown"
+USER_AGENT_HEADER = "kw-user-agent-header"
+SENTRY = "kw-sentry"
+
+_timings = ContextVar("kw_platform_timings", default=None)
+_totals = {}
+_lock = threading.Lock()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def add(name, seconds):
+    """Add time spent in the library to the current request and to the totals.
+
+    :param name: Name of the measured place, e.g. :obj:`VALIDATE`.
+    :param seconds: Measured time in seconds.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+    with _lock:
+        count, total = _totals.get(name, (0, 0.0))
+        _totals[name] = (count + 1, total + seconds)
+
+
+def timed(name):
+    """Measure the time spent in the decorated function if profiling is enabled.
+
+    Even when disabled, every call goes through the wrapper, an additional Python
+    frame, so hot paths should check :obj:`enabled` themselves.
+
+    :param name: Name of the measured place.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(name, clock() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def start_request():
+    """Start collecting timings of a request.
+
+    :return: Token for :func:`finish_request`.
+    """
+    return _timings.set({})
+
+
+def finish_request(token):
+    """Stop collecting timings of the request.
+
+    :param token: Token returned by :func:`start_request`.
+    :return: Timings of the request in seconds by their names.
+    """
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings or {}
+
+
+def server_timing(timings):
+    """Render timings as a value of the ``Server-Timing`` header.
+
+    :param timings: Timings in seconds by their names.
+    :rtype: str
+    """
+    return ", ".join(
+        "{};dur={:.3f}".format(name, seconds * 1000)
+        for name, seconds in sorted(timings.items())
+    )
+
+
+def totals():
+    """Return the number of measurements and the total time by their names."""
+    with _lock:
+        return dict(_totals)
+
+
+def reset():
+    """Clear the totals."""
+    with _lock:
+        _totals.clear()
@@ -12,18 +12,22 @@ if ensure_module_is_available(required_module):
     from .monkey import (
         construct_user_agent,
         patch,
+        patch_with_deadline,
         patch_with_user_agent,
         patch_with_sentry,
+        unpatch,
     )
     from .session import KiwiSession
 
     __all__ = [
         "KiwiSession",
         "construct_user_agent",
+        "patch_with_deadline",
         "patch_with_user_agent",
         "patch_with_sentry",
         "monkey",
         "patch",
+        "unpatch",
     ]
 else:
     from .._compat import ModuleNotFoundError  # pylint: disable=redefined-builtin
@@ -4,12 +4,15 @@ Monkey Patching
 """
 
 import requests
-import wrapt
 
 from .. import wrappers
 from ..utils import construct_user_agent
 
 
+#: Interceptor of :meth:`requests.Session.request` running hooks of all patches.
+interceptor = wrappers.Interceptor("requests", "Session.request", outer=True)
+
+
 def patch_with_user_agent(user_agent=None):
     """Patch :meth:`requests.Session.request` with User-Agent.
 
@@ -23,12 +26,11 @@ def patch_with_user_agent(user_agent=None):
     if user_agent is None:
         user_agent = construct_user_agent
 
-    wrapt.wrap_function_wrapper(
-        "requests", "Session.request", wrappers.add_user_agent(user_agent)
-    )
+    interceptor.add_hook("user_agent", pre=wrappers.user_agent_hook(user_agent))
+    interceptor.patch()
 
 
-def patch_with_sentry(sunset_header=True, deprecated_usage_header=True):
+def patch_with_sentry(sunset_header=True, deprecated_usage_header=True, sampler=None):
     """Patch :meth:`requests.Session.request` to create events in Sentry.
 
     If the HTTP response contains, for example, the ``Sunset`` HTTP header,
@@ -44,14 +46,31 @@ def patch_with_sentry(sunset_header=True, deprecated_usage_header=True):
         header, :obj:`True` by default.
     :param deprecated_usage_header: (optional) Whether to report the presence of the
         ``Deprecated-Usage`` header, :obj:`True` by default.
+    :param sampler: (optional) :class:`kw.platform.utils.ReportSampler` deciding
+        which events are sent to Sentry, :obj:`kw.platform.utils.report_sampler`
+        by default.
     """
-    wrapt.wrap_function_wrapper(
-        "requests",
-        "Session.request",
-        wrappers.add_sentry_handler(
-            sunset_header=sunset_header, deprecated_usage_header=deprecated_usage_header
+    interceptor.add_hook(
+        "sentry",
+        post=wrappers.sentry_hook(
+            sunset_header=sunset_header,
+            deprecated_usage_header=deprecated_usage_header,
+            sampler=sampler,
         ),
     )
+    interceptor.patch()
+
+
+def patch_with_deadline():
+    """Patch :meth:`requests.Session.request` to respect the request deadline.
+
+    Within a deadline set by :mod:`kw.platform.deadline`, the timeout of requests
+    is limited to the remaining budget, the budget is forwarded in the deadline
+    header and :exc:`kw.platform.deadline.DeadlineExceeded` is raised without
+    sending the request once the budget is exhausted.
+    """
+    interceptor.add_hook("deadline", pre=wrappers.deadline_hook())
+    interceptor.patch()
 
 
 def patch():
@@ -61,6 +80,7 @@ def patch():
 
     * :func:`kw.platform.requests.patch.patch_with_user_agent`
     * :func:`kw.platform.requests.patch.patch_with_sentry`
+    * :func:`kw.platform.requests.patch.patch_with_deadline`
     """
     if getattr(requests, "__kiwi_platform_patch", False):
         # Already patched, skip
@@ -68,6 +88,17 @@ def patch():
 
     patch_with_user_agent()
     patch_with_sentry()
+    patch_with_deadline()
 
     # Mark module as patched
     setattr(requests, "__kiwi_platform_patch", True)
+
+
+def unpatch():
+    """Remove all patches of :mod:`requests` module.
+
+    Restores the original :meth:`requests.Session.request`.
+    """
+    interceptor.unpatch()
+    if hasattr(requests, "__kiwi_platform_patch"):
+        delattr(requests, "__kiwi_platform_patch")
@@ -3,9 +3,50 @@ Session
 =======
 """
 
+import functools
+import json
+
 import requests
 
+from .. import serialization
+from ..compression import accept_encoding, compress_request
+from ..deadline import apply_deadline
+from ..streaming import (
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_MAX_RECORD_SIZE,
+    JSONArrayDecoder,
+    NDJSONDecoder,
+    iter_records,
+)
 from ..utils import add_user_agent_header, construct_user_agent, report_to_sentry
+from ..wrappers import handling
+
+
+try:
+    from urllib3.util.request import ACCEPT_ENCODING
+except ImportError:  # urllib3 < 1.25
+    ACCEPT_ENCODING = "gzip,deflate"
+
+_dumps = functools.partial(json.dumps, allow_nan=False)
+
+
+class KiwiResponse(requests.Response):
+    """Response parsing JSON with :mod:`kw.platform.serialization`."""
+
+    def json(self, **kwargs):
+        """Parse the JSON body of the response.
+
+        UTF-8 bodies are parsed by :func:`kw.platform.serialization.loads` straight
+        from bytes. Other encodings, invalid bodies or ``kwargs`` for
+        :func:`json.loads` fall back to :meth:`requests.Response.json`.
+        """
+        if kwargs or (self.encoding or "utf-8").lower() not in ("utf-8", "utf8"):
+            return super(KiwiResponse, self).json(**kwargs)
+        try:
+            return serialization.loads(self.content)
+        except ValueError:
+            # Let requests detect the encoding or raise its own error
+            return super(KiwiResponse, self).json()
 
 
 class KiwiSession(requests.Session):
@@ -16,11 +57,103 @@ class KiwiSession(requests.Session):
         from kw.platform.requests import KiwiSession
         session = KiwiSession()
         session.get('https://kiwi.com')
+
+    Within a deadline set by :mod:`kw.platform.deadline`, the timeout of requests
+    is limited to the remaining budget, which is forwarded in the deadline header.
+
+    Responses are requested in the best encoding :mod:`urllib3` can decode, request
+    bodies larger than :obj:`compress_threshold` are gzipped,
+    see :mod:`kw.platform.compression`.
+
+    Responses are :class:`KiwiResponse` with a faster :meth:`KiwiResponse.json`.
+
+    Reports to Sentry are sampled by :obj:`sampler`, a
+    :class:`kw.platform.utils.ReportSampler` which can be overridden per instance.
     """
 
+    #: Sampler of events reported to Sentry,
+    #: :obj:`kw.platform.utils.report_sampler` if :obj:`None`.
+    sampler = None
+
+    #: Minimum size of compressed request bodies in bytes,
+    #: :obj:`kw.platform.settings.KIWI_COMPRESS_REQUEST_THRESHOLD` if :obj:`None`.
+    compress_threshold = None
+
+    def __init__(self):
+        super(KiwiSession, self).__init__()
+        self.headers["Accept-Encoding"] = accept_encoding(ACCEPT_ENCODING.split(","))
+
     def request(self, *args, **kwargs):
-        headers = kwargs.setdefault("headers", {})
+        apply_deadline(kwargs)
+        compress_request(kwargs, self.compress_threshold, dumps=_dumps)
+        # Copied, so a headers dict shared by several requests is left untouched
+        headers = kwargs["headers"] = requests.structures.CaseInsensitiveDict(
+            kwargs.get("headers") or {}
+        )
         add_user_agent_header(headers, construct_user_agent)
-        response = super(KiwiSession, self).request(*args, **kwargs)
-        report_to_sentry(response, sunset_header=True, deprecated_usage_header=True)
+        with handling("user_agent", "sentry"):
+            response = super(KiwiSession, self).request(*args, **kwargs)
+        # Responses are built by transport adapters, only the class is replaced
+        response.__class__ = KiwiResponse
+        report_to_sentry(
+            response,
+            sunset_header=True,
+            deprecated_usage_header=True,
+            sampler=self.sampler,
+        )
         return response
+
+    def stream_ndjson(
+        self,
+        method,
+        url,
+        max_record_size=DEFAULT_MAX_RECORD_SIZE,
+        max_body_size=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        **kwargs
+    ):
+        """Iterate over JSON lines of the response without reading it whole.
+
+        The request is sent on the first iteration, responses with an error status
+        raise :exc:`requests.HTTPError`. See :mod:`kw.platform.streaming`.
+
+        Usage::
+
+            for booking in session.stream_ndjson("GET", "https://kiwi.com/bookings"):
+                process(booking)
+
+        :param method: HTTP method.
+        :param url: URL of the request.
+        :param max_record_size: (optional) maximum size of a line in bytes,
+            :obj:`kw.platform.streaming.DEFAULT_MAX_RECORD_SIZE` by default.
+        :param max_body_size: (optional) maximum size of the body in bytes,
+            no limit by default.
+        :param chunk_size: (optional) size of chunks read from the response.
+        :param kwargs: Other arguments of :meth:`request`.
+        :raises kw.platform.streaming.LimitExceeded: If the limits are exceeded.
+        """
+        decoder = NDJSONDecoder(max_record_size, max_body_size)
+        return self._stream_records(decoder, method, url, chunk_size, kwargs)
+
+    def stream_json_array(
+        self,
+        method,
+        url,
+        max_record_size=DEFAULT_MAX_RECORD_SIZE,
+        max_body_size=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        **kwargs
+    ):
+        """Iterate over items of a JSON array in the response without reading it whole.
+
+        Works as :meth:`stream_ndjson`, ``max_record_size`` limits size of items.
+        """
+        decoder = JSONArrayDecoder(max_record_size, max_body_size)
+        return self._stream_records(decoder, method, url, chunk_size, kwargs)
+
+    def _stream_records(self, decoder, method, url, chunk_size, kwargs):
+        kwargs["stream"] = True
+        with self.request(method, url, **kwargs) as response:
+            response.raise_for_status()
+            for record in iter_records(response.iter_content(chunk_size), decoder):
+                yield record
@@ -0,0 +1,125 @@
+"""
+Serialization
+=============
+
+Pluggable JSON backend used for JSON produced and consumed by this library.
+
+The fastest installed backend is used, ``orjson``, then ``ujson``, falling back
+to the :mod:`json` module of the standard library. The backend can be chosen by
+:obj:`settings.KIWI_JSON_BACKEND` or :func:`use`. If the configured backend is not
+installed, a warning is logged and the fastest installed one is used instead.
+
+Usage::
+
+    from kw.platform import serialization
+
+    serialization.use("json")
+    serialization.dumps({"message": "Hello"})
+"""
+
+import json
+import logging
+from collections import namedtuple
+
+from . import settings
+
+
+#: Backend with functions serializing objects to text and parsing text or bytes.
+JSONBackend = namedtuple("JSONBackend", ["name", "dumps", "loads"])
+
+
+def _stdlib_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def _create_orjson():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    return JSONBackend("orjson", dumps, orjson.loads)
+
+
+def _create_ujson():
+    import ujson
+
+    def loads(data):
+        if isinstance(data, bytearray):
+            data = bytes(data)
+        return ujson.loads(data)
+
+    return JSONBackend("ujson", ujson.dumps, loads)
+
+
+def _create_json():
+    return JSONBackend("json", json.dumps, _stdlib_loads)
+
+
+_FACTORIES = (("orjson", _create_orjson), ("ujson", _create_ujson))
+
+
+def _available_backends():
+    backends = []
+    for _, factory in _FACTORIES:
+        try:
+            backends.append(factory())
+        except ImportError:
+            pass
+    backends.append(_create_json())
+    return backends
+
+
+#: Installed backends in the order of preference.
+BACKENDS = _available_backends()
+
+
+def use(name=None):
+    """Set the JSON backend used by the library.
+
+    :param name: (optional) name of the backend, ``orjson``, ``ujson`` or ``json``,
+        the fastest installed backend if :obj:`None`.
+    :raises ValueError: If the backend is not installed.
+    """
+    global _backend
+    for backend in BACKENDS:
+        if name is None or backend.name == name:
+            _backend = backend
+            return
+    raise ValueError("JSON backend {!r} is not installed".format(name))
+
+
+def backend():
+    """Return the current :class:`JSONBackend`."""
+    return _backend
+
+
+def dumps(obj):
+    """Serialize the object to JSON text with the current backend."""
+    return _backend.dumps(obj)
+
+
+def loads(data):
+    """Parse JSON text or UTF-8 bytes with the current backend.
+
+    :raises ValueError: If the data is not valid JSON.
+    """
+    return _backend.loads(data)
+
+
+def _use_configured():
+    try:
+        use(settings.KIWI_JSON_BACKEND or None)
+    except ValueError:
+        logging.warning(
+            "JSON backend %r from KIWI_JSON_BACKEND is not installed, using %r",
+            settings.KIWI_JSON_BACKEND,
+            BACKENDS[0].name,
+        )
+        use()
+
+
+_backend = None
+_use_configured()
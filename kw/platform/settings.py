@@ -3,11 +3,24 @@ Settings
 ========
 
 Configuration of this library.
+
+The settings below are read from environment variables on import. Settings
+related to the validation of requests can also be reloaded at runtime,
+see :func:`current`.
 """
 
+import json
+import logging
 import os
+import threading
+from collections import namedtuple
 from distutils.util import strtobool
 
+from dateutil.parser import parse
+
+from ._compat import string_types
+from .bypass import BypassRules
+
 
 #: Datetime when to start slowing down requests from services which do not comply with
 #: the ``KW-RFC-22`` standard. See :obj:`kw.platform.wsgi.user_agent_middleware`.
@@ -29,3 +42,385 @@ KIWI_RESTRICT_USER_AGENT_MESSAGE = "Invalid User-Agent: does not comply with KW-
 KIWI_ENABLE_RESTRICTION_OF_REQUESTS = strtobool(
     os.getenv("KIWI_ENABLE_RESTRICTION_OF_REQUESTS", "true")
 )
+
+#: Comma-separated rules of requests which skip the validation of the User-Agent
+#: header, e.g. ``/healthz,/metrics/*,OPTIONS,ua:kube-probe/``, empty by default.
+#: See :mod:`kw.platform.bypass`.
+KIWI_USER_AGENT_BYPASS = os.getenv("KIWI_USER_AGENT_BYPASS", "")
+
+#: When to delay requests which are being slowed down, ``after`` the handler
+#: (default) or ``before`` it, case-insensitive, other values raise
+#: :exc:`ValueError`. See :mod:`kw.platform.slowdown`.
+KIWI_SLOWDOWN_MODE = os.getenv("KIWI_SLOWDOWN_MODE", "after")
+
+#: Maximum relative deviation of delays before the handler, ``0`` by default.
+KIWI_SLOWDOWN_JITTER = float(os.getenv("KIWI_SLOWDOWN_JITTER", "0"))
+
+#: Maximum number of bytes held at once by responses delayed after the handler,
+#: no limit by default.
+KIWI_SLOWDOWN_MAX_HELD_BYTES = (
+    int(os.environ["KIWI_SLOWDOWN_MAX_HELD_BYTES"])
+    if os.getenv("KIWI_SLOWDOWN_MAX_HELD_BYTES")
+    else None
+)
+
+#: Ask clients to close the connection after a refused request, so they do not hold
+#: keep-alive connections, ``False`` by default. See :func:`kw.platform.utils.refusal`.
+#: Only the aiohttp and ASGI middlewares send the ``Connection: close`` header, WSGI
+#: apps must not send hop-by-hop headers, so WSGI servers have to be configured
+#: to close the connections themselves.
+KIWI_REFUSAL_CLOSE_CONNECTION = strtobool(
+    os.getenv("KIWI_REFUSAL_CLOSE_CONNECTION", "false")
+)
+
+#: Value of the ``Retry-After`` header of refused requests in seconds,
+#: no header by default.
+KIWI_REFUSAL_RETRY_AFTER = (
+    int(os.environ["KIWI_REFUSAL_RETRY_AFTER"])
+    if os.getenv("KIWI_REFUSAL_RETRY_AFTER")
+    else None
+)
+
+#: Measure time spent inside the library per request, ``False`` by default.
+#: See :mod:`kw.platform.profiling`.
+KIWI_PROFILING = strtobool(os.getenv("KIWI_PROFILING", "false"))
+
+#: Probability of reporting a response with the ``Sunset`` header to Sentry,
+#: ``1.0`` (report every response) by default.
+#: See :class:`kw.platform.utils.ReportSampler`.
+KIWI_SUNSET_REPORT_RATE = float(os.getenv("KIWI_SUNSET_REPORT_RATE", "1.0"))
+
+#: Probability of reporting a response with the ``Deprecated-Usage`` header to Sentry,
+#: ``1.0`` (report every response) by default.
+KIWI_DEPRECATED_USAGE_REPORT_RATE = float(
+    os.getenv("KIWI_DEPRECATED_USAGE_REPORT_RATE", "1.0")
+)
+
+#: Number of sampled out responses which are still reported to Sentry per window
+#: of :obj:`KIWI_REPORT_RESERVOIR_WINDOW` seconds, ``0`` (disabled) by default.
+KIWI_REPORT_RESERVOIR_SIZE = int(os.getenv("KIWI_REPORT_RESERVOIR_SIZE", "0"))
+
+#: Length of the reservoir window in seconds, ``60`` by default.
+KIWI_REPORT_RESERVOIR_WINDOW = float(os.getenv("KIWI_REPORT_RESERVOIR_WINDOW", "60"))
+
+#: Name of the HTTP header with the remaining time budget of the request in
+#: milliseconds. See :mod:`kw.platform.deadline`.
+KIWI_DEADLINE_HEADER = os.getenv("KIWI_DEADLINE_HEADER", "X-Request-Deadline-Ms")
+
+#: Time budget in seconds of incoming requests without the deadline header,
+#: no deadline by default.
+KIWI_DEFAULT_REQUEST_BUDGET = (
+    float(os.environ["KIWI_DEFAULT_REQUEST_BUDGET"])
+    if os.getenv("KIWI_DEFAULT_REQUEST_BUDGET")
+    else None
+)
+
+#: Minimum size in bytes of request bodies compressed by the Kiwi sessions,
+#: compression is disabled by default. See :mod:`kw.platform.compression`.
+KIWI_COMPRESS_REQUEST_THRESHOLD = (
+    int(os.environ["KIWI_COMPRESS_REQUEST_THRESHOLD"])
+    if os.getenv("KIWI_COMPRESS_REQUEST_THRESHOLD")
+    else None
+)
+
+#: Name of the JSON backend used by the library, ``orjson``, ``ujson`` or ``json``,
+#: the fastest installed backend by default. See :mod:`kw.platform.serialization`.
+KIWI_JSON_BACKEND = os.getenv("KIWI_JSON_BACKEND", "")
+
+
+class Snapshot(
+    namedtuple(
+        "Snapshot",
+        [
+            "slowdown_datetime",
+            "restrict_datetime",
+            "enable_restriction_of_requests",
+            "restrict_user_agent_message",
+            "bypass",
+            "slowdown_mode",
+            "slowdown_jitter",
+            "slowdown_max_held_bytes",
+        ],
+    )
+):
+    """Immutable snapshot of the settings related to the validation of requests
+    and to slowing them down.
+
+    :ivar slowdown_datetime: Parsed :obj:`KIWI_REQUESTS_SLOWDOWN_DATETIME`.
+    :ivar restrict_datetime: Parsed :obj:`KIWI_REQUESTS_RESTRICT_DATETIME`.
+    :ivar enable_restriction_of_requests: :obj:`KIWI_ENABLE_RESTRICTION_OF_REQUESTS`.
+    :ivar restrict_user_agent_message: :obj:`KIWI_RESTRICT_USER_AGENT_MESSAGE`.
+    :ivar bypass: :class:`kw.platform.bypass.BypassRules` compiled from
+        :obj:`KIWI_USER_AGENT_BYPASS`.
+    :ivar slowdown_mode: :obj:`KIWI_SLOWDOWN_MODE`.
+    :ivar slowdown_jitter: :obj:`KIWI_SLOWDOWN_JITTER`.
+    :ivar slowdown_max_held_bytes: :obj:`KIWI_SLOWDOWN_MAX_HELD_BYTES`.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_environ(cls, environ=None, defaults=None):
+        """Create a snapshot from environment variables.
+
+        :param environ: (optional) mapping of variables, :obj:`os.environ` by default.
+        :param defaults: (optional) snapshot used for missing variables,
+            values from the time of import by default.
+        """
+        environ = os.environ if environ is None else environ
+        values = (defaults or _initial)._asdict()
+        for variable, field in _VARIABLES.items():
+            if variable in environ:
+                values[field] = environ[variable]
+        return cls.create(**values)
+
+    @classmethod
+    def create(cls, **values):
+        """Create a snapshot, converting string values to the proper types."""
+        for field in ("slowdown_datetime", "restrict_datetime"):
+            if isinstance(values.get(field), string_types):
+                values[field] = parse(values[field])
+        enable = values.get("enable_restriction_of_requests")
+        if isinstance(enable, string_types):
+            values["enable_restriction_of_requests"] = bool(strtobool(enable))
+        elif enable is not None:
+            values["enable_restriction_of_requests"] = bool(enable)
+        bypass = values.get("bypass")
+        if bypass is None or isinstance(bypass, string_types):
+            values["bypass"] = BypassRules.parse(bypass or "")
+        mode = (values.get("slowdown_mode") or _SLOWDOWN_AFTER).lower()
+        if mode not in _SLOWDOWN_MODES:
+            raise ValueError("Unknown slowdown mode: {}".format(mode))
+        values["slowdown_mode"] = mode
+        jitter = values.get("slowdown_jitter")
+        values["slowdown_jitter"] = float(jitter or 0)
+        max_held_bytes = values.get("slowdown_max_held_bytes")
+        if isinstance(max_held_bytes, string_types):
+            values["slowdown_max_held_bytes"] = (
+                int(max_held_bytes) if max_held_bytes else None
+            )
+        return cls(**values)
+
+
+# kw.platform.slowdown.AFTER and BEFORE, the module imports the settings
+_SLOWDOWN_AFTER = "after"
+_SLOWDOWN_MODES = (_SLOWDOWN_AFTER, "before")
+
+_VARIABLES = {
+    "KIWI_REQUESTS_SLOWDOWN_DATETIME": "slowdown_datetime",
+    "KIWI_REQUESTS_RESTRICT_DATETIME": "restrict_datetime",
+    "KIWI_ENABLE_RESTRICTION_OF_REQUESTS": "enable_restriction_of_requests",
+    "KIWI_RESTRICT_USER_AGENT_MESSAGE": "restrict_user_agent_message",
+    "KIWI_USER_AGENT_BYPASS": "bypass",
+    "KIWI_SLOWDOWN_MODE": "slowdown_mode",
+    "KIWI_SLOWDOWN_JITTER": "slowdown_jitter",
+    "KIWI_SLOWDOWN_MAX_HELD_BYTES": "slowdown_max_held_bytes",
+}
+
+_initial = Snapshot.create(
+    slowdown_datetime=KIWI_REQUESTS_SLOWDOWN_DATETIME,
+    restrict_datetime=KIWI_REQUESTS_RESTRICT_DATETIME,
+    enable_restriction_of_requests=bool(KIWI_ENABLE_RESTRICTION_OF_REQUESTS),
+    restrict_user_agent_message=os.getenv(
+        "KIWI_RESTRICT_USER_AGENT_MESSAGE", KIWI_RESTRICT_USER_AGENT_MESSAGE
+    ),
+    bypass=KIWI_USER_AGENT_BYPASS,
+    slowdown_mode=KIWI_SLOWDOWN_MODE,
+    slowdown_jitter=KIWI_SLOWDOWN_JITTER,
+    slowdown_max_held_bytes=KIWI_SLOWDOWN_MAX_HELD_BYTES,
+)
+_snapshot = _initial
+_lock = threading.Lock()
+
+
+def _constants():
+    return (
+        KIWI_REQUESTS_SLOWDOWN_DATETIME,
+        KIWI_REQUESTS_RESTRICT_DATETIME,
+        KIWI_ENABLE_RESTRICTION_OF_REQUESTS,
+        KIWI_RESTRICT_USER_AGENT_MESSAGE,
+        KIWI_USER_AGENT_BYPASS,
+        KIWI_SLOWDOWN_MODE,
+        KIWI_SLOWDOWN_JITTER,
+        KIWI_SLOWDOWN_MAX_HELD_BYTES,
+    )
+
+
+_published = _constants()
+
+
+def _sync_from_constants():
+    global _snapshot, _published
+
+    with _lock:
+        constants = _constants()
+        if constants == _published:
+            return
+        try:
+            _snapshot = Snapshot.create(**dict(zip(Snapshot._fields, constants)))
+        except Exception:
+            # Logged once, the constants are not parsed again until they change
+            logging.exception("Invalid settings assigned, keeping the previous ones")
+        _published = constants
+
+
+def current():
+    """Return the current :class:`Snapshot` of the settings.
+
+    Middlewares read the snapshot once per request, a reload replaces it
+    with a single assignment, so no locking is needed when reading it.
+
+    Module-level settings assigned directly, e.g.
+    ``settings.KIWI_ENABLE_RESTRICTION_OF_REQUESTS = False``, are picked up
+    by the next call, so each call also compares the module-level settings with
+    the ones of the snapshot, which costs building a tuple of them. Prefer
+    :func:`update`. Assigned values which can not be parsed are logged once
+    and the previous snapshot is kept.
+
+    Usage::
+
+        from kw.platform import settings
+
+        if settings.current().enable_restriction_of_requests:
+            ...
+    """
+    if _constants() != _published:
+        _sync_from_constants()
+    return _snapshot
+
+
+def _publish(snapshot):
+    global _snapshot, _published
+    global KIWI_REQUESTS_SLOWDOWN_DATETIME, KIWI_REQUESTS_RESTRICT_DATETIME
+    global KIWI_ENABLE_RESTRICTION_OF_REQUESTS, KIWI_RESTRICT_USER_AGENT_MESSAGE
+    global KIWI_USER_AGENT_BYPASS, KIWI_SLOWDOWN_MODE, KIWI_SLOWDOWN_JITTER
+    global KIWI_SLOWDOWN_MAX_HELD_BYTES
+
+    _snapshot = snapshot
+    # Keep the module-level settings in sync for code which reads them directly
+    KIWI_REQUESTS_SLOWDOWN_DATETIME = snapshot.slowdown_datetime.isoformat()
+    KIWI_REQUESTS_RESTRICT_DATETIME = snapshot.restrict_datetime.isoformat()
+    KIWI_ENABLE_RESTRICTION_OF_REQUESTS = snapshot.enable_restriction_of_requests
+    KIWI_RESTRICT_USER_AGENT_MESSAGE = snapshot.restrict_user_agent_message
+    KIWI_USER_AGENT_BYPASS = str(snapshot.bypass)
+    KIWI_SLOWDOWN_MODE = snapshot.slowdown_mode
+    KIWI_SLOWDOWN_JITTER = snapshot.slowdown_jitter
+    KIWI_SLOWDOWN_MAX_HELD_BYTES = snapshot.slowdown_max_held_bytes
+    _published = _constants()
+    return snapshot
+
+
+def update(**values):
+    """Replace values of the current snapshot.
+
+    Usage::
+
+        settings.update(
+            restrict_datetime="2020-01-01T13:00:00",
+            enable_restriction_of_requests=True,
+        )
+
+    :param values: Fields of :class:`Snapshot` to replace, datetimes and booleans
+        can be provided as strings.
+    :rtype: :class:`Snapshot`
+    """
+    with _lock:
+        new_values = _snapshot._asdict()
+        new_values.update(values)
+        return _publish(Snapshot.create(**new_values))
+
+
+def reload_from_environ():
+    """Reload the settings from environment variables.
+
+    Variables which are not set fall back to the values from the time of import.
+
+    :rtype: :class:`Snapshot`
+    """
+    with _lock:
+        return _publish(Snapshot.from_environ())
+
+
+def reload_from_file(path):
+    """Reload the settings from a JSON file.
+
+    The file contains an object with environment variable names as keys, e.g.
+    ``{"KIWI_ENABLE_RESTRICTION_OF_REQUESTS": "false"}``. Missing keys fall back
+    to environment variables.
+
+    :param path: Path to the file.
+    :rtype: :class:`Snapshot`
+    """
+    with open(path) as f:
+        variables = json.load(f)
+
+    environ = dict(os.environ)
+    environ.update((key, str(value)) for key, value in variables.items())
+    with _lock:
+        return _publish(Snapshot.from_environ(environ))
+
+
+class FileWatcher(object):
+    """Reload the settings whenever modification time of a file changes.
+
+    The file is checked in a daemon thread, see :func:`watch_file`.
+
+    :param path: Path to the JSON file, see :func:`reload_from_file`.
+    :param interval: (optional) seconds between checks, ``1`` by default.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self._mtime = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kw-settings-watcher")
+        self._thread.daemon = True
+
+    def start(self):
+        self.check()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def check(self):
+        """Reload the settings if the file has been modified since the last check.
+
+        :return: Whether the settings have been reloaded.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            reload_from_file(self.path)
+        except Exception:
+            logging.exception("Unable to reload settings from %s", self.path)
+            return False
+        self._mtime = mtime
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+
+def watch_file(path, interval=1.0):
+    """Start watching a JSON file with settings, see :func:`reload_from_file`.
+
+    Usage::
+
+        from kw.platform import settings
+
+        watcher = settings.watch_file("/etc/kiwi-platform/settings.json")
+
+    :param path: Path to the file.
+    :param interval: (optional) seconds between checks of the modification time.
+    :rtype: :class:`FileWatcher`
+    """
+    return FileWatcher(path, interval=interval).start()
@@ -0,0 +1,139 @@
+"""
+Slowdown
+========
+
+Delaying of requests with invalid User-Agent header.
+
+By default, the middlewares call the handler first and then hold the finished
+response for as long as the handler took, see :obj:`AFTER`. With large responses
+and many non-compliant callers, the held responses inflate memory of the server,
+so the bytes held at once can be capped by
+:obj:`settings.KIWI_SLOWDOWN_MAX_HELD_BYTES`. Responses over the cap are sent
+without the delay and counted under the key ``user_agent.slowdown_skipped``.
+Responses are sized by their ``Content-Length`` header, WSGI bodies without it
+only if they are lists of chunks.
+
+Alternatively, requests can be delayed before the handler is called, see
+:obj:`BEFORE`. The duration of the handler is not known yet, so the delay is
+an exponentially weighted moving average of recent durations of the same route,
+optionally with random jitter.
+
+The settings can be reloaded at runtime, see :func:`kw.platform.settings.current`.
+
+Usage::
+
+    KIWI_SLOWDOWN_MODE=before KIWI_SLOWDOWN_JITTER=0.1
+"""
+
+import random
+import threading
+from collections import OrderedDict
+
+from . import metrics, profiling, settings
+
+
+#: Hold the response after the handler has finished, the default mode.
+AFTER = "after"
+
+#: Delay the request before the handler is called.
+BEFORE = "before"
+
+
+class DurationEstimator(object):
+    """Exponentially weighted moving average of handler durations per route.
+
+    At most ``max_routes`` routes are tracked, the least recently recorded route
+    is evicted when a new one comes, so paths with IDs can not grow the memory
+    without bounds nor push frequent routes out for good.
+
+    :param alpha: (optional) weight of the latest duration, ``0.2`` by default.
+    :param default: (optional) estimate of routes without any duration.
+    :param max_routes: (optional) maximum number of tracked routes.
+    """
+
+    def __init__(self, alpha=0.2, default=0.0, max_routes=1024):
+        self.alpha = alpha
+        self.default = default
+        self.max_routes = max_routes
+        self._durations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._durations)
+
+    def estimate(self, route):
+        """Return the estimated duration of the route in seconds."""
+        return self._durations.get(route, self.default)
+
+    def record(self, route, duration):
+        """Add a duration of the route in seconds to the average."""
+        with self._lock:
+            previous = self._durations.pop(route, None)
+            if previous is not None:
+                duration = previous + self.alpha * (duration - previous)
+            elif len(self._durations) >= self.max_routes:
+                self._durations.popitem(last=False)
+            self._durations[route] = duration
+
+
+class HeldBytes(object):
+    """Accounting of bytes held by delayed responses.
+
+    :param limit: (optional) maximum number of bytes held at once or a function
+        returning it, called on every :meth:`acquire`, no limit if :obj:`None`.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.held = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """Reserve bytes of a response which is going to be delayed.
+
+        :return: Whether the response fits under the limit.
+        """
+        limit = self.limit() if callable(self.limit) else self.limit
+        with self._lock:
+            if limit is not None and self.held + size > limit:
+                return False
+            self.held += size
+            return True
+
+    def release(self, size):
+        """Release bytes reserved by :meth:`acquire`."""
+        with self._lock:
+            self.held -= size
+
+
+#: Durations of routes shared by the middlewares of the process.
+durations = DurationEstimator()
+
+#: Bytes held by responses delayed in the :obj:`AFTER` mode.
+held_bytes = HeldBytes(lambda: settings.current().slowdown_max_held_bytes)
+
+
+def delays_before_handler():
+    """Check if requests are delayed before the handler is called."""
+    return settings.current().slowdown_mode == BEFORE
+
+
+def estimate_delay(route, jitter=None):
+    """Return the delay of a request to the route in the :obj:`BEFORE` mode.
+
+    :param route: Key of the route, e.g. ``GET /bookings/{id}``.
+    :param jitter: (optional) maximum relative deviation of the delay,
+        :obj:`settings.KIWI_SLOWDOWN_JITTER` by default.
+    """
+    delay = durations.estimate(route)
+    jitter = settings.current().slowdown_jitter if jitter is None else jitter
+    if jitter:
+        delay *= 1 + random.uniform(-jitter, jitter)
+    return max(delay, 0.0)
+
+
+def record_delay(seconds):
+    """Record the delay of a request in metrics and profiling."""
+    metrics.observe("user_agent.delay_seconds", seconds)
+    if profiling.enabled:
+        profiling.add(profiling.SLOWDOWN, seconds)
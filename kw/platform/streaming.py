@@ -0,0 +1,265 @@
+"""
+Streaming
+=========
+
+Incremental decoding of large JSON responses with bounded memory.
+
+The decoders are fed chunks of the response body and return records as soon as
+they are complete, the parsed part of the body is dropped from a buffer which is
+reused between chunks. Two formats are supported:
+
+* JSON lines (NDJSON), one JSON document per line, see :class:`NDJSONDecoder`,
+* a JSON array whose items are returned one by one, see :class:`JSONArrayDecoder`.
+
+Usage::
+
+    from kw.platform.requests import KiwiSession
+
+    session = KiwiSession()
+    for booking in session.stream_ndjson("GET", "https://kiwi.com/bookings"):
+        process(booking)
+
+See also :meth:`kw.platform.requests.KiwiSession.stream_ndjson` and
+:meth:`kw.platform.aiohttp.KiwiClientSession.stream_ndjson`.
+"""
+
+import re
+
+from . import serialization
+
+
+#: Maximum size of a single record in bytes, ``1 MiB`` by default.
+DEFAULT_MAX_RECORD_SIZE = 1024 * 1024
+
+#: Size of chunks read from responses in bytes.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Bytearrays, so membership of bytes works the same on Python 2 and 3
+_WHITESPACE = bytearray(b" \t\r\n")
+_OPENING = bytearray(b"[{")
+_CLOSING = bytearray(b"]}")
+_STRUCTURE_RE = re.compile(b'["\\[\\]{},]')
+_STRING_RE = re.compile(b'["\\\\]')
+
+_BEFORE_ARRAY, _BETWEEN_ITEMS, _IN_ITEM, _AFTER_ARRAY = range(4)
+
+
+class LimitExceeded(ValueError):
+    """A record or the whole body is larger than allowed."""
+
+
+class _Decoder(object):
+    def __init__(self, max_record_size=DEFAULT_MAX_RECORD_SIZE, max_body_size=None):
+        self.max_record_size = max_record_size
+        self.max_body_size = max_body_size
+        self.body_size = 0
+        self._buffer = bytearray()
+
+    def feed(self, chunk):
+        """Decode records completed by the chunk.
+
+        :param chunk: Next bytes of the body.
+        :return: List of decoded records.
+        :raises LimitExceeded: If a record or the body is larger than allowed.
+        :raises ValueError: If the body is not valid.
+        """
+        self.body_size += len(chunk)
+        if self.max_body_size is not None and self.body_size > self.max_body_size:
+            raise LimitExceeded("Body larger than {} bytes".format(self.max_body_size))
+        self._buffer += chunk
+
+        records = []
+        consumed = self._decode(records)
+        # Drop parsed bytes in place, the buffer keeps its allocation
+        del self._buffer[:consumed]
+        return records
+
+    def close(self):
+        """Decode records remaining at the end of the body.
+
+        :return: List of decoded records.
+        :raises ValueError: If the body is incomplete.
+        """
+        return []
+
+    def _check_record_size(self, size):
+        if self.max_record_size is not None and size > self.max_record_size:
+            raise LimitExceeded(
+                "Record larger than {} bytes".format(self.max_record_size)
+            )
+
+    @staticmethod
+    def _load(data):
+        return serialization.loads(data)
+
+
+class NDJSONDecoder(_Decoder):
+    """Incremental decoder of JSON lines.
+
+    Empty lines are skipped.
+
+    :param max_record_size: (optional) maximum size of a line in bytes,
+        :obj:`DEFAULT_MAX_RECORD_SIZE` by default, :obj:`None` for no limit.
+    :param max_body_size: (optional) maximum size of the body in bytes,
+        no limit by default.
+    """
+
+    def __init__(self, max_record_size=DEFAULT_MAX_RECORD_SIZE, max_body_size=None):
+        super(NDJSONDecoder, self).__init__(max_record_size, max_body_size)
+        self._scanned = 0
+
+    def _decode(self, records):
+        buffer = self._buffer
+        start = 0
+        while True:
+            end = buffer.find(b"\n", max(start, self._scanned))
+            if end == -1:
+                break
+            self._check_record_size(end - start)
+            if buffer[start:end].strip():
+                records.append(self._load(buffer[start:end]))
+            start = end + 1
+
+        self._check_record_size(len(buffer) - start)
+        # Do not search the incomplete line again on the next chunk
+        self._scanned = len(buffer) - start
+        return start
+
+    def close(self):
+        records = []
+        if self._buffer.strip():
+            records.append(self._load(self._buffer))
+        del self._buffer[:]
+        return records
+
+
+class JSONArrayDecoder(_Decoder):
+    """Incremental decoder of items of a JSON array.
+
+    :param max_record_size: (optional) maximum size of an item in bytes,
+        :obj:`DEFAULT_MAX_RECORD_SIZE` by default, :obj:`None` for no limit.
+    :param max_body_size: (optional) maximum size of the body in bytes,
+        no limit by default.
+    """
+
+    def __init__(self, max_record_size=DEFAULT_MAX_RECORD_SIZE, max_body_size=None):
+        super(JSONArrayDecoder, self).__init__(max_record_size, max_body_size)
+        self._state = _BEFORE_ARRAY
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+
+    def _skip_whitespace(self, pos, skip=_WHITESPACE):
+        buffer = self._buffer
+        while pos < len(buffer) and buffer[pos] in skip:
+            pos += 1
+        return pos
+
+    def _decode(self, records):
+        buffer = self._buffer
+        pos = self._pos
+        consumed = 0
+
+        while pos < len(buffer):
+            if self._state == _BEFORE_ARRAY:
+                pos = self._skip_whitespace(pos)
+                if pos == len(buffer):
+                    break
+                if buffer[pos] != ord(b"["):
+                    raise ValueError("Body is not a JSON array")
+                self._state = _BETWEEN_ITEMS
+                pos += 1
+                consumed = pos
+
+            elif self._state == _BETWEEN_ITEMS:
+                pos = self._skip_whitespace(pos, _WHITESPACE + bytearray(b","))
+                consumed = pos
+                if pos == len(buffer):
+                    break
+                if buffer[pos] == ord(b"]"):
+                    self._state = _AFTER_ARRAY
+                    pos += 1
+                    consumed = pos
+                else:
+                    self._state = _IN_ITEM
+                    self._start = pos
+                    self._depth = 0
+
+            elif self._state == _IN_ITEM:
+                pos = self._scan_item(records, pos)
+                if self._state == _IN_ITEM:
+                    break
+                consumed = pos
+
+            else:
+                pos = self._skip_whitespace(pos)
+                consumed = pos
+                if pos < len(buffer):
+                    raise ValueError("Extra data after the JSON array")
+
+        if self._state == _IN_ITEM:
+            self._check_record_size(len(buffer) - self._start)
+            self._start -= consumed
+        self._pos = pos - consumed
+        return consumed
+
+    def _scan_item(self, records, pos):
+        buffer = self._buffer
+        while True:
+            if self._in_string:
+                match = _STRING_RE.search(buffer, pos)
+                if match is None:
+                    return len(buffer)
+                if buffer[match.start()] == ord(b"\\"):
+                    if match.end() == len(buffer):
+                        # Escaped character is in the next chunk
+                        return match.start()
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _STRUCTURE_RE.search(buffer, pos)
+            if match is None:
+                return len(buffer)
+            char = buffer[match.start()]
+            pos = match.end()
+
+            if char == ord(b'"'):
+                self._in_string = True
+            elif char in _OPENING:
+                self._depth += 1
+            elif char in _CLOSING and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self._emit(records, pos)
+            elif self._depth == 0:
+                # Comma or closing bracket of the array after a scalar item
+                return self._emit(records, match.start())
+
+    def _emit(self, records, end):
+        start = self._start
+        self._check_record_size(end - start)
+        records.append(self._load(self._buffer[start:end]))
+        self._state = _BETWEEN_ITEMS
+        return end
+
+    def close(self):
+        if self._state != _AFTER_ARRAY:
+            raise ValueError("Incomplete JSON array")
+        return []
+
+
+def iter_records(chunks, decoder):
+    """Iterate over records decoded from chunks of a body.
+
+    :param chunks: Iterable of bytes.
+    :param decoder: :class:`NDJSONDecoder` or :class:`JSONArrayDecoder`.
+    """
+    for chunk in chunks:
+        for record in decoder.feed(chunk):
+            yield record
+    for record in decoder.close():
+        yield record
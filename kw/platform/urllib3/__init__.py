@@ -0,0 +1,33 @@
+"""
+urllib3
+=======
+
+Extensions and helpers patching kiwi code standards for ``urllib3`` library.
+"""
+from ..utils import ensure_module_is_available
+
+
+required_module = "urllib3"
+if ensure_module_is_available(required_module):
+    from .monkey import (
+        construct_user_agent,
+        patch,
+        patch_with_sentry,
+        patch_with_user_agent,
+        unpatch,
+    )
+
+    __all__ = [
+        "construct_user_agent",
+        "monkey",
+        "patch",
+        "patch_with_sentry",
+        "patch_with_user_agent",
+        "unpatch",
+    ]
+else:
+    from .._compat import ModuleNotFoundError  # pylint: disable=redefined-builtin
+
+    raise ModuleNotFoundError(
+        "Trying to patch missing module {!r}".format(required_module)
+    )
@@ -0,0 +1,97 @@
+"""
+Monkey Patching
+===============
+
+Patches of :meth:`urllib3.PoolManager.urlopen`, used also by :func:`urllib3.request`.
+Connection pools used directly, e.g. by :mod:`requests`, are not patched,
+see :mod:`kw.platform.requests` or :mod:`kw.platform.httplib`.
+"""
+
+import urllib3
+
+from .. import wrappers
+from ..utils import add_user_agent_header, construct_user_agent
+
+
+#: Interceptor of :meth:`urllib3.PoolManager.urlopen` running hooks of all patches.
+interceptor = wrappers.Interceptor("urllib3", "PoolManager.urlopen", outer=True)
+
+
+def _user_agent_hook(user_agent):
+    def _add_headers(instance, kwargs):
+        if kwargs.get("headers") is None:
+            # Keep the default headers of the pool manager
+            kwargs["headers"] = instance.headers.copy()
+        add_user_agent_header(kwargs["headers"], user_agent)
+
+    return _add_headers
+
+
+def patch_with_user_agent(user_agent=None):
+    """Patch :meth:`urllib3.PoolManager.urlopen` with User-Agent.
+
+    In case `User-Agent` header has not been provided directly to request.
+    Add `User-Agent` string constructed by
+    :func:`kw.platform.utils.construct_user_agent` as `User-Agent` header.
+
+    :param user_agent: (optional) User-Agent string that will be used as
+        `User-Agent` header.
+    """
+    if user_agent is None:
+        user_agent = construct_user_agent
+
+    interceptor.add_hook("user_agent", pre=_user_agent_hook(user_agent))
+    interceptor.patch()
+
+
+def patch_with_sentry(sunset_header=True, deprecated_usage_header=True, sampler=None):
+    """Patch :meth:`urllib3.PoolManager.urlopen` to create events in Sentry.
+
+    Works as :func:`kw.platform.requests.patch_with_sentry`.
+
+    :param sunset_header: (optional) Whether to report the presence of the ``Sunset``
+        header, :obj:`True` by default.
+    :param deprecated_usage_header: (optional) Whether to report the presence of the
+        ``Deprecated-Usage`` header, :obj:`True` by default.
+    :param sampler: (optional) :class:`kw.platform.utils.ReportSampler` deciding
+        which events are sent to Sentry, :obj:`kw.platform.utils.report_sampler`
+        by default.
+    """
+    interceptor.add_hook(
+        "sentry",
+        post=wrappers.sentry_hook(
+            sunset_header=sunset_header,
+            deprecated_usage_header=deprecated_usage_header,
+            sampler=sampler,
+        ),
+    )
+    interceptor.patch()
+
+
+def patch():
+    """Apply all patches for :mod:`urllib3` module.
+
+    This will automatically apply:
+
+    * :func:`kw.platform.urllib3.monkey.patch_with_user_agent`
+    * :func:`kw.platform.urllib3.monkey.patch_with_sentry`
+    """
+    if getattr(urllib3, "__kiwi_platform_patch", False):
+        # Already patched, skip
+        return
+
+    patch_with_user_agent()
+    patch_with_sentry()
+
+    # Mark module as patched
+    setattr(urllib3, "__kiwi_platform_patch", True)
+
+
+def unpatch():
+    """Remove all patches of :mod:`urllib3` module.
+
+    Restores the original :meth:`urllib3.PoolManager.urlopen`.
+    """
+    interceptor.unpatch()
+    if hasattr(urllib3, "__kiwi_platform_patch"):
+        delattr(urllib3, "__kiwi_platform_patch")
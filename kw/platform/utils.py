@@ -3,16 +3,21 @@ Utils
 =====
 """
 
+import abc
+import atexit
 import importlib
 import logging
 import os
+import random
 import re
+import threading
+from collections import Counter, namedtuple
 from datetime import datetime
 
-from dateutil.parser import parse
-
-from . import settings
+from . import counters, metrics, profiling, serialization, settings
+from ._compat import ABC
 from ._compat import ModuleNotFoundError  # pylint: disable=redefined-builtin
+from .load import PASS, SLOWDOWN
 
 
 try:
@@ -27,32 +32,261 @@ USER_AGENT_RE = re.compile(
     r"^(?P<name>\S.+?)\/(?P<version>\S.+?) "
     r"\([Kk]iwi\.com (?P<environment>\S.+?)\)(?: ?(?P<system_info>.*))$"
 )
-REQ_SLOWDOWN_DATETIME = parse(settings.KIWI_REQUESTS_SLOWDOWN_DATETIME)
-REQ_RESTRICT_DATETIME = parse(settings.KIWI_REQUESTS_RESTRICT_DATETIME)
+
+#: Deprecated, the slowdown datetime at the time of import, not updated when
+#: the settings are reloaded. Use :func:`kw.platform.settings.current`.
+REQ_SLOWDOWN_DATETIME = settings.current().slowdown_datetime
+
+#: Deprecated, the restrict datetime at the time of import, not updated when
+#: the settings are reloaded. Use :func:`kw.platform.settings.current`.
+REQ_RESTRICT_DATETIME = settings.current().restrict_datetime
+
+SUNSET = "sunset"
+DEPRECATED_USAGE = "deprecated_usage"
 
 
 class UserAgentValidator:
-    def __init__(self, value):
+    """Validate User-Agent and decide what to do with the request.
+
+    By default, requests from non-compliant clients are slowed down or refused based
+    on :obj:`settings.KIWI_REQUESTS_SLOWDOWN_DATETIME` and
+    :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`. If ``load`` is provided,
+    the decision is based on the current level of the load monitor instead.
+
+    :param value: User-Agent string.
+    :param load: (optional) :class:`kw.platform.load.LoadMonitor`.
+    """
+
+    def __init__(self, value, load=None):
         self.value = value
         self.is_valid = bool(self.value and USER_AGENT_RE.match(self.value))
+        #: Snapshot of the settings taken once for the whole validation.
+        self.settings = settings.current()
+        self.load_level = None if load is None else load.level
 
     @property
     def ok(self):
-        return datetime.utcnow() < REQ_SLOWDOWN_DATETIME or self.is_valid
+        if self.load_level is not None:
+            return self.is_valid or self.load_level == PASS
+        return datetime.utcnow() < self.settings.slowdown_datetime or self.is_valid
 
     @property
     def slowdown(self):
-        if not settings.KIWI_ENABLE_RESTRICTION_OF_REQUESTS:
+        if not self.settings.enable_restriction_of_requests:
             return False
-        return not self.ok and datetime.utcnow() < REQ_RESTRICT_DATETIME
+        if self.load_level is not None:
+            return not self.ok and self.load_level == SLOWDOWN
+        return not self.ok and datetime.utcnow() < self.settings.restrict_datetime
 
     @property
     def restrict(self):
-        if not settings.KIWI_ENABLE_RESTRICTION_OF_REQUESTS:
+        if not self.settings.enable_restriction_of_requests:
             return False
         return not self.ok and not self.slowdown
 
 
+class ValidationResults(object):
+    """Columnar results of :func:`validate_many`.
+
+    All columns are aligned with the order of the validated values. Parsed fields
+    of invalid values are :obj:`None`.
+
+    :ivar valid: Bit array of validity, bit ``i % 8`` of byte ``i // 8`` belongs to
+        the ``i``-th value, use :meth:`is_valid` to read it.
+    :ivar names: List of service names.
+    :ivar versions: List of versions.
+    :ivar environments: List of environments.
+    :ivar system_infos: List of system information strings.
+    :ivar unique: Number of distinct validated values.
+    """
+
+    def __init__(self, size, valid, names, versions, environments, system_infos):
+        self.size = size
+        self.valid = valid
+        self.names = names
+        self.versions = versions
+        self.environments = environments
+        self.system_infos = system_infos
+        self.unique = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self.is_valid(index)
+
+    def is_valid(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("index out of range")
+        return bool(self.valid[index >> 3] & (1 << (index & 7)))
+
+    def count_valid(self):
+        return sum(bin(byte).count("1") for byte in self.valid)
+
+
+def validate_many(values):
+    """Validate many User-Agent strings at once.
+
+    Every distinct value is validated only once, results of duplicates share the
+    parsed fields.
+
+    Usage::
+
+        from kw.platform.utils import validate_many
+
+        results = validate_many(["mambo/1a (Kiwi.com dev)", "curl/7.64.1"])
+        results.is_valid(0)  # True
+        results.names  # ["mambo", None]
+
+    :param values: Iterable of User-Agent strings.
+    :rtype: :class:`ValidationResults`
+    """
+    parsed_values = {}
+    invalid = (None, None, None, None, False)
+    valid = bytearray()
+    names, versions, environments, system_infos = [], [], [], []
+
+    size = 0
+    byte = 0
+    for value in values:
+        parsed = parsed_values.get(value)
+        if parsed is None:
+            match = value and USER_AGENT_RE.match(value)
+            if match:
+                parsed = match.group("name", "version", "environment", "system_info")
+                parsed += (True,)
+            else:
+                parsed = invalid
+            parsed_values[value] = parsed
+
+        names.append(parsed[0])
+        versions.append(parsed[1])
+        environments.append(parsed[2])
+        system_infos.append(parsed[3])
+        if parsed[4]:
+            byte |= 1 << (size & 7)
+        size += 1
+        if not size & 7:
+            valid.append(byte)
+            byte = 0
+
+    if size & 7:
+        valid.append(byte)
+
+    results = ValidationResults(
+        size, valid, names, versions, environments, system_infos
+    )
+    results.unique = len(parsed_values)
+    return results
+
+
+def record_validation(user_agent):
+    """Record the outcome of the validation of a request in :mod:`counters`.
+
+    Only requests with invalid User-Agent are recorded, under the keys
+    ``user_agent.invalid``, ``user_agent.slowdown`` and ``user_agent.restrict``.
+    The User-Agent is also added to :obj:`counters.offenders`.
+
+    :param user_agent: Validator of the request's User-Agent.
+    :type user_agent: :class:`UserAgentValidator`
+    """
+    metrics.incr("user_agent.validated")
+    if user_agent.is_valid:
+        return
+
+    counters.incr("user_agent.invalid")
+    counters.offenders.add(user_agent.value)
+    if user_agent.restrict:
+        counters.incr("user_agent.restrict")
+    elif user_agent.slowdown:
+        counters.incr("user_agent.slowdown")
+
+
+def is_bypassed(method, path, user_agent=None, count=True):
+    """Check if the request skips the validation of the User-Agent header.
+
+    Matched requests are counted under the key ``user_agent.bypassed``,
+    see :class:`kw.platform.bypass.BypassRules`.
+
+    :param method: HTTP method of the request.
+    :param path: Path of the request.
+    :param user_agent: (optional) User-Agent header of the request.
+    :param count: (optional) whether to count the matched request,
+        ``True`` by default.
+    """
+    rules = settings.current().bypass
+    return rules.match(method, path, user_agent, count=count) is not None
+
+
+def validate_request(method, path, user_agent, load=None):
+    """Validate the User-Agent header of a request and record the outcome.
+
+    :param method: HTTP method of the request.
+    :param path: Path of the request.
+    :param user_agent: User-Agent header of the request.
+    :param load: (optional) :class:`kw.platform.load.LoadMonitor`.
+    :return: :class:`UserAgentValidator` or :obj:`None` if the request
+        skips the validation, see :func:`is_bypassed`.
+    """
+    start = profiling.clock() if profiling.enabled else None
+    try:
+        if is_bypassed(method, path, user_agent):
+            return None
+        validator = UserAgentValidator(user_agent, load=load)
+        record_validation(validator)
+        return validator
+    finally:
+        if start is not None:
+            profiling.add(profiling.VALIDATE, profiling.clock() - start)
+
+
+#: Pre-serialized response to requests refused because of invalid User-Agent.
+#:
+#: :ivar body: JSON body in bytes.
+#: :ivar headers: Tuple of ``(name, value)`` pairs including ``Content-Length``.
+#: :ivar close: Whether to close the connection after the response.
+Refusal = namedtuple("Refusal", ["body", "headers", "close"])
+
+_refusal = (None, None)
+
+
+def refusal(snapshot=None):
+    """Return the response to requests refused because of invalid User-Agent.
+
+    The body and headers are serialized once and reused until the settings
+    or the JSON backend change. See :obj:`settings.KIWI_REFUSAL_CLOSE_CONNECTION`
+    and :obj:`settings.KIWI_REFUSAL_RETRY_AFTER`.
+
+    :param snapshot: (optional) :class:`kw.platform.settings.Snapshot` with the
+        message, the current settings by default.
+    :rtype: :class:`Refusal`
+    """
+    global _refusal
+    snapshot = snapshot or settings.current()
+    key = (
+        snapshot,
+        serialization.backend(),
+        settings.KIWI_REFUSAL_CLOSE_CONNECTION,
+        settings.KIWI_REFUSAL_RETRY_AFTER,
+    )
+    cached_key, cached = _refusal
+    if cached_key == key:
+        return cached
+
+    message = snapshot.restrict_user_agent_message
+    body = serialization.dumps({"message": message}).encode("utf-8")
+    headers = [
+        ("Content-Type", "application/json; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+    ]
+    if settings.KIWI_REFUSAL_RETRY_AFTER is not None:
+        headers.append(("Retry-After", str(settings.KIWI_REFUSAL_RETRY_AFTER)))
+    response = Refusal(body, tuple(headers), bool(key[2]))
+    _refusal = (key, response)
+    return response
+
+
 def ensure_module_is_available(module):
     try:
         importlib.import_module(module)
@@ -89,19 +323,24 @@ def construct_user_agent(app_name=None, package_version=None, app_environment=No
 
 
 def add_user_agent_header(headers, user_agent):
-    if not headers.get("User-Agent"):
-        custom_agent = user_agent() if callable(user_agent) else user_agent
-        if custom_agent:
-            headers["User-Agent"] = custom_agent
-        else:
-            # If no user_agent nor env vars has been provided, request can't be
-            # patched.
-            raise ValueError(
-                "Unable to patch requests 'User-Agent' header. You have to provide"
-                " either environment variables or patch manually using "
-                "functions `construct_user_agent` and `patch_with_user_agent`."
-                "You can find more info in README."
-            )
+    start = profiling.clock() if profiling.enabled else None
+    try:
+        if not headers.get("User-Agent"):
+            custom_agent = user_agent() if callable(user_agent) else user_agent
+            if custom_agent:
+                headers["User-Agent"] = custom_agent
+            else:
+                # If no user_agent nor env vars has been provided, request can't be
+                # patched.
+                raise ValueError(
+                    "Unable to patch requests 'User-Agent' header. You have to"
+                    " provide either environment variables or patch manually using "
+                    "functions `construct_user_agent` and `patch_with_user_agent`."
+                    "You can find more info in README."
+                )
+    finally:
+        if start is not None:
+            profiling.add(profiling.USER_AGENT_HEADER, profiling.clock() - start)
 
 
 def capture_message(message, level="info"):
@@ -117,42 +356,325 @@ def capture_message(message, level="info"):
         getattr(logging, level)(message)
 
 
-def report_to_sentry(response, sunset_header=True, deprecated_usage_header=True):
-    """Report response headers to Sentry.
+class ReportSampler(object):
+    """Sample events reported to Sentry by :func:`report_to_sentry`.
 
-    Reports the following headers:
+    Every event increments the :attr:`seen` counter of its header type, so the volume
+    stays visible even if most of the events are never sent to Sentry. An event is
+    captured right away with the probability configured for its header type.
 
-    - ``Sunset`` or ``sunset`` relation type in ``Link`` header
-    - ``Deprecated-Usage``
+    Events which have been sampled out are offered to a reservoir which keeps
+    ``reservoir_size`` uniformly chosen events per ``window`` seconds, the window
+    starts with the first event offered. These events are captured by a timer
+    thread once the window is over, outside of the Sentry scope of any request,
+    or on :meth:`flush`, which also runs at the exit of the interpreter. This
+    guarantees that a few representative events get reported even with very low
+    rates.
 
-    :param sunset_header: Whether to report the ``Sunset`` header.
-    :param deprecated_usage_header: Whether to report the ``Deprecated-Usage`` header.
+    Usage::
+
+        from kw.platform.utils import ReportSampler
+
+        sampler = ReportSampler(
+            rates={"sunset": 0.01, "deprecated_usage": 0.1}, reservoir_size=3
+        )
+
+    :param rates: (optional) probability of capturing an event, either a float
+        used for all header types or a dict mapping header types to probabilities,
+        ``1.0`` by default.
+    :param reservoir_size: (optional) number of sampled out events captured per
+        window, ``0`` (disabled) by default.
+    :param window: (optional) length of the reservoir window in seconds.
+    """
+
+    def __init__(self, rates=1.0, reservoir_size=0, window=60.0):
+        self.rates = rates
+        self.reservoir_size = reservoir_size
+        self.window = window
+        #: Number of events per header type.
+        self.seen = Counter()
+        #: Number of events per header type which have been captured.
+        self.reported = Counter()
+        self._lock = threading.Lock()
+        self._window_seen = 0
+        self._reservoir = []
+        self._timer = None
+        self._flush_at_exit = False
+
+    def rate(self, header_type):
+        if isinstance(self.rates, dict):
+            return self.rates.get(header_type, 1.0)
+        return self.rates
+
+    def sample(self, header_type, message, level="warning"):
+        """Record an event and capture it if it has been sampled in.
+
+        :param header_type: Type of the reported header, e.g. ``sunset``.
+        :param message: Message to capture.
+        :param level: Level of the message, ``warning`` by default.
+        """
+        with self._lock:
+            self.seen[header_type] += 1
+        counters.incr(header_type + ".seen")
+        if random.random() < self.rate(header_type):
+            self._capture(header_type, message, level)
+        elif self.reservoir_size > 0:
+            self._offer((header_type, message, level))
+
+    def flush(self):
+        """Capture all events waiting in the reservoir and start a new window."""
+        with self._lock:
+            events, self._reservoir = self._reservoir, []
+            self._window_seen = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for event in events:
+            self._capture(*event)
+
+    def _capture(self, header_type, message, level):
+        with self._lock:
+            self.reported[header_type] += 1
+        counters.incr(header_type + ".reported")
+        capture_message(message, level=level)
+
+    def _start_window(self):
+        self._timer = threading.Timer(self.window, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+        if not self._flush_at_exit:
+            atexit.register(self.flush)
+            self._flush_at_exit = True
+
+    def _offer(self, event):
+        with self._lock:
+            if self._timer is None:
+                self._start_window()
+            self._window_seen += 1
+            if len(self._reservoir) < self.reservoir_size:
+                self._reservoir.append(event)
+            else:
+                index = random.randrange(self._window_seen)
+                if index < self.reservoir_size:
+                    self._reservoir[index] = event
+
+
+#: Sampler used by :func:`report_to_sentry` unless a different one is provided,
+#: configured by :obj:`settings.KIWI_SUNSET_REPORT_RATE`,
+#: :obj:`settings.KIWI_DEPRECATED_USAGE_REPORT_RATE`,
+#: :obj:`settings.KIWI_REPORT_RESERVOIR_SIZE`
+#: and :obj:`settings.KIWI_REPORT_RESERVOIR_WINDOW`.
+report_sampler = ReportSampler(
+    rates={
+        SUNSET: settings.KIWI_SUNSET_REPORT_RATE,
+        DEPRECATED_USAGE: settings.KIWI_DEPRECATED_USAGE_REPORT_RATE,
+    },
+    reservoir_size=settings.KIWI_REPORT_RESERVOIR_SIZE,
+    window=settings.KIWI_REPORT_RESERVOIR_WINDOW,
+)
+
+
+def parse_link_header(value):
+    """Parse the ``Link`` HTTP header into a dict keyed by relation types.
+
+    The result has the same format as :attr:`requests.Response.links`.
+
+    :param value: Value of the ``Link`` header.
+    :rtype: dict
     """
-    if sunset_header:
+    links = {}
+    replace_chars = " '\""
+    value = value.strip(replace_chars)
+    if not value:
+        return links
+
+    for link_value in re.split(", *<", value):
+        url, _, params = link_value.partition(";")
+        link = {"url": url.strip("<> '\"")}
+        for param in params.split(";"):
+            key, sep, param_value = param.partition("=")
+            if not sep:
+                break
+            link[key.strip(replace_chars)] = param_value.strip(replace_chars)
+        links[link.get("rel") or link["url"]] = link
+
+    return links
+
+
+class ResponseInspector(ABC):
+    """Base class for inspectors of HTTP response headers.
+
+    Inspectors are run by :class:`InspectorPipeline` only if the response contains
+    at least one of the :attr:`headers` they declare, the pipeline reads the values
+    of the headers and passes them to :meth:`inspect`, which subclasses implement.
+    """
+
+    #: Type of reported headers, used for sampling and for disabling the inspector.
+    header_type = None
+    #: Names of the headers the inspector cares about.
+    headers = ()
+
+    @abc.abstractmethod
+    def inspect(self, values, sampler):
+        """Inspect response headers and report findings.
+
+        :param values: Dict of values of the watched headers present in the
+            response by their names as declared in :attr:`headers`, multiple values
+            of a header are joined by commas.
+        :param sampler: :class:`ReportSampler` used for reporting.
+        """
+
+
+class SunsetInspector(ResponseInspector):
+    """Report the ``Sunset`` header and the ``sunset`` relation type in ``Link``.
+
+    The ``Link`` header is parsed only if it mentions the ``sunset`` relation type.
+    """
+
+    header_type = SUNSET
+    headers = ("Sunset", "Link")
+
+    def inspect(self, values, sampler):
         sunset_warning = ""
 
-        if "Sunset" in response.headers:
+        if "Sunset" in values:
             sunset_warning += (
                 "The Sunset header found in the HTTP response: "
-                "{}".format(response.headers["Sunset"])
+                "{}".format(values["Sunset"])
             )
-        if "sunset" in response.links:
-            if sunset_warning:
-                sunset_warning += ", additional info: "
-            else:
-                sunset_warning += (
-                    "The Sunset Link relation type found in the HTTP response: "
-                )
-            sunset_warning += str(response.links["sunset"]["url"])
+
+        link = values.get("Link")
+        if link and "sunset" in link.lower():
+            links = parse_link_header(link)
+            if "sunset" in links:
+                if sunset_warning:
+                    sunset_warning += ", additional info: "
+                else:
+                    sunset_warning += (
+                        "The Sunset Link relation type found in the HTTP response: "
+                    )
+                sunset_warning += str(links["sunset"]["url"])
 
         if sunset_warning:
-            capture_message(sunset_warning, level="warning")
+            sampler.sample(self.header_type, sunset_warning, level="warning")
 
-    if deprecated_usage_header:
-        deprecated_usage_warning = response.headers.get("Deprecated-Usage")
+
+class DeprecatedUsageInspector(ResponseInspector):
+    """Report the ``Deprecated-Usage`` header."""
+
+    header_type = DEPRECATED_USAGE
+    headers = ("Deprecated-Usage",)
+
+    def inspect(self, values, sampler):
+        deprecated_usage_warning = values.get("Deprecated-Usage")
 
         if deprecated_usage_warning:
-            capture_message(deprecated_usage_warning, level="warning")
+            sampler.sample(self.header_type, deprecated_usage_warning, level="warning")
+
+
+class InspectorPipeline(object):
+    """Run response inspectors in a single pass over the response headers.
+
+    The pipeline reads each header declared by its inspectors once and runs only
+    the inspectors whose headers are present, passing them the values read,
+    so responses without any relevant header cost one lookup per watched header.
+
+    :param inspectors: (optional) iterable of :class:`ResponseInspector` instances.
+    """
+
+    def __init__(self, inspectors=()):
+        self.inspectors = ()
+        self._watched = ()
+        for inspector in inspectors:
+            self.register(inspector)
+
+    def register(self, inspector):
+        """Add an inspector to the end of the pipeline."""
+        self._update(self.inspectors + (inspector,))
+
+    def unregister(self, inspector):
+        """Remove an inspector from the pipeline."""
+        self._update(tuple(i for i in self.inspectors if i is not inspector))
+
+    def _update(self, inspectors):
+        watched = []
+        for inspector in inspectors:
+            watched.extend(h for h in inspector.headers if h not in watched)
+        # Replace both attributes at once, so concurrent runs see a consistent state
+        self.inspectors, self._watched = inspectors, tuple(watched)
+
+    def run(self, response, sampler=None, skip=()):
+        """Run inspectors interested in the headers of the response.
+
+        :param response: Response object with case-insensitive ``headers``,
+            e.g. :class:`requests.Response` or :class:`aiohttp.ClientResponse`.
+        :param sampler: (optional) :class:`ReportSampler` used for reporting,
+            :obj:`report_sampler` by default.
+        :param skip: (optional) header types of inspectors which should not run.
+        """
+        headers = response.headers
+        # Multidicts of aiohttp and messages of http.client return only the first
+        # value of repeated headers from `get`
+        get_all = getattr(headers, "getall", None) or getattr(headers, "get_all", None)
+        values = {}
+        for name in self._watched:
+            if get_all is None:
+                value = headers.get(name)
+            else:
+                value = get_all(name, None)
+                value = ", ".join(value) if value else None
+            if value is not None:
+                values[name] = value
+        if not values:
+            return
+
+        if sampler is None:
+            sampler = report_sampler
+        for inspector in self.inspectors:
+            if inspector.header_type in skip:
+                continue
+            if any(name in values for name in inspector.headers):
+                inspector.inspect(values, sampler)
+
+
+#: Pipeline used by :func:`report_to_sentry`, register additional
+#: :class:`ResponseInspector` instances here.
+inspectors = InspectorPipeline([SunsetInspector(), DeprecatedUsageInspector()])
+
+
+def report_to_sentry(
+    response, sunset_header=True, deprecated_usage_header=True, sampler=None
+):
+    """Report response headers to Sentry.
+
+    Reports the following headers:
+
+    - ``Sunset`` or ``sunset`` relation type in ``Link`` header
+    - ``Deprecated-Usage``
+
+    The headers are reported by inspectors registered in :obj:`inspectors`.
+
+    :param sunset_header: Whether to report the ``Sunset`` header.
+    :param deprecated_usage_header: Whether to report the ``Deprecated-Usage`` header.
+    :param sampler: (optional) :class:`ReportSampler` deciding which events are
+        captured, :obj:`report_sampler` by default.
+    """
+    start = profiling.clock() if profiling.enabled else None
+    try:
+        skip = ()
+        if not sunset_header or not deprecated_usage_header:
+            skip = [
+                header_type
+                for header_type, enabled in (
+                    (SUNSET, sunset_header),
+                    (DEPRECATED_USAGE, deprecated_usage_header),
+                )
+                if not enabled
+            ]
+        inspectors.run(response, sampler=sampler, skip=skip)
+    finally:
+        if start is not None:
+            profiling.add(profiling.SENTRY, profiling.clock() - start)
 
 
 def httpdate(dt):
@@ -183,3 +705,174 @@ def httpdate(dt):
         "{weekday}, {dt.day:02d} {month} {dt.year:04d} "
         "{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d} GMT"
     ).format(weekday=weekday, month=month, dt=dt)
+
+
+def render_sunset_headers(when=None, info_url=None):
+    """Render the ``Sunset`` and ``Link`` HTTP headers of a deprecated resource.
+
+    :param when: When the Sunset date arrives, must be UTC.
+    :type when: datetime
+    :param info_url: URL to a page with more information about the Sunset.
+    :type info_url: str
+    :return: List of ``(name, value)`` pairs.
+    :rtype: list
+    """
+    headers = []
+    if info_url:
+        headers.append(("Link", '<{}>;rel="sunset"'.format(info_url)))
+    if when:
+        headers.append(("Sunset", httpdate(when)))
+    return headers
+
+
+class SunsetRegistry(object):
+    """Application-level registry of deprecated routes.
+
+    Headers are rendered once on registration, so sunset middlewares only look up
+    the route and append the prepared headers to the response.
+
+    Usage::
+
+        from kw.platform.utils import SunsetRegistry
+
+        sunsets = SunsetRegistry()
+        sunsets.register("/v1/users", when=datetime(2020, 8, 1, 10, 0, 0))
+
+    See :func:`kw.platform.aiohttp.middlewares.sunset_middleware` and
+    :func:`kw.platform.wsgi.sunset_middleware`.
+    """
+
+    def __init__(self):
+        self._headers = {}
+        self._raw_headers = {}
+
+    def register(self, route, when=None, info_url=None):
+        """Mark a route as deprecated.
+
+        :param route: Key of the route, e.g. the path of the resource.
+        :param when: When the Sunset date arrives, must be UTC.
+        :type when: datetime
+        :param info_url: URL to a page with more information about the Sunset.
+        :type info_url: str
+        """
+        if when is None and info_url is None:
+            raise TypeError("function takes at least one argument (0 given)")
+        headers = tuple(render_sunset_headers(when, info_url))
+        self._headers[route] = headers
+        self._raw_headers[route] = tuple(
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers
+        )
+
+    def unregister(self, route):
+        self._headers.pop(route, None)
+        self._raw_headers.pop(route, None)
+
+    def get(self, route):
+        """Return the rendered headers of a route or :obj:`None`."""
+        return self._headers.get(route)
+
+    def get_raw(self, route):
+        """Return the rendered headers of a route as bytes or :obj:`None`.
+
+        Header names are lowercase, as required by ASGI.
+        """
+        return self._raw_headers.get(route)
+
+    def __contains__(self, route):
+        return route in self._headers
+
+    def __len__(self):
+        return len(self._headers)
+
+
+class DeprecationRegistry(object):
+    """Registry of deprecated routes and parameters with accounting of their callers.
+
+    Responses of requests using a deprecated route or parameter get the
+    ``Deprecated-Usage`` header rendered once on registration. Calling services
+    are counted by the name parsed from their User-Agent header in a table of
+    constant size, see :class:`kw.platform.counters.SpaceSaving`, so it is known
+    who still depends on the API before it is removed.
+
+    Usage::
+
+        from kw.platform.utils import DeprecationRegistry
+
+        deprecations = DeprecationRegistry()
+        deprecations.register(
+            "/v1/users", "Parameter 'sort' is deprecated", parameters=["sort"]
+        )
+
+        deprecations.usage()  # [("/v1/users", "mambo", 42, 0)]
+
+    See :func:`kw.platform.aiohttp.utils.deprecated_usage` and
+    :func:`kw.platform.wsgi.deprecation_middleware`.
+
+    :param capacity: (optional) number of tracked pairs of routes and callers,
+        ``1000`` by default.
+    """
+
+    def __init__(self, capacity=1000):
+        self._entries = {}
+        #: The most frequent pairs of deprecated routes and calling services.
+        self.callers = counters.SpaceSaving(capacity)
+
+    def register(self, route, message, parameters=()):
+        """Mark a route or its parameters as deprecated.
+
+        :param route: Key of the route, e.g. the path of the resource.
+        :param message: Value of the ``Deprecated-Usage`` header.
+        :param parameters: (optional) names of deprecated query parameters,
+            the whole route is deprecated if empty.
+        """
+        headers = (("Deprecated-Usage", message),)
+        self._entries[route] = (headers, frozenset(parameters))
+
+    def unregister(self, route):
+        self._entries.pop(route, None)
+
+    def __contains__(self, route):
+        return route in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def match(self, route, parameters=(), user_agent=None):
+        """Return the headers if the request uses the deprecated API.
+
+        Matched requests are recorded in :attr:`callers`.
+
+        :param route: Key of the route.
+        :param parameters: (optional) names of query parameters of the request.
+        :param user_agent: (optional) User-Agent header of the request.
+        :return: Tuple of ``(name, value)`` pairs or :obj:`None`.
+        """
+        entry = self._entries.get(route)
+        if entry is None:
+            return None
+        headers, deprecated_parameters = entry
+        if deprecated_parameters and deprecated_parameters.isdisjoint(parameters):
+            return None
+
+        match = user_agent and USER_AGENT_RE.match(user_agent)
+        caller = match.group("name") if match else "unknown"
+        self.callers.add((route, caller))
+        metrics.incr("deprecated_usage.served")
+        return headers
+
+    def usage(self, k=None):
+        """Return the most frequent callers of deprecated routes.
+
+        :param k: (optional) number of entries, all tracked entries by default.
+        :return: List of ``(route, caller, count, error)`` tuples sorted by count,
+            see :meth:`kw.platform.counters.SpaceSaving.top`.
+        """
+        return [
+            (route, caller, count, error)
+            for (route, caller), count, error in self.callers.top(k)
+        ]
+
+
+#: Registry used by :func:`kw.platform.aiohttp.utils.deprecated_usage` by default.
+deprecations = DeprecationRegistry()
@@ -1,23 +1,199 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import wrapt
+
+from ._compat import ContextVar
+from .deadline import apply_deadline, requests_timeout
 from .utils import add_user_agent_header, report_to_sentry
 
 
-def add_user_agent(user_agent=None):
-    def _add_headers(func, instance, args, kwargs):
-        headers = kwargs.setdefault("headers", {})
-        add_user_agent_header(headers, user_agent)
-        return func(*args, **kwargs)
+# Names of hooks run for the current call by an interceptor or a session of
+# a higher-level library, e.g. requests on top of http.client
+_handled = ContextVar("kw_platform_handled_hooks", default=frozenset())
+
+
+def handled(name):
+    """Check if hooks of the name run for the current call in a higher-level library.
+
+    Hooks of lower-level libraries, see :mod:`kw.platform.httplib`, use it to skip
+    requests which have already been handled.
+
+    :param name: Name of the hooks, e.g. ``"sentry"``.
+    """
+    return name in _handled.get()
+
+
+@contextmanager
+def handling(*names):
+    """Mark hooks of the names as handled for calls made inside the block.
+
+    :param names: Names of the hooks, e.g. ``"user_agent"``.
+    """
+    token = _handled.set(_handled.get().union(names))
+    try:
+        yield
+    finally:
+        _handled.reset(token)
+
+
+def user_agent_hook(user_agent=None):
+    def _add_headers(instance, kwargs):
+        if kwargs.get("headers") is None:
+            kwargs["headers"] = {}
+        add_user_agent_header(kwargs["headers"], user_agent)
 
     return _add_headers
 
 
-def add_sentry_handler(sunset_header=True, deprecated_usage_header=True):
-    def _check_headers(func, instance, args, kwargs):
-        response = func(*args, **kwargs)
+def sentry_hook(sunset_header=True, deprecated_usage_header=True, sampler=None):
+    def _check_headers(instance, response):
         report_to_sentry(
             response,
             sunset_header=sunset_header,
             deprecated_usage_header=deprecated_usage_header,
+            sampler=sampler,
         )
+
+    return _check_headers
+
+
+def deadline_hook(limit_timeout=requests_timeout):
+    def _apply_deadline(instance, kwargs):
+        apply_deadline(kwargs, limit_timeout)
+
+    return _apply_deadline
+
+
+def add_user_agent(user_agent=None):
+    hook = user_agent_hook(user_agent)
+
+    def _add_headers(func, instance, args, kwargs):
+        hook(instance, kwargs)
+        return func(*args, **kwargs)
+
+    return _add_headers
+
+
+def add_sentry_handler(sunset_header=True, deprecated_usage_header=True, sampler=None):
+    hook = sentry_hook(sunset_header, deprecated_usage_header, sampler)
+
+    def _check_headers(func, instance, args, kwargs):
+        response = func(*args, **kwargs)
+        hook(instance, response)
         return response
 
     return _check_headers
+
+
+def add_deadline(limit_timeout=requests_timeout):
+    hook = deadline_hook(limit_timeout)
+
+    def _apply_deadline(func, instance, args, kwargs):
+        hook(instance, kwargs)
+        return func(*args, **kwargs)
+
+    return _apply_deadline
+
+
+class Interceptor(object):
+    """Single wrapper of a function running registered hooks on every call.
+
+    Pre-request hooks are called with ``(instance, kwargs)`` and may modify the
+    keyword arguments of the call, post-response hooks are called with
+    ``(instance, response)``. All hooks run in one wrapper frame and can be added
+    or removed at runtime.
+
+    Usage::
+
+        interceptor = Interceptor("requests", "Session.request")
+        interceptor.add_hook("user_agent", pre=user_agent_hook())
+        interceptor.patch()
+
+    :param module: Name of the module, e.g. ``"requests"``.
+    :param name: Path of the wrapped function in the module,
+        e.g. ``"Session.request"``.
+    :param outer: (optional) whether the hooks are marked as handled during
+        the call, so hooks of the same names of lower-level libraries skip it,
+        see :func:`handled`. ``False`` by default.
+    """
+
+    def __init__(self, module, name, outer=False):
+        self.module = module
+        self.name = name
+        self.outer = outer
+        self._hooks = OrderedDict()
+        self._names = frozenset()
+        self._pre_hooks = ()
+        self._post_hooks = ()
+        self._lock = threading.RLock()
+
+    @property
+    def hooks(self):
+        """Names of registered hooks in the order they run."""
+        return list(self._hooks)
+
+    def add_hook(self, name, pre=None, post=None):
+        """Register hooks under the name, replacing hooks registered before.
+
+        :param name: Name of the hooks.
+        :param pre: (optional) function called before the wrapped function.
+        :param post: (optional) function called with its result.
+        """
+        with self._lock:
+            self._hooks[name] = (pre, post)
+            self._update_hooks()
+
+    def remove_hook(self, name):
+        """Remove hooks registered under the name."""
+        with self._lock:
+            self._hooks.pop(name, None)
+            self._update_hooks()
+
+    def _update_hooks(self):
+        # Calls iterate over immutable tuples, so they never need the lock
+        hooks = list(self._hooks.values())
+        self._names = frozenset(self._hooks)
+        self._pre_hooks = tuple(pre for pre, _ in hooks if pre is not None)
+        self._post_hooks = tuple(post for _, post in hooks if post is not None)
+
+    @property
+    def patched(self):
+        """Whether the function is currently wrapped by the interceptor."""
+        current = wrapt.resolve_path(self.module, self.name)[2]
+        return (
+            isinstance(current, wrapt.FunctionWrapper) and current._self_wrapper is self
+        )
+
+    def patch(self):
+        """Wrap the function, does nothing if it is already wrapped."""
+        with self._lock:
+            if not self.patched:
+                wrapt.wrap_function_wrapper(self.module, self.name, self)
+
+    def unpatch(self):
+        """Restore the original function and remove all hooks.
+
+        If the function has been wrapped again by someone else in the meantime,
+        the interceptor stays in place without any hooks.
+        """
+        with self._lock:
+            if self.patched:
+                parent, attribute, current = wrapt.resolve_path(self.module, self.name)
+                setattr(parent, attribute, current.__wrapped__)
+            self._hooks.clear()
+            self._update_hooks()
+
+    def __call__(self, func, instance, args, kwargs):
+        token = _handled.set(_handled.get() | self._names) if self.outer else None
+        try:
+            for hook in self._pre_hooks:
+                hook(instance, kwargs)
+            response = func(*args, **kwargs)
+            for hook in self._post_hooks:
+                hook(instance, response)
+            return response
+        finally:
+            if token is not None:
+                _handled.reset(token)
@@ -7,73 +7,435 @@ Various helpers for WSGI applications.
 
 import time
 
-import webob
-from webob.dec import wsgify
+try:
+    from urllib.parse import parse_qs
+except ImportError:  # Python 2
+    from urlparse import parse_qs
 
-from . import settings, utils
+from . import counters, deadline, metrics, profiling, settings, slowdown, utils
 
 
-def _refuse_request(req, app):
-    return webob.exc.HTTPBadRequest(settings.KIWI_RESTRICT_USER_AGENT_MESSAGE)
+def _refuse_request(environ, start_response, user_agent):
+    # Connection is a hop-by-hop header which WSGI apps must not send (PEP 3333),
+    # closing the connection after a refusal is up to the server
+    refusal = utils.refusal(user_agent.settings)
+    start_response("400 Bad Request", list(refusal.headers))
+    return [refusal.body]
 
 
-def _slowdown_request(req, app):
+class _ClosingIterator(object):
+    """Pass the response through, call the callback once the server closes it."""
+
+    def __init__(self, iterable, callback):
+        self._iterable = iterable
+        self._callback = callback
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            if hasattr(self._iterable, "close"):
+                self._iterable.close()
+        finally:
+            self._callback()
+
+
+def _get_response(environ, start_response, app, monitor=None):
     before_time = time.time()
-    resp = req.get_response(app)
-    seconds = time.time() - before_time
-    time.sleep(seconds)
-    return resp
+    if monitor is None:
+        return app(environ, start_response), before_time
+
+    monitor.request_started()
+    try:
+        app_iter = app(environ, start_response)
+    except Exception:
+        monitor.request_finished(time.time() - before_time)
+        raise
+
+    def finish():
+        monitor.request_finished(time.time() - before_time)
+
+    return _ClosingIterator(app_iter, finish), before_time
+
+
+def _held_size(app_iter, content_length=None):
+    """Return the size of a response body held in memory.
+
+    The ``Content-Length`` header is used if the app sent it, bodies without it
+    are sized only if they are lists or tuples of chunks.
+    """
+    if content_length is not None:
+        try:
+            return int(content_length)
+        except ValueError:
+            pass
+    if isinstance(app_iter, (list, tuple)):
+        return sum(len(chunk) for chunk in app_iter)
+    return 0
+
+
+def _content_length(headers):
+    for name, value in headers:
+        if name.lower() == "content-length":
+            return value
+    return None
+
+
+def _slowdown_request(environ, start_response, app, monitor=None):
+    content_length = []
+
+    def sized_start_response(status, headers, exc_info=None):
+        content_length[:] = [_content_length(headers)]
+        return start_response(status, headers, exc_info)
+
+    app_iter, before_time = _get_response(environ, sized_start_response, app, monitor)
+    if not isinstance(app_iter, (list, tuple)):
+        # Lazy bodies are produced while the server iterates over them
+        return _DelayedIterator(app_iter, before_time, content_length)
+
+    _hold(time.time() - before_time, _held_size(app_iter, *content_length))
+    return app_iter
+
+
+def _hold(request_duration, size):
+    """Delay the response of the size by the duration of the request."""
+    if slowdown.held_bytes.acquire(size):
+        slowdown.record_delay(request_duration)
+        try:
+            time.sleep(request_duration)
+        finally:
+            slowdown.held_bytes.release(size)
+    else:
+        counters.incr("user_agent.slowdown_skipped")
+
+
+class _DelayedIterator(object):
+    """Delay the response once its first chunk has been produced."""
+
+    def __init__(self, iterable, before_time, content_length):
+        self._iterable = iterable
+        self._before_time = before_time
+        self._content_length = content_length
+
+    def __iter__(self):
+        chunks = iter(self._iterable)
+        for chunk in chunks:
+            size = _held_size([chunk], *self._content_length)
+            _hold(time.time() - self._before_time, size)
+            yield chunk
+            break
+        for chunk in chunks:
+            yield chunk
+
+    def close(self):
+        if hasattr(self._iterable, "close"):
+            self._iterable.close()
+
+
+def default_route_key(environ):
+    """Return the key of durations of the request, its method and ``PATH_INFO``."""
+    return "{} {}".format(environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", ""))
+
+
+def _delay_request(environ, start_response, app, monitor, delay, route_key):
+    """Delay the request before calling the app by the estimated duration."""
+    route = route_key(environ)
+    if delay:
+        seconds = slowdown.estimate_delay(route)
+        slowdown.record_delay(seconds)
+        time.sleep(seconds)
+
+    app_iter, before_time = _get_response(environ, start_response, app, monitor)
+    slowdown.durations.record(route, time.time() - before_time)
+    return app_iter
+
+
+def user_agent_middleware(app, monitor=None, route_key=default_route_key):
+    """Validate client's User-Agent header and modify response based on that.
+
+    If the User-Agent header is invalid, there are three possible outcomes:
+
+    1. The current time is less then :obj:`settings.KIWI_REQUESTS_SLOWDOWN_DATETIME`,
+       do nothing in this case.
+    2. The current time is less then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
+       slow down the response twice the normal responce time.
+    3. The current time is more then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
+       refuse the request, return ``HTTP 400`` to the client.
+
+    The middleware reads the header straight from the WSGI environ and passes
+    the response of the app through untouched, streamed responses included.
+    Responses of slowed down requests are held for as long as the app took to
+    produce them, lazily produced bodies, e.g. generators, until their first chunk
+    has been produced, the rest of the body is not included in the delay.
+
+    Usage::
+
+        from your_app import wsgi_app
+
+        wsgi_app = user_agent_middleware(wsgi_app)
+
+    For example, in Flask, the middleware can be applied like this::
+
+        from flask import Flask
+
+        app = Flask(__name__)
+        app.wsgi_app = user_agent_middleware(app)
+
+        app.run()
+
+    In Django, you can apply the middleware like this::
+
+        from django.core.wsgi import get_wsgi_application
+
+        application = user_agent_middleware(get_wsgi_application())
+
+    For more information see
+    `Django docs <https://docs.djangoproject.com/en/dev/howto/deployment/wsgi/>`_.
+
+    .. warning::
+
+        The middleware slows down requests by calling :meth:`time.sleep()`
+        (in the time frame when requests with invalid user-agent are being delayed).
+        This can increase worker busyness which can overload a service.
+
+    :param app: WSGI application.
+    :param monitor: (optional) monitor of the server load, see
+        :func:`adaptive_user_agent_middleware`.
+    :param route_key: (optional) function returning the route of a WSGI environ,
+        used as the key of durations when delaying requests before the app, see
+        :mod:`kw.platform.slowdown`. Paths with IDs should be mapped to their
+        routes, e.g. ``GET /users/{id}``, :func:`default_route_key` by default.
+    """
+
+    def middleware(environ, start_response):
+        user_agent = utils.validate_request(
+            environ.get("REQUEST_METHOD"),
+            environ.get("PATH_INFO", ""),
+            environ.get("HTTP_USER_AGENT"),
+            monitor,
+        )
+        if user_agent is None:
+            return app(environ, start_response)
+        elif user_agent.restrict:
+            return _refuse_request(environ, start_response, user_agent)
+        elif slowdown.delays_before_handler():
+            return _delay_request(
+                environ, start_response, app, monitor, user_agent.slowdown, route_key
+            )
+        elif user_agent.slowdown:
+            return _slowdown_request(environ, start_response, app, monitor)
+        elif monitor is not None:
+            return _get_response(environ, start_response, app, monitor)[0]
+
+        return app(environ, start_response)
+
+    return middleware
+
+
+def adaptive_user_agent_middleware(app, monitor, route_key=default_route_key):
+    """Validate client's User-Agent header based on server load.
 
+    Works as :obj:`user_agent_middleware`, except requests with invalid User-Agent
+    header are slowed down or refused only when the load tracked by the monitor
+    crosses its thresholds, the dates from settings are not used. Requests handled
+    by the middleware are recorded in the monitor.
 
-def _validate_user_agent(req, app):
-    user_agent = utils.UserAgentValidator(req.user_agent)
+    Usage::
 
-    if user_agent.slowdown:
-        return _slowdown_request(req, app)
-    elif user_agent.restrict:
-        return _refuse_request(req, app)
+        from kw.platform.load import LoadMonitor
+
+        monitor = LoadMonitor(slowdown_in_flight=8, restrict_latency=2.0)
+        wsgi_app = adaptive_user_agent_middleware(wsgi_app, monitor)
+
+    :param app: WSGI application.
+    :param monitor: Monitor of the server load.
+    :type monitor: :class:`kw.platform.load.LoadMonitor`
+    :param route_key: (optional) see :func:`user_agent_middleware`.
+    """
+    return user_agent_middleware(app, monitor=monitor, route_key=route_key)
+
+
+def sunset_middleware(app, registry):
+    """Add the ``Sunset`` HTTP header to responses of deprecated routes.
+
+    Routes are looked up in the registry by ``PATH_INFO`` of the request,
+    the response is passed through untouched apart from the added headers.
+
+    Usage::
+
+        from kw.platform.utils import SunsetRegistry
+
+        sunsets = SunsetRegistry()
+        sunsets.register("/v1/users", when=datetime(2020, 8, 1, 10, 0, 0))
+
+        wsgi_app = sunset_middleware(wsgi_app, sunsets)
+
+    :param app: WSGI application.
+    :param registry: Registry of deprecated routes.
+    :type registry: :class:`kw.platform.utils.SunsetRegistry`
+    """
+
+    def middleware(environ, start_response):
+        headers = registry.get(environ.get("PATH_INFO", ""))
+        if not headers:
+            return app(environ, start_response)
+
+        def sunset_start_response(status, response_headers, exc_info=None):
+            return start_response(status, response_headers + list(headers), exc_info)
+
+        return app(environ, sunset_start_response)
+
+    return middleware
+
+
+def deprecation_middleware(app, registry):
+    """Add the ``Deprecated-Usage`` HTTP header to responses of deprecated routes.
+
+    Routes are looked up in the registry by ``PATH_INFO`` of the request, calling
+    services are counted in the registry, the response is passed through
+    untouched apart from the added header.
+
+    Usage::
+
+        from kw.platform.utils import DeprecationRegistry
+
+        deprecations = DeprecationRegistry()
+        deprecations.register("/v1/users", "Use /v2/users instead")
+
+        wsgi_app = deprecation_middleware(wsgi_app, deprecations)
+
+    :param app: WSGI application.
+    :param registry: Registry of deprecated routes.
+    :type registry: :class:`kw.platform.utils.DeprecationRegistry`
+    """
+
+    def middleware(environ, start_response):
+        route = environ.get("PATH_INFO", "")
+        if route not in registry:
+            return app(environ, start_response)
+
+        parameters = parse_qs(environ.get("QUERY_STRING", ""), keep_blank_values=True)
+        headers = registry.match(route, parameters, environ.get("HTTP_USER_AGENT"))
+        if not headers:
+            return app(environ, start_response)
+
+        def deprecation_start_response(status, response_headers, exc_info=None):
+            return start_response(status, response_headers + list(headers), exc_info)
+
+        return app(environ, deprecation_start_response)
+
+    return middleware
+
+
+def deadline_middleware(app):
+    """Set the deadline of the request for outgoing requests made by the app.
+
+    The budget is read from the header :obj:`settings.KIWI_DEADLINE_HEADER`,
+    :obj:`settings.KIWI_DEFAULT_REQUEST_BUDGET` is used if it is missing.
+    The deadline stays set until the server closes the response, so it also
+    applies to streamed bodies. See :mod:`kw.platform.deadline`.
+
+    Usage::
+
+        wsgi_app = deadline_middleware(wsgi_app)
+
+    :param app: WSGI application.
+    """
+
+    def middleware(environ, start_response):
+        key = "HTTP_" + settings.KIWI_DEADLINE_HEADER.upper().replace("-", "_")
+        token = deadline.set_deadline(deadline.budget_from_header(environ.get(key)))
+        try:
+            app_iter = app(environ, start_response)
+        except Exception:
+            deadline.reset_deadline(token)
+            raise
+        # Streamed bodies are produced while the server iterates the response
+        return _ClosingIterator(app_iter, lambda: deadline.reset_deadline(token))
+
+    return middleware
+
+
+def prometheus_app():
+    """Create a WSGI app exposing the metrics of the library in the Prometheus format.
+
+    See :mod:`kw.platform.metrics`.
+
+    Usage::
+
+        from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+        app = DispatcherMiddleware(app, {"/metrics": prometheus_app()})
+    """
+    metrics.enable()
+
+    def app(environ, start_response):
+        body = metrics.render_prometheus().encode("utf-8")
+        start_response(
+            "200 OK",
+            [
+                ("Content-Type", metrics.PROMETHEUS_CONTENT_TYPE),
+                ("Content-Length", str(len(body))),
+            ],
+        )
+        return [body]
 
     return app
 
 
-#: Validate client's User-Agent header and modify response based on that.
-#:
-#: If the User-Agent header is invalid, there are three possible outcomes:
-#:
-#: 1. The current time is less then :obj:`settings.KIWI_REQUESTS_SLOWDOWN_DATETIME`,
-#:    do nothing in this case.
-#: 2. The current time is less then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
-#:    slow down the response twice the normal responce time.
-#: 3. The current time is more then :obj:`settings.KIWI_REQUESTS_RESTRICT_DATETIME`,
-#:    refuse the request, return ``HTTP 400`` to the client.
-#:
-#: Usage::
-#:
-#:     from your_app import wsgi_app
-#:
-#:     wsgi_app = user_agent_middleware(wsgi_app)
-#:
-#: For example, in Flask, the middleware can be applied like this::
-#:
-#:     from flask import Flask
-#:
-#:     app = Flask(__name__)
-#:     app.wsgi_app = user_agent_middleware(app)
-#:
-#:     app.run()
-#:
-#: In Django, you can apply the middleware like this::
-#:
-#:     from django.core.wsgi import get_wsgi_application
-#:
-#:     application = user_agent_middleware(get_wsgi_application())
-#:
-#: For more information see
-#: `Django docs <https://docs.djangoproject.com/en/dev/howto/deployment/wsgi/>`_.
-#:
-#: .. warning::
-#:
-#:     The middleware slows down requests by calling :meth:`time.sleep()`
-#:     (in the time frame when requests with invalid user-agent are being delayed).
-#:     This can increase worker busyness which can overload a service.
-user_agent_middleware = wsgify.middleware(_validate_user_agent)
+def profiling_middleware(app):
+    """Send time spent inside the library in the ``Server-Timing`` header.
+
+    Does nothing unless the profiling is enabled, see :mod:`kw.platform.profiling`.
+    The headers are passed to the server once the app returns, so the time
+    of the wrapped middlewares is included.
+
+    Usage::
+
+        wsgi_app = profiling_middleware(user_agent_middleware(wsgi_app))
+
+    :param app: WSGI application.
+    """
+
+    def middleware(environ, start_response):
+        if not profiling.enabled:
+            return app(environ, start_response)
+
+        token = profiling.start_request()
+        state = {}
+
+        def finish():
+            if "timings" not in state:
+                state["timings"] = profiling.finish_request(token)
+            return state["timings"]
+
+        def send_headers():
+            if "write" not in state:
+                status, headers, exc_info = state.pop("response")
+                timings = finish()
+                if timings:
+                    headers = list(headers)
+                    headers.append(("Server-Timing", profiling.server_timing(timings)))
+                state["write"] = start_response(status, headers, exc_info)
+            return state["write"]
+
+        def profiling_start_response(status, headers, exc_info=None):
+            if "write" in state:
+                # The headers have been sent, let the server handle the error
+                return start_response(status, headers, exc_info)
+            state["response"] = (status, headers, exc_info)
+            if "timings" in state:
+                # Called lazily while the server iterates the body
+                return send_headers()
+            return lambda data: send_headers()(data)
+
+        try:
+            app_iter = app(environ, profiling_start_response)
+        finally:
+            finish()
+        if "response" in state:
+            send_headers()
+        return app_iter
+
+    return middleware
@@ -1,8 +1,17 @@
 import pytest
 
+from kw.platform import settings
+
 
 @pytest.fixture
 def app_env_vars(monkeypatch):
     monkeypatch.setenv("APP_NAME", "unittest")
     monkeypatch.setenv("PACKAGE_VERSION", "1.0")
     monkeypatch.setenv("APP_ENVIRONMENT", "test-env")
+
+
+@pytest.fixture
+def restore_settings():
+    snapshot = settings.current()
+    yield
+    settings._publish(snapshot)
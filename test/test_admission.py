@@ -0,0 +1,238 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from freezegun import freeze_time
+
+from kw.platform import counters, profiling, settings, utils
+from kw.platform.aiohttp import admission
+from kw.platform.aiohttp import admission_middleware, user_agent_middleware
+
+
+async def test_admission_queue__priority(loop):
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    order = []
+
+    async def request(name, priority):
+        await queue.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        queue.release()
+
+    await queue.acquire(admission.COMPLIANT)
+    tasks = [
+        loop.create_task(request("non-compliant", admission.NON_COMPLIANT)),
+        loop.create_task(request("compliant", admission.COMPLIANT)),
+    ]
+    await asyncio.sleep(0)
+    assert queue.queued() == 2
+
+    queue.release()
+    await asyncio.gather(*tasks)
+
+    assert order == ["compliant", "non-compliant"]
+    assert queue.in_flight == 0
+    assert queue.queued() == 0
+
+
+async def test_admission_queue__queue_full(loop):
+    queue = admission.AdmissionQueue(max_concurrency=1, non_compliant_queue=0)
+    before = counters.get("admission.non_compliant.queue_full")
+    await queue.acquire(admission.COMPLIANT)
+
+    with pytest.raises(admission.AdmissionRejected) as e:
+        await queue.acquire(admission.NON_COMPLIANT)
+
+    assert e.value.reason == "queue_full"
+    assert counters.get("admission.non_compliant.queue_full") == before + 1
+
+
+async def test_admission_queue__timeout(loop):
+    queue = admission.AdmissionQueue(max_concurrency=1, non_compliant_timeout=0.01)
+    await queue.acquire(admission.COMPLIANT)
+
+    with pytest.raises(admission.AdmissionRejected) as e:
+        await queue.acquire(admission.NON_COMPLIANT)
+
+    assert e.value.reason == "timeout"
+    assert queue.queued() == 0
+    queue.release()
+    assert queue.in_flight == 0
+
+
+async def test_admission_queue__cancelled(loop):
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    await queue.acquire(admission.COMPLIANT)
+    task = loop.create_task(queue.acquire(admission.COMPLIANT))
+    await asyncio.sleep(0)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert queue.queued() == 0
+    queue.release()
+    assert queue.in_flight == 0
+
+
+async def test_admission_middleware(aiohttp_client, loop):
+    release = asyncio.Event()
+
+    async def hello(request):
+        await release.wait()
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    queue = admission.AdmissionQueue(max_concurrency=1, non_compliant_queue=0)
+    app = aiohttp.web.Application(middlewares=[admission_middleware(queue)])
+    app.router.add_get("/", hello)
+    client = await aiohttp_client(app)
+
+    compliant = {"User-Agent": "mambo/1a (Kiwi.com dev)"}
+    first = loop.create_task(client.get("/", headers=compliant))
+    while not queue.in_flight:
+        await asyncio.sleep(0.01)
+
+    res = await client.get("/", headers={"User-Agent": "invalid"})
+    assert res.status == 503
+
+    second = loop.create_task(client.get("/", headers=compliant))
+    while not queue.queued():
+        await asyncio.sleep(0.01)
+    release.set()
+
+    assert (await first).status == 200
+    assert (await second).status == 200
+    assert queue.in_flight == 0
+
+
+async def test_admission_middleware__bypass(aiohttp_client, loop, restore_settings):
+    release = asyncio.Event()
+
+    async def hello(request):
+        await release.wait()
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    async def healthz(request):
+        return aiohttp.web.json_response(text="OK")
+
+    settings.update(bypass="/healthz")
+    queue = admission.AdmissionQueue(max_concurrency=1, non_compliant_queue=0)
+    app = aiohttp.web.Application(middlewares=[admission_middleware(queue)])
+    app.router.add_get("/", hello)
+    app.router.add_get("/healthz", healthz)
+    client = await aiohttp_client(app)
+
+    first = loop.create_task(client.get("/"))
+    while not queue.in_flight:
+        await asyncio.sleep(0.01)
+
+    res = await client.get("/healthz", headers={"User-Agent": "kube-probe/1.16"})
+    assert res.status == 200
+    release.set()
+    assert (await first).status == 200
+
+
+async def test_admission_middleware__slowdown_outside_slot(
+    aiohttp_client, loop, monkeypatch
+):
+    in_flight = []
+
+    async def sleep(seconds):
+        in_flight.append(queue.in_flight)
+
+    async def hello(request):
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    app = aiohttp.web.Application(
+        middlewares=[user_agent_middleware, admission_middleware(queue)]
+    )
+    app.router.add_get("/", hello)
+    client = await aiohttp_client(app)
+
+    with freeze_time("2019-07-26"):
+        res = await client.get("/", headers={"User-Agent": "invalid"})
+
+    assert res.status == 200
+    assert in_flight == [0]
+
+
+async def test_admission_middleware__after_user_agent_middleware(
+    aiohttp_client, loop, mocker, restore_settings
+):
+    async def hello(request):
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    settings.update(bypass="/healthz")
+    validator = mocker.spy(utils, "UserAgentValidator")
+    before = counters.get("user_agent.bypassed")
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    app = aiohttp.web.Application(
+        middlewares=[user_agent_middleware, admission_middleware(queue)]
+    )
+    app.router.add_get("/", hello)
+    app.router.add_get("/healthz", hello)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/healthz")
+    assert res.status == 200
+    assert counters.get("user_agent.bypassed") == before + 1
+    assert settings.current().bypass.hits["/healthz"] == 1
+
+    res = await client.get("/", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"})
+    assert res.status == 200
+    assert validator.call_count == 1
+
+
+async def test_admission_middleware__wait_excluded_from_slowdown(
+    aiohttp_client, loop, monkeypatch
+):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(seconds):
+        delays.append(seconds)
+
+    async def hello(request):
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    app = aiohttp.web.Application(
+        middlewares=[user_agent_middleware, admission_middleware(queue)]
+    )
+    app.router.add_get("/", hello)
+    client = await aiohttp_client(app)
+
+    await queue.acquire(admission.COMPLIANT)
+    with freeze_time("2019-07-26", tick=True):
+        request = loop.create_task(client.get("/", headers={"User-Agent": "invalid"}))
+        while not queue.queued():
+            await sleep(0.01)
+        await sleep(0.2)
+        monkeypatch.setattr(asyncio, "sleep", record_sleep)
+        queue.release()
+        res = await request
+
+    assert res.status == 200
+    assert len(delays) == 1
+    assert delays[0] < 0.1
+
+
+async def test_admission_middleware__profiling(aiohttp_client, loop, monkeypatch):
+    async def hello(request):
+        return aiohttp.web.json_response(text="Hello, world!")
+
+    monkeypatch.setattr(profiling, "enabled", True)
+    profiling.reset()
+    queue = admission.AdmissionQueue(max_concurrency=1)
+    app = aiohttp.web.Application(middlewares=[admission_middleware(queue)])
+    app.router.add_get("/", hello)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"})
+
+    assert res.status == 200
+    assert profiling.totals()[profiling.VALIDATE][0] == 1
+    profiling.reset()
@@ -1,3 +1,5 @@
+import asyncio
+import threading
 import time
 from datetime import datetime
 
@@ -9,6 +11,10 @@ from aioresponses import aioresponses
 from freezegun import freeze_time
 
 from kw.platform import aiohttp as uut
+from kw.platform import deadline, metrics, profiling, settings, slowdown, wrappers
+from kw.platform.load import RESTRICT, LoadMonitor
+from kw.platform.streaming import LimitExceeded
+from kw.platform.utils import DeprecationRegistry, ReportSampler, SunsetRegistry
 
 
 @pytest.fixture
@@ -19,7 +25,7 @@ def patch_aiohttp(mocker, app_env_vars):
 
     yield
 
-    del aiohttp.__kiwi_platform_patch  # pylint: disable=no-member
+    uut.monkey.unpatch()
 
 
 @pytest.fixture
@@ -119,6 +125,192 @@ async def test_aiohttp__user_agent_middleware__slowdown(
     assert request_time >= expected_time
 
 
+@pytest.mark.parametrize("method", ["middleware", "decorator"])
+async def test_aiohttp__user_agent_middleware__bypass(
+    aiohttp_client, loop, restore_settings, method
+):
+    if method == "middleware":
+        app = create_app(middlewares=[uut.user_agent_middleware])
+    else:
+        app = create_app(handler_decorators=[uut.mandatory_user_agent])
+    client = await aiohttp_client(app)
+    settings.update(bypass="/")
+
+    with freeze_time("2020-01-01", tick=True):
+        res = await client.get("/", headers={"User-Agent": "invalid"})
+
+    assert res.status == 200
+    assert settings.current().bypass.hits == {"/": 1}
+
+
+async def test_aiohttp__user_agent_middleware__slowdown_before(
+    aiohttp_client, loop, monkeypatch
+):
+    monkeypatch.setattr(settings, "KIWI_SLOWDOWN_MODE", slowdown.BEFORE)
+    monkeypatch.setattr(slowdown, "durations", slowdown.DurationEstimator())
+    slowdown.durations.record("GET /", 0.2)
+    client = await aiohttp_client(create_app(middlewares=[uut.user_agent_middleware]))
+
+    with freeze_time("2019-07-26", tick=True):
+        before_time = time.time()
+        res = await client.get("/", headers={"User-Agent": "invalid"})
+        request_time = time.time() - before_time
+
+    assert res.status == 200
+    assert request_time >= 0.2
+    assert slowdown.durations.estimate("GET /") < 0.2
+
+
+async def test_aiohttp__user_agent_middleware__slowdown_held_bytes(
+    aiohttp_client, loop, monkeypatch
+):
+    monkeypatch.setattr(slowdown, "held_bytes", slowdown.HeldBytes(limit=1))
+    client = await aiohttp_client(
+        create_app(sleep_seconds=0.2, middlewares=[uut.user_agent_middleware])
+    )
+
+    with freeze_time("2019-07-26", tick=True):
+        before_time = time.time()
+        res = await client.get("/", headers={"User-Agent": "invalid"})
+        request_time = time.time() - before_time
+
+    assert res.status == 200
+    assert request_time < 0.4
+    assert slowdown.held_bytes.held == 0
+
+
+@pytest.mark.parametrize("method", ["middleware", "decorator"])
+async def test_aiohttp__user_agent_middleware__refusal(
+    aiohttp_client, loop, monkeypatch, method
+):
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_CLOSE_CONNECTION", True)
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_RETRY_AFTER", 60)
+    if method == "middleware":
+        app = create_app(middlewares=[uut.user_agent_middleware])
+    else:
+        app = create_app(handler_decorators=[uut.mandatory_user_agent])
+    client = await aiohttp_client(app)
+
+    with freeze_time("2020-01-01", tick=True):
+        res = await client.get("/")
+
+    assert res.status == 400
+    assert await res.json() == {"message": settings.KIWI_RESTRICT_USER_AGENT_MESSAGE}
+    assert res.headers["Retry-After"] == "60"
+    assert res.headers["Connection"] == "close"
+
+
+async def test_aiohttp__prometheus_handler(
+    aiohttp_client, loop, monkeypatch, restore_settings
+):
+    monkeypatch.setattr(metrics, "_enabled", False)
+    settings.update(bypass="/metrics")
+    app = create_app(middlewares=[uut.user_agent_middleware])
+    app.router.add_get("/metrics", uut.prometheus_handler())
+    client = await aiohttp_client(app)
+
+    await client.get("/", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"})
+    res = await client.get("/metrics")
+
+    assert res.status == 200
+    assert res.headers["Content-Type"] == metrics.PROMETHEUS_CONTENT_TYPE
+    assert "kiwi_platform_user_agent_validated_total" in await res.text()
+
+
+async def test_aiohttp__profiling_middleware(aiohttp_client, loop, monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    app = create_app(middlewares=[uut.profiling_middleware, uut.user_agent_middleware])
+    client = await aiohttp_client(app)
+
+    res = await client.get("/", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"})
+
+    assert res.status == 200
+    assert res.headers["Server-Timing"].startswith(profiling.VALIDATE + ";dur=")
+
+
+async def test_aiohttp__adaptive_user_agent_middleware(aiohttp_client, loop):
+    monitor = LoadMonitor(restrict_in_flight=2, slowdown_lag=10)
+    app = create_app(middlewares=[uut.adaptive_user_agent_middleware(monitor)])
+    uut.track_loop_lag(app, monitor, interval=0.01)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/", headers={"User-Agent": "invalid"})
+    assert res.status == 200
+
+    monitor.request_started()
+    monitor.request_started()
+    assert monitor.level == RESTRICT
+
+    res = await client.get("/", headers={"User-Agent": "invalid"})
+    assert res.status == 400
+
+    res = await client.get("/", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"})
+    assert res.status == 200
+    assert monitor.in_flight == 2
+
+    lag_monitor = app[uut.LOOP_LAG_KEY]
+    lag_monitor.record(11)
+    assert monitor.lag == 11
+    assert lag_monitor.histogram.sum == 11
+
+
+async def test_aiohttp__loop_lag_monitor(aiohttp_client, loop, mocker):
+    clock = mocker.Mock(return_value=100.0)
+    listener = mocker.Mock()
+
+    async def sleep(seconds):
+        if listener.call_count == 2:
+            raise asyncio.CancelledError
+        # Wake up 50 ms late
+        clock.return_value += seconds + 0.05
+
+    mocker.patch("kw.platform.aiohttp.lag.asyncio.sleep", sleep)
+    lag_monitor = uut.LoopLagMonitor(interval=0.5)
+    lag_monitor.add_listener(listener)
+    lag_monitor._loop = mocker.Mock(time=clock)
+
+    with pytest.raises(asyncio.CancelledError):
+        await lag_monitor._measure()
+
+    assert listener.call_args_list == [mocker.call(pytest.approx(0.05))] * 2
+    assert lag_monitor.lag == pytest.approx(0.05)
+    assert lag_monitor.histogram.count == 2
+    assert lag_monitor.histogram.sum == pytest.approx(0.1)
+
+
+async def test_aiohttp__loop_lag_monitor__setup(aiohttp_client, loop):
+    lag_monitor = uut.LoopLagMonitor(interval=60)
+    app = create_app()
+    lag_monitor.setup(app)
+
+    client = await aiohttp_client(app)
+    assert lag_monitor._task is not None
+
+    await client.close()
+    assert lag_monitor._task is None
+
+
+def test_aiohttp__loop_lag_monitor__blocked(mocker):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    lag_monitor = uut.LoopLagMonitor(
+        interval=0.01, slow_threshold=0.02, sampler=ReportSampler(rates=1.0)
+    )
+    lag_monitor._loop = mocker.Mock(time=mocker.Mock(return_value=100.0))
+    lag_monitor._loop_thread_id = threading.get_ident()
+
+    lag_monitor._wake_up_at = 99.99
+    assert lag_monitor.check_blocked() is False
+
+    lag_monitor._wake_up_at = 99.9
+    assert lag_monitor.check_blocked() is True
+    assert lag_monitor.check_blocked() is False
+
+    m_capture_message.assert_called_once()
+    message = m_capture_message.call_args[0][0]
+    assert message.startswith("Event loop blocked for more than")
+    assert "test_aiohttp__loop_lag_monitor__blocked" in message
+
+
 async def test_aiohttp__kiwi_client_session__sunset(loop, mocker, aiomock):
     m_capture_message = mocker.patch("kw.platform.utils.capture_message")
     mocker.patch("kw.platform.aiohttp.session.add_user_agent_header")
@@ -147,6 +339,153 @@ async def test_aiohttp__kiwi_client_session__user_agent(httpbin, app_env_vars):
             )
 
 
+async def test_aiohttp__deadline_middleware(aiohttp_client, loop):
+    async def budget(request):
+        return web.json_response({"remaining": deadline.remaining()})
+
+    app = web.Application(middlewares=[uut.deadline_middleware])
+    app.router.add_get("/", budget)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/", headers={"X-Request-Deadline-Ms": "1500"})
+    assert 1.4 < (await res.json())["remaining"] <= 1.5
+
+    res = await client.get("/")
+    assert (await res.json())["remaining"] is None
+
+
+async def test_aiohttp__kiwi_client_session__deadline(httpbin, app_env_vars):
+    token = deadline.set_deadline(2)
+    try:
+        async with uut.KiwiClientSession() as client:
+            async with client.get(httpbin.url) as resp:
+                budget = resp.request_info.headers.get("X-Request-Deadline-Ms")
+                assert 1900 < int(budget) <= 2000
+
+        deadline.set_deadline(0)
+        async with uut.KiwiClientSession() as client:
+            with pytest.raises(deadline.DeadlineExceeded):
+                await client.get(httpbin.url)
+    finally:
+        deadline.reset_deadline(token)
+
+
+def test_aiohttp__limit_client_timeout():
+    timeout = aiohttp.ClientTimeout(total=10, connect=1)
+
+    limited = uut.session.limit_client_timeout(None, 2, default=timeout)
+
+    assert limited.total == 2
+    assert limited.connect == 1
+    assert uut.session.limit_client_timeout(1, 2).total == 1
+
+
+async def test_aiohttp__compression(aiohttp_server, loop, app_env_vars):
+    async def echo(request):
+        return web.json_response(
+            {
+                "accept_encoding": request.headers["Accept-Encoding"],
+                "content_encoding": request.headers.get("Content-Encoding"),
+                "body": await request.json(),
+            }
+        )
+
+    app = web.Application(middlewares=[uut.compression_middleware(threshold=100)])
+    app.router.add_post("/", echo)
+    server = await aiohttp_server(app)
+
+    class Session(uut.KiwiClientSession):
+        compress_threshold = 100
+
+    body = {"key": "x" * 100}
+    async with Session() as client:
+        async with client.post(server.make_url("/"), json=body) as resp:
+            assert resp.headers["Content-Encoding"] == "gzip"
+            assert await resp.json() == {
+                "accept_encoding": uut.session.ACCEPT_ENCODING,
+                "content_encoding": "gzip",
+                "body": body,
+            }
+
+        async with client.post(server.make_url("/"), json={}) as resp:
+            assert "Content-Encoding" not in resp.headers
+            assert (await resp.json())["content_encoding"] is None
+
+
+async def test_aiohttp__compression__shared_headers(aiohttp_server, loop):
+    async def echo(request):
+        return web.json_response(
+            {"content_encoding": request.headers.get("Content-Encoding")}
+        )
+
+    app = web.Application()
+    app.router.add_post("/", echo)
+    server = await aiohttp_server(app)
+
+    class Session(uut.KiwiClientSession):
+        compress_threshold = 100
+
+    headers = {"User-Agent": "test/1.0 (Kiwi.com test)"}
+    async with Session() as client:
+        async with client.post(
+            server.make_url("/"), json={"key": "x" * 100}, headers=headers
+        ) as resp:
+            assert (await resp.json())["content_encoding"] == "gzip"
+
+        async with client.post(server.make_url("/"), json={}, headers=headers) as resp:
+            assert (await resp.json())["content_encoding"] is None
+
+    assert headers == {"User-Agent": "test/1.0 (Kiwi.com test)"}
+
+
+async def test_aiohttp__kiwi_client_session__stream(aiohttp_server, loop, app_env_vars):
+    async def records(request):
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+        for i in range(3):
+            await response.write(b'{"id": %d}\n' % i)
+        return response
+
+    async def array(request):
+        return web.Response(body=b'[1, "two", {"three": 3}]')
+
+    app = web.Application()
+    app.router.add_get("/records", records)
+    app.router.add_get("/array", array)
+    server = await aiohttp_server(app)
+
+    async with uut.KiwiClientSession() as client:
+        stream = client.stream_ndjson("GET", server.make_url("/records"))
+        assert [record async for record in stream] == [{"id": i} for i in range(3)]
+
+        async with client.stream_json_array(
+            "GET", server.make_url("/array"), chunk_size=2
+        ) as stream:
+            assert [item async for item in stream] == [1, "two", {"three": 3}]
+
+        stream = client.stream_ndjson(
+            "GET", server.make_url("/records"), max_record_size=5
+        )
+        with pytest.raises(LimitExceeded):
+            await stream.__anext__()
+        assert stream._response.closed
+
+
+async def test_aiohttp__kiwi_client_session__json(aiohttp_server, loop, app_env_vars):
+    async def echo(request):
+        return web.json_response(await request.json())
+
+    app = web.Application()
+    app.router.add_post("/", echo)
+    server = await aiohttp_server(app)
+
+    async with uut.KiwiClientSession() as client:
+        async with client.post(server.make_url("/"), json={"key": "ř"}) as resp:
+            assert isinstance(resp, uut.session.KiwiClientResponse)
+            assert await resp.json() == {"key": "ř"}
+
+
 async def test_aiohttp__request_patched(httpbin, patch_aiohttp):
     async with aiohttp.ClientSession() as client:
         async with client.get(httpbin.url) as resp:
@@ -158,6 +497,19 @@ async def test_aiohttp__request_patched(httpbin, patch_aiohttp):
     assert getattr(aiohttp, "__kiwi_platform_patch") is True
 
 
+async def test_aiohttp__unpatch(httpbin, app_env_vars):
+    original = aiohttp.ClientSession.__dict__["_request"]
+
+    uut.monkey.patch()
+    assert uut.monkey.interceptor.patched
+    uut.monkey.unpatch()
+
+    assert aiohttp.ClientSession.__dict__["_request"] is original
+    async with aiohttp.ClientSession() as client:
+        async with client.get(httpbin.url) as resp:
+            assert "aiohttp" in resp.request_info.headers.get("User-Agent")
+
+
 async def test_aiohttp__request_not_patched(httpbin):
     async with aiohttp.ClientSession() as client:
         async with client.get(httpbin.url) as resp:
@@ -212,6 +564,90 @@ async def test_aiohttp__utils_sunset__append_link(aiohttp_client, loop):
     )
 
 
+async def test_aiohttp__sunset_middleware(aiohttp_client, loop):
+    sunsets = SunsetRegistry()
+    sunsets.register("/users/{id}", info_url="https://sunset.example.com")
+
+    async def user(request):
+        return web.Response(
+            text="User", headers={"Link": '<https://meta.example.com>;rel="meta"'}
+        )
+
+    app = create_app(middlewares=[uut.sunset_middleware(sunsets)])
+    app.router.add_get("/users/{id}", user)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/users/1")
+    assert res.headers["Link"] == (
+        '<https://meta.example.com>;rel="meta",'
+        '<https://sunset.example.com>;rel="sunset"'
+    )
+
+    res = await client.get("/")
+    assert "Link" not in res.headers
+
+
+async def test_aiohttp__sunset_middleware__http_exception(aiohttp_client, loop):
+    sunsets = SunsetRegistry()
+    sunsets.register("/users/{id}", when=datetime(2019, 8, 1, 10, 0, 0))
+
+    async def user(request):
+        raise web.HTTPGone()
+
+    app = create_app(middlewares=[uut.sunset_middleware(sunsets)])
+    app.router.add_get("/users/{id}", user)
+    client = await aiohttp_client(app)
+
+    res = await client.get("/users/1")
+    assert res.status == 410
+    assert res.headers["Sunset"] == "Thu, 01 Aug 2019 10:00:00 GMT"
+
+
+async def test_aiohttp__utils_deprecated_usage(aiohttp_client, loop):
+    deprecations = DeprecationRegistry()
+
+    @uut.utils.deprecated_usage(
+        "Parameter 'sort' is deprecated", parameters=["sort"], registry=deprecations
+    )
+    async def users(request):
+        return web.Response(text="Users")
+
+    app = create_app()
+    app.router.add_get("/users", users)
+    client = await aiohttp_client(app)
+
+    res = await client.get(
+        "/users?sort=name", headers={"User-Agent": "mambo/1a (Kiwi.com dev)"}
+    )
+    assert res.headers["Deprecated-Usage"] == "Parameter 'sort' is deprecated"
+
+    res = await client.get("/users")
+    assert "Deprecated-Usage" not in res.headers
+    key = "{}.{}".format(__name__, users.__qualname__)
+    assert deprecations.usage() == [(key, "mambo", 1, 0)]
+
+
+def test_aiohttp__utils_deprecated_usage__duplicate():
+    deprecations = DeprecationRegistry()
+
+    def view(message):
+        @uut.utils.deprecated_usage(message, registry=deprecations)
+        async def get(request):
+            return web.Response(text="Hello")
+
+        return get
+
+    view("First")
+    with pytest.raises(ValueError):
+        view("Second")
+
+    @uut.utils.deprecated_usage("Other", registry=deprecations, name="other.get")
+    async def get(request):
+        return web.Response(text="Hello")
+
+    assert len(deprecations) == 2
+
+
 def test_aiohttp__utils_sunset__error():
     with pytest.raises(TypeError):
         uut.utils.sunset()
@@ -272,9 +708,9 @@ async def test_aiohttp__patch_with_sentry__sunset(
     aiomock.get(url, headers=headers)
 
     async with aiohttp.ClientSession() as client:
-        wrapt.wrap_function_wrapper(
-            client, "_request", uut.monkey._add_sentry_handler()
-        )
+        interceptor = uut.monkey.AsyncInterceptor("aiohttp", "ClientSession._request")
+        interceptor.add_hook("sentry", post=wrappers.sentry_hook())
+        wrapt.wrap_function_wrapper(client, "_request", interceptor)
         async with client.get(url) as resp:
             await resp.text()
 
@@ -309,9 +745,9 @@ async def test_aiohttp__patch_with_sentry__deprecated_usage(
     aiomock.get(url, headers=headers)
 
     async with aiohttp.ClientSession() as client:
-        wrapt.wrap_function_wrapper(
-            client, "_request", uut.monkey._add_sentry_handler()
-        )
+        interceptor = uut.monkey.AsyncInterceptor("aiohttp", "ClientSession._request")
+        interceptor.add_hook("sentry", post=wrappers.sentry_hook())
+        wrapt.wrap_function_wrapper(client, "_request", interceptor)
         async with client.get(url) as resp:
             await resp.text()
 
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from freezegun import freeze_time
+
+from kw.platform import asgi as uut
+from kw.platform import settings
+from kw.platform.utils import SunsetRegistry
+
+
+def create_app(sleep_seconds=0):
+    async def app(scope, receive, send):
+        if sleep_seconds:
+            await asyncio.sleep(sleep_seconds)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"OK"})
+
+    return app
+
+
+async def call(app, path="/", user_agent=None):
+    headers = [(b"host", b"example.com")]
+    if user_agent is not None:
+        headers.append((b"user-agent", user_agent.encode()))
+    scope = {"type": "http", "method": "GET", "path": path, "headers": headers}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+@pytest.mark.parametrize(
+    "user_agent,expected_status,current_time",
+    [
+        ("invalid", 200, "2019-05-21"),
+        (None, 400, "2020-01-01"),
+        ("", 400, "2020-01-01"),
+        ("invalid", 400, "2020-01-01"),
+        ("mambo/1a (Kiwi.com dev)", 200, "2020-01-01"),
+    ],
+)
+async def test_user_agent_middleware__restrict(
+    loop, user_agent, expected_status, current_time
+):
+    app = uut.user_agent_middleware(create_app())
+
+    with freeze_time(current_time, tick=True):
+        messages = await call(app, user_agent=user_agent)
+
+    assert messages[0]["status"] == expected_status
+
+
+@pytest.mark.parametrize(
+    "user_agent,sleep_seconds,expected_time,current_time",
+    [
+        (None, 0.1, 0.2, "2019-07-26"),
+        ("invalid", 0.1, 0.2, "2019-07-26"),
+        ("mambo/1a (Kiwi.com dev)", 0.1, 0.1, "2019-07-26"),
+        ("invalid", 0.1, 0.1, "2019-05-07"),
+    ],
+)
+async def test_user_agent_middleware__slowdown(
+    loop, user_agent, sleep_seconds, expected_time, current_time
+):
+    app = uut.user_agent_middleware(create_app(sleep_seconds))
+
+    with freeze_time(current_time, tick=True):
+        before_time = time.time()
+        messages = await call(app, user_agent=user_agent)
+        request_time = time.time() - before_time
+
+    assert messages[0]["status"] == 200
+    assert messages[1]["body"] == b"OK"
+    assert request_time >= expected_time
+
+
+async def test_user_agent_middleware__bypass(loop, restore_settings):
+    settings.update(bypass="ua:kube-probe/")
+    app = uut.user_agent_middleware(create_app())
+
+    with freeze_time("2020-01-01", tick=True):
+        messages = await call(app, user_agent="kube-probe/1.18")
+
+    assert messages[0]["status"] == 200
+
+
+async def test_user_agent_middleware__lifespan(loop):
+    scopes = []
+
+    async def app(scope, receive, send):
+        scopes.append(scope)
+
+    await uut.user_agent_middleware(app)({"type": "lifespan"}, None, None)
+
+    assert scopes == [{"type": "lifespan"}]
+
+
+async def test_sunset_middleware(loop):
+    sunsets = SunsetRegistry()
+    sunsets.register("/old", when=datetime(2019, 8, 5, 5, 10, 0))
+    app = uut.sunset_middleware(create_app(), sunsets)
+
+    messages = await call(app, path="/old")
+    assert messages[0]["headers"] == [
+        (b"content-type", b"text/plain"),
+        (b"sunset", b"Mon, 05 Aug 2019 05:10:00 GMT"),
+    ]
+
+    messages = await call(app, path="/new")
+    assert messages[0]["headers"] == [(b"content-type", b"text/plain")]
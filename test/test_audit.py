@@ -0,0 +1,70 @@
+import gzip
+from datetime import datetime
+
+import pytest
+
+from kw.platform import audit as uut
+
+
+LINE = '10.0.0.1 - - [26/Jul/2019:10:00:00 +0000] "GET / HTTP/1.1" 200 2 "-" "{}"\n'
+
+USER_AGENTS = (
+    ["mambo/1a (Kiwi.com dev)"] * 5
+    + ["mambo/1b (Kiwi.com dev) requests/2.22"] * 2
+    + ["python-requests/2.22"] * 3
+)
+
+
+@pytest.fixture
+def logs(tmpdir):
+    plain = tmpdir.join("access.log")
+    plain.write("".join(LINE.format(user_agent) for user_agent in USER_AGENTS))
+    plain.write("garbage\n", mode="a")
+
+    compressed = str(tmpdir.join("access.log.1.gz"))
+    with gzip.open(compressed, "wb") as f:
+        f.write(LINE.format("zoo/1.0 (Kiwi.com production)").encode())
+
+    return [str(plain), compressed]
+
+
+def test_split_file(logs):
+    plain, compressed = logs
+
+    assert uut.split_file(compressed) == [(compressed, None, None)]
+
+    tasks = uut.split_file(plain, chunk_size=100)
+    assert len(tasks) > 2
+    lines = [line for task in tasks for line in uut._read_lines(*task)]
+    assert len(lines) == len(USER_AGENTS) + 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_audit(logs, jobs):
+    result = uut.audit(logs, chunk_size=100, jobs=jobs)
+
+    assert result.total == 11
+    assert result.unmatched == 1
+    assert result.non_compliant == 3
+    assert result.callers() == [
+        ("mambo", 7, 0),
+        ("python-requests/2.22", 0, 3),
+        ("zoo", 1, 0),
+    ]
+    assert result.enforcement(
+        datetime(2019, 7, 30), datetime(2019, 7, 24), datetime(2019, 8, 1)
+    ) == (3.0 / 11, 0.0)
+    assert result.enforcement(
+        datetime(2019, 8, 2), datetime(2019, 7, 24), datetime(2019, 8, 1)
+    ) == (0.0, 3.0 / 11)
+
+
+def test_main(logs, capsys):
+    assert uut.main(["--jobs", "1", "--at", "2019-07-30", "--top", "1"] + logs) == 0
+
+    output = capsys.readouterr().out
+    assert "Requests: 11\n" in output
+    assert "Non-compliant requests: 3 (27.27 %)\n" in output
+    assert "At 2019-07-30T00:00:00: 27.27 % slowed down, 0.00 % refused\n" in output
+    assert "mambo" in output
+    assert "zoo" not in output
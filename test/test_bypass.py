@@ -0,0 +1,71 @@
+import pytest
+
+from kw.platform import counters, settings, utils
+from kw.platform.bypass import BypassRules
+
+
+@pytest.fixture
+def rules():
+    return BypassRules.parse(
+        "/healthz, /metrics/*, /metrics/internal/*, options, ua:kube-probe/"
+    )
+
+
+@pytest.mark.parametrize(
+    "method,path,user_agent,expected",
+    [
+        ("GET", "/healthz", None, "/healthz"),
+        ("GET", "/healthz/deep", None, None),
+        ("GET", "/metrics/", None, "/metrics/*"),
+        ("GET", "/metrics/internal/jobs", None, "/metrics/internal/*"),
+        ("GET", "/metric", None, None),
+        ("OPTIONS", "/bookings", None, "OPTIONS"),
+        ("GET", "/bookings", "kube-probe/1.18", "ua:kube-probe/"),
+        ("GET", "/bookings", "kube-prob", None),
+        ("GET", "/bookings", "mambo/1a (Kiwi.com dev)", None),
+        ("GET", "/", None, None),
+    ],
+)
+def test_match(rules, method, path, user_agent, expected):
+    assert rules.match(method, path, user_agent) == expected
+
+
+def test_hits(rules, mocker):
+    incr = mocker.spy(counters, "incr")
+
+    rules.match("GET", "/healthz")
+    rules.match("GET", "/healthz")
+    rules.match("GET", "/metrics/cpu")
+    rules.match("GET", "/bookings")
+
+    assert rules.hits == {"/healthz": 2, "/metrics/*": 1}
+    assert incr.call_count == 3
+
+    assert rules.match("GET", "/healthz", count=False) == "/healthz"
+    assert rules.hits["/healthz"] == 2
+    assert incr.call_count == 3
+
+
+def test_parse():
+    rules = BypassRules.parse(" /healthz,,get ,ua:curl/, /static/*")
+
+    assert rules.rules == ["/healthz", "/static/*", "GET", "ua:curl/"]
+    assert str(BypassRules.parse(str(rules))) == str(rules)
+    assert repr(rules) == "BypassRules.parse('/healthz,/static/*,GET,ua:curl/')"
+
+
+def test_empty():
+    rules = BypassRules.parse("")
+
+    assert not rules
+    assert rules.match("GET", "/healthz") is None
+
+
+def test_is_bypassed(restore_settings):
+    assert not utils.is_bypassed("GET", "/healthz")
+
+    settings.update(bypass="/healthz")
+
+    assert settings.KIWI_USER_AGENT_BYPASS == "/healthz"
+    assert utils.is_bypassed("GET", "/healthz")
+    assert not utils.is_bypassed("GET", "/")
@@ -0,0 +1,86 @@
+import gzip
+import json
+
+import pytest
+
+from kw.platform import compression as uut
+
+
+def test_accept_encoding():
+    assert uut.accept_encoding(["gzip", " deflate", "BR"]) == "br, gzip, deflate"
+    assert uut.accept_encoding(["identity", "gzip"]) == "gzip"
+
+
+def test_gzip_compress():
+    data = b"Kiwi.com " * 100
+
+    compressed = uut.gzip_compress(data)
+
+    assert len(compressed) < len(data)
+    assert gzip.decompress(compressed) == data
+
+
+@pytest.mark.parametrize(
+    "kwargs,threshold,compressed",
+    [
+        ({"data": b"x" * 100}, 10, True),
+        ({"data": "x" * 100}, 10, True),
+        ({"data": b"x" * 100}, 1000, False),
+        ({"data": {"key": "x" * 100}}, 10, False),
+        ({"data": b"x" * 100, "headers": {"Content-Encoding": "br"}}, 10, False),
+        ({"data": b"x" * 100, "headers": {"content-encoding": "br"}}, 10, False),
+        ({"data": b"x" * 100}, None, False),
+    ],
+)
+def test_compress_request(kwargs, threshold, compressed):
+    uut.compress_request(kwargs, threshold)
+
+    headers = kwargs.get("headers") or {}
+    assert (headers.get("Content-Encoding") == "gzip") is compressed
+    assert len([key for key in headers if key.lower() == "content-encoding"]) <= 1
+
+
+def test_compress_request__shared_headers():
+    headers = {"Accept": "application/json"}
+    large = {"data": b"x" * 100, "headers": headers}
+    small = {"data": b"x", "headers": headers}
+
+    uut.compress_request(large, threshold=10)
+    uut.compress_request(small, threshold=10)
+
+    assert large["headers"]["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in small["headers"]
+    assert headers == {"Accept": "application/json"}
+
+
+def test_compress_request__json():
+    kwargs = {"json": {"key": "x" * 100}}
+
+    uut.compress_request(kwargs, threshold=10)
+
+    assert "json" not in kwargs
+    assert kwargs["headers"] == {
+        "Content-Type": "application/json",
+        "Content-Encoding": "gzip",
+    }
+    assert json.loads(gzip.decompress(kwargs["data"])) == {"key": "x" * 100}
+
+
+def test_compress_request__small_json():
+    kwargs = {"json": {"key": "value"}}
+
+    uut.compress_request(kwargs, threshold=1000)
+
+    assert kwargs == {
+        "data": b'{"key": "value"}',
+        "headers": {"Content-Type": "application/json"},
+    }
+
+
+def test_compress_request__disabled(mocker):
+    mocker.patch("kw.platform.settings.KIWI_COMPRESS_REQUEST_THRESHOLD", None)
+    kwargs = {"json": {"key": "value"}}
+
+    uut.compress_request(kwargs)
+
+    assert kwargs == {"json": {"key": "value"}}
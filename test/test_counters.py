@@ -0,0 +1,131 @@
+import os
+
+import pytest
+from freezegun import freeze_time
+
+from kw.platform import counters as uut
+from kw.platform.utils import UserAgentValidator, record_validation
+
+
+@pytest.fixture
+def local_counters():
+    local_counters = uut.LocalCounters()
+    uut.use(local_counters)
+    uut.offenders.clear()
+    yield local_counters
+    uut.use(uut.LocalCounters())
+
+
+def test_local_counters():
+    counters = uut.LocalCounters()
+    counters.incr("a")
+    counters.incr("a", 2)
+
+    assert counters.get("a") == 3
+    assert counters.get("b") == 0
+    assert counters.snapshot() == {"a": 3}
+
+
+def test_shared_counters(tmpdir):
+    path = str(tmpdir.join("counters"))
+    counters = uut.SharedCounters(path, max_keys=4, max_workers=4)
+    counters.incr("a")
+    counters.incr("b", 5)
+
+    other = uut.SharedCounters(path, max_keys=4, max_workers=4)
+    other.incr("b")
+
+    assert counters.get("a") == 1
+    assert counters.get("b") == 6
+    assert counters.get("c") == 0
+    assert other.snapshot() == {"a": 1, "b": 6}
+
+    with pytest.raises(ValueError):
+        uut.SharedCounters(path, max_keys=8, max_workers=4).incr("a")
+
+
+def test_shared_counters__dropped(tmpdir):
+    counters = uut.SharedCounters(str(tmpdir.join("counters")), max_keys=3)
+    counters.incr("a")
+    counters.incr("b")
+    counters.incr("c", 2)
+    counters.incr("x" * 64)
+
+    assert counters.snapshot() == {"a": 1, "b": 1, uut.DROPPED_KEY: 3}
+    assert counters.get("c") == 0
+    assert counters.get(uut.DROPPED_KEY) == 3
+
+
+def test_shared_counters__reattach(tmpdir):
+    counters = uut.SharedCounters(str(tmpdir.join("counters")))
+    counters.incr("a")
+    inherited = counters._mmap
+
+    # Pretend the counters have been inherited from a parent process
+    counters._pid = -1
+    counters.incr("a")
+
+    assert inherited.closed
+    assert counters._mmap is not inherited
+    assert counters.get("a") == 2
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_shared_counters__fork(tmpdir):
+    counters = uut.SharedCounters(str(tmpdir.join("counters")), max_workers=8)
+    counters.incr("requests")
+
+    children = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            for _ in range(100):
+                counters.incr("requests")
+            os._exit(0)
+        children.append(pid)
+
+    for pid in children:
+        os.waitpid(pid, 0)
+
+    assert counters.get("requests") == 401
+
+
+def test_record_validation(local_counters):
+    record_validation(UserAgentValidator("mambo/1a (Kiwi.com dev)"))
+    assert local_counters.snapshot() == {}
+
+    with freeze_time("2019-07-26"):
+        record_validation(UserAgentValidator("invalid"))
+    with freeze_time("2020-01-01"):
+        record_validation(UserAgentValidator(None))
+
+    assert local_counters.snapshot() == {
+        "user_agent.invalid": 2,
+        "user_agent.slowdown": 1,
+        "user_agent.restrict": 1,
+    }
+    assert set(uut.offenders.top()) == {("invalid", 1, 0), (None, 1, 0)}
+
+
+def test_space_saving():
+    top_k = uut.SpaceSaving(capacity=3)
+    for key in "aaaaabbbcd":
+        top_k.add(key)
+
+    assert top_k.top() == [("a", 5, 0), ("b", 3, 0), ("d", 2, 1)]
+
+    top_k.add("e")
+    top_k.add("a")
+
+    assert top_k.top(1) == [("a", 6, 0)]
+    assert set(top_k.top()[1:]) == {("b", 3, 0), ("e", 3, 2)}
+
+
+def test_space_saving__heavy_hitters():
+    top_k = uut.SpaceSaving(capacity=10)
+    for i in range(10000):
+        top_k.add("frequent" if i % 4 == 0 else "rare-{}".format(i))
+
+    key, count, error = top_k.top(1)[0]
+    assert key == "frequent"
+    assert count - error <= 2500 <= count
@@ -0,0 +1,97 @@
+import pytest
+from freezegun import freeze_time
+
+from kw.platform import deadline as uut
+from kw.platform import settings
+
+
+def test_remaining():
+    assert uut.remaining() is None
+
+    with freeze_time("2020-01-01 00:00:00") as frozen:
+        token = uut.set_deadline(2)
+        frozen.tick(0.5)
+        assert uut.remaining() == pytest.approx(1.5)
+        uut.reset_deadline(token)
+
+    assert uut.remaining() is None
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [(None, 3.0), ("", 3.0), ("invalid", 3.0), ("1500", 1.5), ("-10", 0.0)],
+)
+def test_parse_header(value, expected):
+    assert uut.parse_header(value, default=3.0) == expected
+
+
+@pytest.mark.parametrize(
+    "timeout,expected",
+    [(None, 2.5), (1, 1), (10, 2.5), ((1, 10), (1, 2.5)), ((None, 1), (2.5, 1))],
+)
+def test_requests_timeout(timeout, expected):
+    assert uut.requests_timeout(timeout, 2.5) == expected
+
+
+def test_apply_deadline():
+    kwargs = {"timeout": 10, "headers": None}
+
+    with freeze_time():
+        token = uut.set_deadline(2.5)
+        uut.apply_deadline(kwargs)
+        uut.reset_deadline(token)
+
+    assert kwargs == {
+        "timeout": 2.5,
+        "headers": {settings.KIWI_DEADLINE_HEADER: "2500"},
+    }
+
+
+def test_apply_deadline__shared_headers():
+    headers = {"Accept": "application/json"}
+
+    with freeze_time() as frozen:
+        token = uut.set_deadline(0.2)
+        first = {"headers": headers}
+        uut.apply_deadline(first)
+        uut.reset_deadline(token)
+
+        token = uut.set_deadline(5)
+        frozen.tick(1)
+        second = {"headers": headers}
+        uut.apply_deadline(second)
+        uut.reset_deadline(token)
+
+        third = {"headers": headers}
+        uut.apply_deadline(third)
+
+    assert first["headers"][settings.KIWI_DEADLINE_HEADER] == "200"
+    assert second["headers"][settings.KIWI_DEADLINE_HEADER] == "4000"
+    assert third["headers"] is headers
+    assert headers == {"Accept": "application/json"}
+
+
+def test_apply_deadline__replaces_header():
+    kwargs = {"headers": {settings.KIWI_DEADLINE_HEADER.lower(): "9999"}}
+
+    with freeze_time():
+        token = uut.set_deadline(1)
+        uut.apply_deadline(kwargs)
+        uut.reset_deadline(token)
+
+    assert kwargs["headers"] == {settings.KIWI_DEADLINE_HEADER: "1000"}
+
+
+def test_apply_deadline__no_deadline():
+    kwargs = {"timeout": 10}
+    uut.apply_deadline(kwargs)
+    assert kwargs == {"timeout": 10}
+
+
+def test_apply_deadline__exceeded():
+    token = uut.set_deadline(0)
+    try:
+        with pytest.raises(uut.DeadlineExceeded):
+            uut.apply_deadline({})
+    finally:
+        uut.reset_deadline(token)
@@ -0,0 +1,113 @@
+import httpretty
+import pytest
+import requests
+
+from kw.platform import httplib as uut
+from kw.platform import requests as kw_requests
+
+
+try:
+    import http.client as httplib
+    from urllib.request import Request, urlopen
+except ImportError:  # Python 2
+    import httplib
+    from urllib2 import Request, urlopen
+
+
+URL = "http://kiwi.com/"
+USER_AGENT = "unittest/1.0 (Kiwi.com test-env)"
+
+
+@pytest.fixture
+def http():
+    httpretty.enable()
+    try:
+        yield httpretty
+    finally:
+        httpretty.disable()
+        httpretty.reset()
+
+
+@pytest.fixture
+def patch_httplib(app_env_vars):
+    uut.monkey.patch()
+    yield
+    uut.monkey.unpatch()
+
+
+def test_httplib__urllib(http, mocker, patch_httplib):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    sunset_date = "Sat, 31 Dec 2018 23:59:59 GMT"
+    http.register_uri(
+        http.GET, URL, body="Hello", adding_headers={"Sunset": sunset_date}
+    )
+
+    assert urlopen(URL).read() == b"Hello"
+
+    assert http.last_request().headers["User-Agent"] == USER_AGENT
+    m_capture_message.assert_called_once_with(
+        "The Sunset header found in the HTTP response: " + sunset_date, level="warning"
+    )
+
+
+def test_httplib__requests(http, patch_httplib):
+    http.register_uri(http.GET, URL, body="Hello")
+
+    requests.get(URL)
+    assert http.last_request().headers["User-Agent"] == USER_AGENT
+
+    requests.get(URL, headers={"User-Agent": "custom/1.0 (Kiwi.com test-env)"})
+    assert http.last_request().headers["User-Agent"] == "custom/1.0 (Kiwi.com test-env)"
+
+
+def test_httplib__unpatched(http, app_env_vars):
+    http.register_uri(http.GET, URL, body="Hello")
+
+    uut.monkey.patch()
+    uut.monkey.unpatch()
+    urlopen(Request(URL)).read()
+
+    assert "Python-urllib" in http.last_request().headers["User-Agent"]
+
+
+def test_httplib__connection(http, patch_httplib):
+    http.register_uri(http.GET, URL, body="Hello")
+
+    connection = httplib.HTTPConnection("kiwi.com")
+    connection.request("GET", "/")
+    assert connection.getresponse().read() == b"Hello"
+    assert http.last_request().headers["User-Agent"] == USER_AGENT
+
+    connection.request("GET", "/", headers={"User-Agent": "custom/1.0"})
+    assert connection.getresponse().read() == b"Hello"
+    assert http.last_request().headers["User-Agent"] == "custom/1.0"
+
+
+def test_httplib__without_user_agent(http, monkeypatch):
+    monkeypatch.delenv("APP_NAME", raising=False)
+    http.register_uri(http.GET, URL, body="Hello")
+
+    uut.monkey.patch()
+    try:
+        assert urlopen(URL).read() == b"Hello"
+    finally:
+        uut.monkey.unpatch()
+
+    assert "Python-urllib" in http.last_request().headers["User-Agent"]
+
+
+def test_httplib__with_requests_patches(http, mocker, patch_httplib):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    http.register_uri(
+        http.GET, URL, body="Hello", adding_headers={"Sunset": "Sat, 31 Dec 2018"}
+    )
+
+    kw_requests.monkey.patch()
+    try:
+        requests.get(URL)
+    finally:
+        kw_requests.monkey.unpatch()
+    assert m_capture_message.call_count == 1
+
+    kw_requests.KiwiSession().get(URL)
+    assert m_capture_message.call_count == 2
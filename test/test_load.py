@@ -0,0 +1,72 @@
+import pytest
+
+from kw.platform import load as uut
+from kw.platform.utils import UserAgentValidator
+
+
+def test_load_monitor__in_flight():
+    monitor = uut.LoadMonitor(slowdown_in_flight=2, restrict_in_flight=5)
+
+    monitor.request_started()
+    assert monitor.level == uut.PASS
+
+    monitor.request_started()
+    assert monitor.level == uut.SLOWDOWN
+
+    for _ in range(3):
+        monitor.request_started()
+    assert monitor.level == uut.RESTRICT
+
+    # 4 >= 5 * 0.8, stays restricted
+    monitor.request_finished(0.1)
+    assert monitor.level == uut.RESTRICT
+
+    monitor.request_finished(0.1)
+    assert monitor.level == uut.SLOWDOWN
+
+    # 2 >= 2 * 0.8, stays slowed down
+    monitor.request_finished(0.1)
+    assert monitor.level == uut.SLOWDOWN
+
+    monitor.request_finished(0.1)
+    monitor.request_finished(0.1)
+    assert monitor.level == uut.PASS
+    assert monitor.in_flight == 0
+
+
+def test_load_monitor__latency_and_lag():
+    monitor = uut.LoadMonitor(slowdown_latency=1.0, restrict_lag=0.5, smoothing=0.5)
+
+    monitor.request_started()
+    monitor.request_finished(2.0)
+    assert monitor.latency == 1.0
+    assert monitor.level == uut.SLOWDOWN
+
+    monitor.record_lag(0.6)
+    assert monitor.level == uut.RESTRICT
+
+    monitor.record_lag(0.0)
+    assert monitor.level == uut.SLOWDOWN
+
+    monitor.request_started()
+    monitor.request_finished(0.0)
+    assert monitor.level == uut.PASS
+
+
+@pytest.mark.parametrize(
+    "user_agent,level,slowdown,restrict",
+    [
+        ("invalid", uut.PASS, False, False),
+        ("invalid", uut.SLOWDOWN, True, False),
+        ("invalid", uut.RESTRICT, False, True),
+        ("mambo/1a (Kiwi.com dev)", uut.RESTRICT, False, False),
+    ],
+)
+def test_user_agent_validator__load(user_agent, level, slowdown, restrict):
+    monitor = uut.LoadMonitor()
+    monitor.level = level
+
+    user_agent = UserAgentValidator(user_agent, load=monitor)
+
+    assert user_agent.slowdown is slowdown
+    assert user_agent.restrict is restrict
@@ -0,0 +1,109 @@
+import socket
+
+import pytest
+from freezegun import freeze_time
+from webob.request import BaseRequest
+
+from kw.platform import counters, deadline, metrics, utils, wsgi
+
+
+@pytest.fixture
+def enabled_metrics(monkeypatch):
+    monkeypatch.setattr(counters, "_counters", counters.LocalCounters())
+    monkeypatch.setattr(metrics, "_histograms", {})
+    metrics.enable()
+    yield
+    metrics.disable()
+
+
+@pytest.fixture
+def statsd_server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(1)
+    yield server
+    server.close()
+
+
+def test_histogram():
+    histogram = metrics.Histogram(buckets=(0.1, 1.0))
+
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.snapshot() == ([2, 1, 1], 4, 2.65)
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(counters, "_counters", counters.LocalCounters())
+    monkeypatch.setattr(metrics, "_histograms", {})
+
+    metrics.incr("user_agent.validated")
+    metrics.observe("user_agent.delay_seconds", 0.1)
+
+    assert counters.snapshot() == {}
+    assert metrics.histograms() == {}
+
+
+def test_render_prometheus(enabled_metrics):
+    with freeze_time("2020-01-01"):
+        utils.record_validation(utils.UserAgentValidator("invalid"))
+    metrics.histogram("user_agent.delay_seconds", buckets=(0.1, 1.0)).observe(0.5)
+
+    assert metrics.render_prometheus().splitlines() == [
+        "# TYPE kiwi_platform_user_agent_invalid_total counter",
+        "kiwi_platform_user_agent_invalid_total 1",
+        "# TYPE kiwi_platform_user_agent_restrict_total counter",
+        "kiwi_platform_user_agent_restrict_total 1",
+        "# TYPE kiwi_platform_user_agent_validated_total counter",
+        "kiwi_platform_user_agent_validated_total 1",
+        "# TYPE kiwi_platform_user_agent_delay_seconds histogram",
+        'kiwi_platform_user_agent_delay_seconds_bucket{le="0.1"} 0',
+        'kiwi_platform_user_agent_delay_seconds_bucket{le="1.0"} 1',
+        'kiwi_platform_user_agent_delay_seconds_bucket{le="+Inf"} 1',
+        "kiwi_platform_user_agent_delay_seconds_sum 0.5",
+        "kiwi_platform_user_agent_delay_seconds_count 1",
+    ]
+
+
+def test_deadline_exceeded(enabled_metrics):
+    token = deadline.set_deadline(0)
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.apply_deadline({})
+    finally:
+        deadline.reset_deadline(token)
+
+    assert counters.get("deadline.exceeded") == 1
+
+
+def test_prometheus_app(enabled_metrics):
+    counters.incr("sunset.seen")
+
+    res = BaseRequest.blank("/metrics").get_response(wsgi.prometheus_app())
+
+    assert res.status_code == 200
+    assert res.content_type == "text/plain"
+    assert b"kiwi_platform_sunset_seen_total 1\n" in res.body
+
+
+def test_statsd_emitter(enabled_metrics, statsd_server, monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_DATAGRAM_SIZE", 100)
+    emitter = metrics.StatsDEmitter(*statsd_server.getsockname())
+    counters.incr("sunset.seen", 3)
+    metrics.observe("user_agent.delay_seconds", 0.25)
+
+    assert emitter.flush() == 2
+    lines = []
+    for _ in range(2):
+        lines.extend(statsd_server.recv(1024).decode("utf-8").splitlines())
+    assert lines == [
+        "kiwi_platform.sunset.seen:3|c",
+        "kiwi_platform.user_agent.delay_seconds.count:1|c",
+        "kiwi_platform.user_agent.delay_seconds.sum:0.25|c",
+    ]
+
+    counters.incr("sunset.seen")
+    assert emitter.flush() == 1
+    assert statsd_server.recv(1024) == b"kiwi_platform.sunset.seen:1|c"
+    assert emitter.flush() == 0
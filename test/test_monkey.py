@@ -1,3 +1,6 @@
+import threading
+import time
+
 from kw.platform import monkey
 
 
@@ -13,3 +16,44 @@ def test_patch(mocker):
 
     assert "requests" in monkey._PATCHED_MODULES
     m_patch.assert_called_once_with()
+
+
+def test_unpatch_and_status(mocker):
+    m_module = mocker.Mock()
+    mocker.patch("kw.platform.monkey._import_module", return_value=m_module)
+    mocker.patch("kw.platform.monkey._PATCHED_MODULES", set())
+
+    monkey.patch(requests=True, urllib3=True)
+
+    assert monkey.status() == {
+        "requests": True,
+        "aiohttp": False,
+        "urllib3": True,
+        "httplib": False,
+    }
+
+    monkey.unpatch(urllib3=True)
+    assert monkey.status()["urllib3"] is False
+    assert m_module.unpatch.call_count == 1
+
+    monkey.unpatch()
+    assert not any(monkey.status().values())
+    assert m_module.unpatch.call_count == 2
+
+
+def test_patch__concurrent(mocker):
+    m_module = mocker.Mock()
+    m_module.patch.side_effect = lambda: time.sleep(0.01)
+    mocker.patch("kw.platform.monkey._import_module", return_value=m_module)
+    mocker.patch("kw.platform.monkey._PATCHED_MODULES", set())
+
+    threads = [
+        threading.Thread(target=monkey.patch, kwargs={"aiohttp": True})
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    m_module.patch.assert_called_once_with()
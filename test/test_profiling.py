@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+import pytest
+
+from kw.platform import profiling, utils
+
+
+Response = namedtuple("Response", ["headers"])
+
+
+@pytest.fixture
+def enabled_profiling(monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    profiling.reset()
+    yield
+    profiling.reset()
+
+
+def test_timed(enabled_profiling, mocker):
+    mocker.patch.object(profiling, "clock", side_effect=[1.0, 1.5])
+
+    @profiling.timed("kw-test")
+    def func(value):
+        return value
+
+    token = profiling.start_request()
+    assert func(42) == 42
+    timings = profiling.finish_request(token)
+
+    assert timings == {"kw-test": 0.5}
+    assert profiling.totals() == {"kw-test": (1, 0.5)}
+
+
+def test_timed__disabled(mocker):
+    clock = mocker.patch.object(profiling, "clock")
+
+    @profiling.timed("kw-test")
+    def func():
+        return 42
+
+    assert func() == 42
+    assert not clock.called
+
+
+def test_add__outside_request(enabled_profiling):
+    profiling.add(profiling.SENTRY, 0.25)
+    profiling.add(profiling.SENTRY, 0.25)
+
+    assert profiling.finish_request(profiling.start_request()) == {}
+    assert profiling.totals() == {profiling.SENTRY: (2, 0.5)}
+
+
+def test_server_timing():
+    timings = {profiling.VALIDATE: 0.0001, profiling.SLOWDOWN: 0.25}
+
+    assert (
+        profiling.server_timing(timings)
+        == "kw-slowdown;dur=250.000, kw-validate;dur=0.100"
+    )
+
+
+def test_measured_places(enabled_profiling):
+    utils.validate_request("GET", "/", "mambo/1a (Kiwi.com dev)")
+    utils.add_user_agent_header({}, "mambo/1a (Kiwi.com dev)")
+    utils.report_to_sentry(Response(headers={}))
+
+    assert set(profiling.totals()) == {
+        profiling.VALIDATE,
+        profiling.USER_AGENT_HEADER,
+        profiling.SENTRY,
+    }
+
+
+def test_measured_places__disabled(mocker):
+    clock = mocker.patch.object(profiling, "clock")
+
+    utils.validate_request("GET", "/", "mambo/1a (Kiwi.com dev)")
+    utils.add_user_agent_header({}, "mambo/1a (Kiwi.com dev)")
+    utils.report_to_sentry(Response(headers={}))
+
+    assert not clock.called
@@ -1,10 +1,13 @@
+import gzip
+import json
+
 import httpretty
 import pytest
 import requests
 import wrapt
 
 from kw.platform import requests as uut
-from kw.platform import wrappers
+from kw.platform import deadline, utils, wrappers
 
 
 URL = "http://kiwi.com"
@@ -18,7 +21,7 @@ def patch_requests(mocker, app_env_vars):
 
     yield
 
-    del requests.__kiwi_platform_patch  # pylint: disable=no-member
+    uut.monkey.unpatch()
 
 
 @pytest.fixture
@@ -48,6 +51,116 @@ def test_requests__kiwi_session(http, mocker, app_env_vars):
     )
 
 
+def test_requests__kiwi_session__sampler(http, mocker, app_env_vars):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+
+    http.register_uri(
+        http.GET,
+        URL,
+        body="Hello",
+        adding_headers={"Sunset": "Sat, 31 Dec 2018 23:59:59 GMT"},
+    )
+
+    session = uut.KiwiSession()
+    session.sampler = utils.ReportSampler(rates=0.0)
+    session.get(URL)
+
+    m_capture_message.assert_not_called()
+    assert session.sampler.seen == {utils.SUNSET: 1}
+
+
+def test_requests__kiwi_session__deadline(http, mocker, app_env_vars):
+    http.register_uri(http.GET, URL, body="Hello")
+    m_send = mocker.spy(requests.Session, "send")
+
+    token = deadline.set_deadline(2)
+    try:
+        resp = uut.KiwiSession().get(URL, timeout=10)
+
+        assert 1900 < int(resp.request.headers["X-Request-Deadline-Ms"]) <= 2000
+        assert 1.9 < m_send.call_args[1]["timeout"] <= 2
+
+        deadline.set_deadline(0)
+        with pytest.raises(deadline.DeadlineExceeded):
+            uut.KiwiSession().get(URL)
+    finally:
+        deadline.reset_deadline(token)
+
+
+def test_requests__kiwi_session__deadline__shared_headers(http, app_env_vars):
+    http.register_uri(http.GET, URL, body="Hello")
+    headers = {"Accept": "text/plain"}
+    session = uut.KiwiSession()
+
+    token = deadline.set_deadline(0.2)
+    try:
+        resp = session.get(URL, headers=headers)
+    finally:
+        deadline.reset_deadline(token)
+    assert int(resp.request.headers["X-Request-Deadline-Ms"]) <= 200
+
+    resp = session.get(URL, headers=headers)
+    assert "X-Request-Deadline-Ms" not in resp.request.headers
+    assert "X-Request-Deadline-Ms" not in headers
+
+
+def test_requests__patched__deadline(http, patch_requests):
+    http.register_uri(http.GET, URL, body="Kiwi.com frontpage")
+
+    token = deadline.set_deadline(0)
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            requests.get(URL)
+    finally:
+        deadline.reset_deadline(token)
+
+
+def test_requests__kiwi_session__compression(http, app_env_vars):
+    http.register_uri(http.POST, URL, body="Hello")
+
+    session = uut.KiwiSession()
+    session.compress_threshold = 100
+    resp = session.post(URL, json={"key": "x" * 100})
+
+    assert "gzip" in resp.request.headers["Accept-Encoding"]
+    assert resp.request.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(http.last_request().body)) == {"key": "x" * 100}
+
+
+def test_requests__kiwi_session__stream_ndjson(http, app_env_vars):
+    http.register_uri(http.GET, URL, body='{"id": 1}\n{"id": 2}\n')
+
+    records = uut.KiwiSession().stream_ndjson("GET", URL, chunk_size=4)
+
+    assert list(records) == [{"id": 1}, {"id": 2}]
+
+
+def test_requests__kiwi_session__stream_json_array(http, app_env_vars):
+    http.register_uri(http.GET, URL, body='[{"id": 1}, {"id": 2}]')
+    http.register_uri(http.GET, URL + "/error", status=500, body="[]")
+    session = uut.KiwiSession()
+
+    assert list(session.stream_json_array("GET", URL)) == [{"id": 1}, {"id": 2}]
+    with pytest.raises(requests.HTTPError):
+        list(session.stream_json_array("GET", URL + "/error"))
+
+
+@pytest.mark.parametrize(
+    "content_type,body",
+    [
+        ("application/json", '{"key": "value"}'.encode("utf-8")),
+        ("application/json; charset=utf-16", '{"key": "value"}'.encode("utf-16")),
+    ],
+)
+def test_requests__kiwi_session__json(http, app_env_vars, content_type, body):
+    http.register_uri(http.GET, URL, body=body, content_type=content_type)
+
+    resp = uut.KiwiSession().get(URL)
+
+    assert isinstance(resp, uut.session.KiwiResponse)
+    assert resp.json() == {"key": "value"}
+
+
 def test_requests__patched(http, patch_requests):
     http.register_uri(http.GET, URL, body="Kiwi.com frontpage")
 
@@ -57,6 +170,50 @@ def test_requests__patched(http, patch_requests):
     assert getattr(requests, "__kiwi_platform_patch") is True
 
 
+def test_requests__unpatch(http, app_env_vars):
+    original = requests.Session.__dict__["request"]
+
+    uut.monkey.patch()
+
+    wrapper = requests.Session.__dict__["request"]
+    assert wrapper.__wrapped__ is original
+    assert uut.monkey.interceptor.hooks == ["user_agent", "sentry", "deadline"]
+
+    uut.monkey.unpatch()
+
+    assert requests.Session.__dict__["request"] is original
+    assert not uut.monkey.interceptor.hooks
+    assert not hasattr(requests, "__kiwi_platform_patch")
+
+
+def test_interceptor(http):
+    http.register_uri(http.GET, URL, body="Kiwi.com frontpage")
+    calls = []
+
+    def add_header(instance, kwargs):
+        calls.append("pre")
+        kwargs.setdefault("headers", {})["X-Test"] = "1"
+
+    interceptor = wrappers.Interceptor("requests", "Session.request")
+    interceptor.add_hook("header", pre=add_header)
+    interceptor.add_hook("status", post=lambda _, resp: calls.append(resp.status_code))
+    interceptor.patch()
+    interceptor.patch()
+    try:
+        res = requests.get(URL)
+        assert res.request.headers["X-Test"] == "1"
+        assert calls == ["pre", 200]
+
+        interceptor.remove_hook("header")
+        res = requests.get(URL)
+        assert "X-Test" not in res.request.headers
+        assert calls == ["pre", 200, 200]
+    finally:
+        interceptor.unpatch()
+
+    assert not interceptor.patched
+
+
 def test_requests__not_patched(http):
     http.register_uri(http.GET, URL, body="Kiwi.com frontpage")
 
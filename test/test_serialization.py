@@ -0,0 +1,42 @@
+import pytest
+
+from kw.platform import serialization as uut
+
+
+@pytest.fixture
+def restore_backend():
+    backend = uut.backend()
+    yield
+    uut.use(backend.name)
+
+
+def test_default_backend():
+    assert uut.backend() == uut.BACKENDS[0]
+    assert uut.BACKENDS[-1].name == "json"
+
+
+@pytest.mark.parametrize("backend", [backend.name for backend in uut.BACKENDS])
+def test_backend(backend, restore_backend):
+    uut.use(backend)
+
+    assert uut.backend().name == backend
+    assert uut.loads(uut.dumps({"key": ["value", 1]})) == {"key": ["value", 1]}
+    assert uut.loads(b'{"key": "\\u0159"}') == {"key": b"\xc5\x99".decode("utf-8")}
+    assert uut.loads(bytearray(b"[1, 2]")) == [1, 2]
+    with pytest.raises(ValueError):
+        uut.loads(b"{invalid")
+
+
+def test_use__not_installed(restore_backend):
+    with pytest.raises(ValueError):
+        uut.use("simplejson")
+
+
+def test_use_configured__not_installed(restore_backend, monkeypatch, caplog):
+    monkeypatch.setattr(uut.settings, "KIWI_JSON_BACKEND", "simplejson")
+    uut.use("json")
+
+    uut._use_configured()
+
+    assert uut.backend() == uut.BACKENDS[0]
+    assert "simplejson" in caplog.text
@@ -0,0 +1,114 @@
+import json
+import os
+from datetime import datetime
+
+from freezegun import freeze_time
+
+from kw.platform import settings as uut
+from kw.platform import utils
+from kw.platform.utils import UserAgentValidator
+
+
+def test_update(restore_settings):
+    snapshot = uut.update(
+        restrict_datetime="2019-07-20T13:00:00",
+        enable_restriction_of_requests="false",
+    )
+
+    assert uut.current() is snapshot
+    assert snapshot.restrict_datetime == datetime(2019, 7, 20, 13, 0, 0)
+    assert snapshot.enable_restriction_of_requests is False
+    assert uut.KIWI_REQUESTS_RESTRICT_DATETIME == "2019-07-20T13:00:00"
+    assert uut.KIWI_ENABLE_RESTRICTION_OF_REQUESTS is False
+
+
+def test_update__takes_effect_on_next_validation(restore_settings):
+    with freeze_time("2019-07-26"):
+        assert UserAgentValidator("invalid").slowdown is True
+
+        uut.update(restrict_datetime="2019-07-25T00:00:00")
+
+        assert UserAgentValidator("invalid").slowdown is False
+        assert UserAgentValidator("invalid").restrict is True
+
+
+def test_assigned_constant(restore_settings, monkeypatch):
+    monkeypatch.setattr(uut, "KIWI_ENABLE_RESTRICTION_OF_REQUESTS", False)
+    monkeypatch.setattr(uut, "KIWI_REQUESTS_RESTRICT_DATETIME", "2019-07-25")
+
+    snapshot = uut.current()
+
+    assert snapshot.enable_restriction_of_requests is False
+    assert snapshot.restrict_datetime == datetime(2019, 7, 25)
+    assert uut.current() is snapshot
+
+
+def test_assigned_constant__invalid(restore_settings, monkeypatch, caplog):
+    snapshot = uut.current()
+    monkeypatch.setattr(uut, "KIWI_REQUESTS_RESTRICT_DATETIME", "not a date")
+
+    assert uut.current() is snapshot
+    assert uut.current() is snapshot
+    assert len(caplog.records) == 1
+    assert caplog.records[0].levelname == "ERROR"
+
+    monkeypatch.setattr(uut, "KIWI_REQUESTS_RESTRICT_DATETIME", "2019-07-25")
+
+    assert uut.current().restrict_datetime == datetime(2019, 7, 25)
+
+
+def test_deprecated_datetimes():
+    assert utils.REQ_SLOWDOWN_DATETIME == uut._initial.slowdown_datetime
+    assert utils.REQ_RESTRICT_DATETIME == uut._initial.restrict_datetime
+
+
+def test_reload_from_environ(restore_settings, monkeypatch):
+    monkeypatch.setenv("KIWI_REQUESTS_SLOWDOWN_DATETIME", "2019-06-01T00:00:00")
+    monkeypatch.setenv("KIWI_RESTRICT_USER_AGENT_MESSAGE", "Go away")
+
+    snapshot = uut.reload_from_environ()
+
+    assert snapshot.slowdown_datetime == datetime(2019, 6, 1)
+    assert snapshot.restrict_user_agent_message == "Go away"
+
+
+def test_watch_file(restore_settings, tmpdir):
+    path = str(tmpdir.join("settings.json"))
+    with open(path, "w") as f:
+        json.dump({"KIWI_ENABLE_RESTRICTION_OF_REQUESTS": "false"}, f)
+
+    watcher = uut.FileWatcher(path, interval=60)
+    assert watcher.check() is True
+    assert uut.current().enable_restriction_of_requests is False
+    assert watcher.check() is False
+
+    with open(path, "w") as f:
+        json.dump({"KIWI_ENABLE_RESTRICTION_OF_REQUESTS": "true"}, f)
+    os.utime(path, (0, 0))
+
+    assert watcher.check() is True
+    assert uut.current().enable_restriction_of_requests is True
+
+
+def test_watch_file__invalid(restore_settings, tmpdir):
+    path = str(tmpdir.join("settings.json"))
+    with open(path, "w") as f:
+        f.write("{invalid")
+
+    snapshot = uut.current()
+    assert uut.FileWatcher(path).check() is False
+    assert uut.current() is snapshot
+
+
+def test_watch_file__not_object(restore_settings, tmpdir):
+    path = str(tmpdir.join("settings.json"))
+    with open(path, "w") as f:
+        json.dump(["KIWI_ENABLE_RESTRICTION_OF_REQUESTS"], f)
+
+    snapshot = uut.current()
+    assert uut.FileWatcher(path).check() is False
+    assert uut.current() is snapshot
+
+
+def test_watch_file__missing(restore_settings, tmpdir):
+    assert uut.FileWatcher(str(tmpdir.join("missing.json"))).check() is False
@@ -0,0 +1,74 @@
+import pytest
+
+from kw.platform import settings, slowdown
+
+
+@pytest.fixture
+def durations(monkeypatch):
+    estimator = slowdown.DurationEstimator(alpha=0.5)
+    monkeypatch.setattr(slowdown, "durations", estimator)
+    return estimator
+
+
+def test_duration_estimator():
+    estimator = slowdown.DurationEstimator(alpha=0.5, default=0.1, max_routes=2)
+
+    assert estimator.estimate("GET /") == 0.1
+
+    estimator.record("GET /", 1.0)
+    estimator.record("GET /", 2.0)
+    estimator.record("GET /other", 3.0)
+    estimator.record("GET /", 1.5)
+    estimator.record("GET /new", 4.0)
+
+    assert estimator.estimate("GET /") == 1.5
+    assert estimator.estimate("GET /other") == 0.1
+    assert estimator.estimate("GET /new") == 4.0
+    assert len(estimator) == 2
+
+
+def test_held_bytes():
+    held_bytes = slowdown.HeldBytes(limit=100)
+
+    assert held_bytes.acquire(60)
+    assert not held_bytes.acquire(60)
+    held_bytes.release(60)
+    assert held_bytes.acquire(60)
+    assert held_bytes.held == 60
+
+    assert slowdown.HeldBytes().acquire(1000000000)
+
+
+def test_held_bytes__settings(restore_settings):
+    settings.update(slowdown_max_held_bytes="100")
+    assert not slowdown.held_bytes.acquire(101)
+
+    settings.update(slowdown_max_held_bytes=None)
+    assert slowdown.held_bytes.acquire(101)
+    slowdown.held_bytes.release(101)
+
+
+def test_estimate_delay(durations):
+    durations.record("GET /", 1.0)
+
+    assert slowdown.estimate_delay("GET /", jitter=0) == 1.0
+    for _ in range(100):
+        assert 0.9 <= slowdown.estimate_delay("GET /", jitter=0.1) <= 1.1
+
+
+def test_delays_before_handler(monkeypatch):
+    assert not slowdown.delays_before_handler()
+
+    monkeypatch.setattr(settings, "KIWI_SLOWDOWN_MODE", slowdown.BEFORE)
+
+    assert slowdown.delays_before_handler()
+
+
+def test_slowdown_mode(restore_settings):
+    assert settings.update(slowdown_mode="Before").slowdown_mode == slowdown.BEFORE
+    assert settings.update(slowdown_mode=None).slowdown_mode == slowdown.AFTER
+
+    with pytest.raises(ValueError):
+        settings.update(slowdown_mode="befor")
+    assert settings.current().slowdown_mode == slowdown.AFTER
+    assert settings._SLOWDOWN_MODES == (slowdown.AFTER, slowdown.BEFORE)
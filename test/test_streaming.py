@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from kw.platform import streaming as uut
+
+
+RECORDS = [
+    {"id": 1, "name": "Kiwi.com", "tags": ["a", "b"]},
+    {"id": 2, "name": 'escaped \\" quote, [bracket] {brace}', "nested": {"x": [1]}},
+    "text",
+    3.5,
+    None,
+    [],
+]
+
+
+def split(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]  # noqa: E203
+
+
+def ndjson(records):
+    return "\n".join(json.dumps(record) for record in records).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_ndjson_decoder(chunk_size):
+    body = ndjson(RECORDS) + b"\n\n"
+    decoder = uut.NDJSONDecoder()
+
+    records = list(uut.iter_records(split(body, chunk_size), decoder))
+
+    assert records == RECORDS
+
+
+def test_ndjson_decoder__without_trailing_newline():
+    decoder = uut.NDJSONDecoder()
+    assert list(uut.iter_records([ndjson(RECORDS)], decoder)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_json_array_decoder(chunk_size):
+    body = json.dumps(RECORDS, indent=2).encode("utf-8")
+    decoder = uut.JSONArrayDecoder()
+
+    records = list(uut.iter_records(split(body, chunk_size), decoder))
+
+    assert records == RECORDS
+
+
+@pytest.mark.parametrize("body", [b"[]", b" [ ] ", b"[1]", b'["a"]'])
+def test_json_array_decoder__small(body):
+    decoder = uut.JSONArrayDecoder()
+    assert list(uut.iter_records([body], decoder)) == json.loads(body)
+
+
+@pytest.mark.parametrize("body", [b'{"a": 1}', b"[1, 2", b"[1] 2", b"[1, {]"], ids=str)
+def test_json_array_decoder__invalid(body):
+    with pytest.raises(ValueError):
+        list(uut.iter_records([body], uut.JSONArrayDecoder()))
+
+
+@pytest.mark.parametrize(
+    "decoder_class,body",
+    [
+        (uut.NDJSONDecoder, b'"short"\n"' + b"x" * 30),
+        (uut.JSONArrayDecoder, b'["short", "' + b"x" * 30),
+    ],
+)
+def test_decoder__max_record_size(decoder_class, body):
+    decoder = decoder_class(max_record_size=20)
+
+    with pytest.raises(uut.LimitExceeded):
+        list(uut.iter_records(split(body, 5), decoder))
+
+
+def test_decoder__max_body_size():
+    decoder = uut.NDJSONDecoder(max_body_size=100)
+    body = ndjson([{"id": i} for i in range(20)])
+
+    with pytest.raises(uut.LimitExceeded):
+        list(uut.iter_records(split(body, 10), decoder))
+
+
+def _generate_body(count, chunk_size=4096):
+    """Yield a JSON lines body of ``count`` records without building it whole."""
+    record = json.dumps({"id": 0, "payload": "x" * 200}).encode("utf-8") + b"\n"
+    chunk = record * (chunk_size // len(record))
+    for _ in range(count // (chunk_size // len(record))):
+        yield chunk
+
+
+@pytest.mark.parametrize("decoder_class", [uut.NDJSONDecoder, uut.JSONArrayDecoder])
+def test_decoder__peak_memory_is_flat(decoder_class):
+    tracemalloc = pytest.importorskip("tracemalloc")
+
+    def peak_memory(count):
+        def body():
+            if decoder_class is uut.JSONArrayDecoder:
+                yield b"["
+                for chunk in _generate_body(count):
+                    yield chunk.replace(b"\n", b",")
+                yield b"0]"
+            else:
+                for chunk in _generate_body(count):
+                    yield chunk
+
+        tracemalloc.start()
+        try:
+            for _ in uut.iter_records(body(), decoder_class()):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    small, large = peak_memory(1000), peak_memory(20000)
+
+    assert large < 64 * 1024
+    assert large < small * 1.5
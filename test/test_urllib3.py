@@ -0,0 +1,53 @@
+import httpretty
+import pytest
+import urllib3
+
+from kw.platform import urllib3 as uut
+
+
+URL = "http://kiwi.com/"
+
+
+@pytest.fixture
+def http():
+    httpretty.enable()
+    try:
+        yield httpretty
+    finally:
+        httpretty.disable()
+        httpretty.reset()
+
+
+@pytest.fixture
+def patch_urllib3(app_env_vars):
+    uut.monkey.patch()
+    yield
+    uut.monkey.unpatch()
+
+
+def test_urllib3__patched(http, mocker, patch_urllib3):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    sunset_date = "Sat, 31 Dec 2018 23:59:59 GMT"
+    http.register_uri(
+        http.GET, URL, body="Hello", adding_headers={"Sunset": sunset_date}
+    )
+
+    urllib3.PoolManager(headers={"X-Test": "1"}).request("GET", URL)
+
+    assert http.last_request().headers["User-Agent"] == (
+        "unittest/1.0 (Kiwi.com test-env)"
+    )
+    assert http.last_request().headers["X-Test"] == "1"
+    m_capture_message.assert_called_once_with(
+        "The Sunset header found in the HTTP response: " + sunset_date, level="warning"
+    )
+
+
+def test_urllib3__unpatched(http, app_env_vars):
+    http.register_uri(http.GET, URL, body="Hello")
+
+    uut.monkey.patch()
+    uut.monkey.unpatch()
+    urllib3.PoolManager().request("GET", URL)
+
+    assert "unittest" not in http.last_request().headers.get("User-Agent", "")
@@ -1,6 +1,12 @@
+import json
+import threading
+from datetime import datetime
+
 import pytest
 from freezegun import freeze_time
+from multidict import CIMultiDict
 
+from kw.platform import settings
 from kw.platform import utils as uut
 
 
@@ -36,6 +42,29 @@ def test_user_agent_restriction_disabled(mocker):
         assert uut.UserAgentValidator("invalid").restrict is False
 
 
+def test_refusal(restore_settings, monkeypatch):
+    refusal = uut.refusal()
+
+    assert json.loads(refusal.body.decode("utf-8")) == {
+        "message": settings.KIWI_RESTRICT_USER_AGENT_MESSAGE
+    }
+    assert dict(refusal.headers) == {
+        "Content-Type": "application/json; charset=utf-8",
+        "Content-Length": str(len(refusal.body)),
+    }
+    assert refusal.close is False
+    assert uut.refusal() is refusal
+
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_CLOSE_CONNECTION", True)
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_RETRY_AFTER", 3600)
+    settings.update(restrict_user_agent_message="Go away")
+    refusal = uut.refusal()
+
+    assert json.loads(refusal.body.decode("utf-8")) == {"message": "Go away"}
+    assert ("Retry-After", "3600") in refusal.headers
+    assert refusal.close is True
+
+
 def test_construct_user_agent(app_env_vars):
     user_agent = uut.construct_user_agent()
     assert user_agent == "unittest/1.0 (Kiwi.com test-env)"
@@ -68,3 +97,251 @@ def test_construct_user_agent_missing_args(monkeypatch):
     )
     for user_agent in (user_agent_1, user_agent_2, user_agent_3):
         assert user_agent is None
+
+
+def test_report_sampler__rates(mocker):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    mocker.patch("kw.platform.utils.random.random", return_value=0.5)
+
+    sampler = uut.ReportSampler(rates={uut.SUNSET: 0.1, uut.DEPRECATED_USAGE: 0.9})
+    for _ in range(3):
+        sampler.sample(uut.SUNSET, "sunset")
+        sampler.sample(uut.DEPRECATED_USAGE, "deprecated")
+
+    assert sampler.seen == {uut.SUNSET: 3, uut.DEPRECATED_USAGE: 3}
+    assert sampler.reported == {uut.DEPRECATED_USAGE: 3}
+    assert m_capture_message.call_count == 3
+    m_capture_message.assert_called_with("deprecated", level="warning")
+
+
+def test_report_sampler__reservoir(mocker):
+    m_capture_message = mocker.patch("kw.platform.utils.capture_message")
+    m_timer = mocker.patch("kw.platform.utils.threading.Timer")
+    m_atexit = mocker.patch("kw.platform.utils.atexit.register")
+
+    sampler = uut.ReportSampler(rates=0.0, reservoir_size=2, window=60)
+    for i in range(100):
+        sampler.sample(uut.SUNSET, "sunset {}".format(i))
+
+    m_capture_message.assert_not_called()
+    m_timer.assert_called_once_with(60, sampler.flush)
+    m_timer.return_value.start.assert_called_once_with()
+    m_atexit.assert_called_once_with(sampler.flush)
+
+    # The window is over
+    m_timer.call_args[0][1]()
+
+    assert m_capture_message.call_count == 2
+    assert sampler.seen[uut.SUNSET] == 100
+    assert sampler.reported[uut.SUNSET] == 2
+
+    sampler.sample(uut.SUNSET, "next window")
+    assert m_timer.call_count == 2
+    sampler.flush()
+
+    assert m_capture_message.call_count == 3
+    m_capture_message.assert_called_with("next window", level="warning")
+    m_timer.return_value.cancel.assert_called_with()
+    assert m_atexit.call_count == 1
+
+
+def test_report_sampler__reservoir__timer(mocker):
+    captured = threading.Event()
+    m_capture_message = mocker.patch(
+        "kw.platform.utils.capture_message", side_effect=lambda *a, **k: captured.set()
+    )
+    mocker.patch("kw.platform.utils.atexit.register")
+
+    sampler = uut.ReportSampler(rates=0.0, reservoir_size=1, window=0.01)
+    sampler.sample(uut.SUNSET, "sunset")
+
+    assert captured.wait(5)
+    m_capture_message.assert_called_once_with("sunset", level="warning")
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("", {}),
+        (
+            '<https://example.com/sunset>;rel="sunset"',
+            {"sunset": {"url": "https://example.com/sunset", "rel": "sunset"}},
+        ),
+        (
+            '<https://meta.example.com>; rel="meta", <https://example.com>;rel=sunset',
+            {
+                "meta": {"url": "https://meta.example.com", "rel": "meta"},
+                "sunset": {"url": "https://example.com", "rel": "sunset"},
+            },
+        ),
+    ],
+)
+def test_parse_link_header(value, expected):
+    assert uut.parse_link_header(value) == expected
+
+
+def test_inspector_pipeline(mocker):
+    m_parse_link_header = mocker.spy(uut, "parse_link_header")
+    sampler = mocker.Mock()
+    response = mocker.Mock(headers={"Link": '<https://example.com>;rel="meta"'})
+
+    uut.inspectors.run(response, sampler=sampler)
+
+    m_parse_link_header.assert_not_called()
+    sampler.sample.assert_not_called()
+
+    response.headers = {"Deprecated-Usage": "Old", "Sunset": "soon"}
+    uut.inspectors.run(response, sampler=sampler, skip=[uut.SUNSET])
+
+    sampler.sample.assert_called_once_with(uut.DEPRECATED_USAGE, "Old", level="warning")
+
+
+def test_inspector_pipeline__single_pass(mocker):
+    class Headers(dict):
+        reads = []
+
+        def get(self, name, default=None):
+            self.reads.append(name)
+            return super(Headers, self).get(name, default)
+
+        def __getitem__(self, name):
+            self.reads.append(name)
+            return super(Headers, self).__getitem__(name)
+
+        def __contains__(self, name):
+            self.reads.append(name)
+            return super(Headers, self).__contains__(name)
+
+    sampler = mocker.Mock()
+    headers = Headers({"Sunset": "soon", "Link": '<https://example.com>;rel="sunset"'})
+
+    uut.inspectors.run(mocker.Mock(headers=headers), sampler=sampler)
+
+    assert sorted(headers.reads) == ["Deprecated-Usage", "Link", "Sunset"]
+    sampler.sample.assert_called_once_with(
+        uut.SUNSET,
+        "The Sunset header found in the HTTP response: soon, additional info: "
+        "https://example.com",
+        level="warning",
+    )
+
+
+def test_inspector_pipeline__multidict(mocker):
+    sampler = mocker.Mock()
+    headers = CIMultiDict(
+        [("Link", "<https://example.com>;rel=meta"), ("link", "<x>;rel=sunset")]
+    )
+
+    uut.inspectors.run(mocker.Mock(headers=headers), sampler=sampler)
+
+    sampler.sample.assert_called_once_with(
+        uut.SUNSET,
+        "The Sunset Link relation type found in the HTTP response: x",
+        level="warning",
+    )
+
+
+def test_inspector_pipeline__register(mocker):
+    class TraceInspector(uut.ResponseInspector):
+        header_type = "trace"
+        headers = ("X-Trace",)
+        inspect = mocker.Mock()
+
+    inspector = TraceInspector()
+    pipeline = uut.InspectorPipeline([uut.DeprecatedUsageInspector()])
+    pipeline.register(inspector)
+
+    pipeline.run(mocker.Mock(headers={"Other": "1"}))
+    inspector.inspect.assert_not_called()
+
+    pipeline.run(mocker.Mock(headers={"X-Trace": "1"}), sampler="sampler")
+    inspector.inspect.assert_called_once_with({"X-Trace": "1"}, "sampler")
+
+    pipeline.unregister(inspector)
+    pipeline.run(mocker.Mock(headers={"X-Trace": "1"}))
+    assert inspector.inspect.call_count == 1
+
+
+def test_response_inspector__abstract():
+    class IncompleteInspector(uut.ResponseInspector):
+        headers = ("X-Trace",)
+
+    with pytest.raises(TypeError):
+        IncompleteInspector()
+
+
+def test_sunset_registry():
+    registry = uut.SunsetRegistry()
+    registry.register(
+        "/old", when=datetime(2019, 8, 5, 5, 10, 0), info_url="https://example.com"
+    )
+
+    assert "/old" in registry
+    assert registry.get("/old") == (
+        ("Link", '<https://example.com>;rel="sunset"'),
+        ("Sunset", "Mon, 05 Aug 2019 05:10:00 GMT"),
+    )
+    assert registry.get("/new") is None
+
+    registry.unregister("/old")
+    assert len(registry) == 0
+
+    with pytest.raises(TypeError):
+        registry.register("/old")
+
+
+def test_deprecation_registry():
+    registry = uut.DeprecationRegistry(capacity=2)
+    registry.register("/old", "Use /new instead")
+    registry.register("/users", "Parameter 'sort' is deprecated", parameters=["sort"])
+
+    assert registry.match("/old", user_agent="mambo/1a (Kiwi.com dev)") == (
+        ("Deprecated-Usage", "Use /new instead"),
+    )
+    assert registry.match("/old", user_agent="invalid")
+    assert registry.match("/old", user_agent="mambo/2b (Kiwi.com production)")
+    assert registry.match("/users", parameters=["page"]) is None
+    assert registry.match("/users", parameters={"sort": ["name"]})
+    assert registry.match("/new") is None
+
+    assert registry.usage() == [("/old", "mambo", 2, 0), ("/users", "unknown", 2, 1)]
+
+    registry.unregister("/old")
+    assert "/old" not in registry
+    assert len(registry) == 1
+
+
+def test_validate_many():
+    values = [
+        "mambo/1a (Kiwi.com dev)",
+        None,
+        "invalid",
+        "zoo/git-123ad4 (Kiwi.com production) thief requests/2.22",
+        "",
+        "mambo/1a (Kiwi.com dev)",
+        "invalid",
+        "mambo/1a (Kiwi.com dev)",
+        "mambo/1a (Kiwi.com dev)",
+    ]
+
+    results = uut.validate_many(iter(values))
+
+    assert len(results) == 9
+    assert results.unique == 5
+    assert list(results) == [uut.UserAgentValidator(value).is_valid for value in values]
+    assert results.count_valid() == 5
+    assert len(results.valid) == 2
+    assert results.names[:4] == ["mambo", None, None, "zoo"]
+    assert results.versions[3] == "git-123ad4"
+    assert results.environments[3] == "production"
+    assert results.system_infos[3] == "thief requests/2.22"
+
+    with pytest.raises(IndexError):
+        results.is_valid(9)
+
+
+def test_validate_many__empty():
+    results = uut.validate_many([])
+
+    assert len(results) == 0
+    assert results.count_valid() == 0
@@ -1,10 +1,16 @@
+import io
 import time
+from datetime import datetime
+from wsgiref.handlers import SimpleHandler
 
 import pytest
 from freezegun import freeze_time
 from webob.request import BaseRequest
 
+from kw.platform import counters, deadline, profiling, settings, slowdown
 from kw.platform import wsgi as uut
+from kw.platform.load import RESTRICT, LoadMonitor
+from kw.platform.utils import DeprecationRegistry, SunsetRegistry
 
 
 def create_app(sleep_seconds=0):
@@ -12,11 +18,18 @@ def create_app(sleep_seconds=0):
         if sleep_seconds:
             time.sleep(sleep_seconds)
         start_response("200 OK", [("Content-Type", "text/html; charset=UTF-8")])
-        return ["OK"]
+        return [b"OK"]
 
     return simple_app
 
 
+def get_response(req, app):
+    """Get the response like a WSGI server, closing the body once it is read."""
+    res = req.get_response(app)
+    res.body  # pylint: disable=pointless-statement
+    return res
+
+
 @pytest.mark.parametrize(
     "user_agent,expected_status,current_time",
     [
@@ -69,3 +82,318 @@ def test_user_agent_middleware__slowdown(
 
     assert res.status_code == 200
     assert request_time >= expected_time
+
+
+@pytest.mark.parametrize(
+    "bypass,expected_status",
+    [("", 400), ("/bookings", 200), ("/bookings/*", 400), ("GET", 200)],
+)
+def test_user_agent_middleware__bypass(restore_settings, bypass, expected_status):
+    settings.update(bypass=bypass)
+    app = uut.user_agent_middleware(create_app())
+
+    req = BaseRequest.blank("/bookings")
+    with freeze_time("2020-01-01", tick=True):
+        res = req.get_response(app)
+
+    assert res.status_code == expected_status
+
+
+def test_user_agent_middleware__slowdown_before(monkeypatch):
+    monkeypatch.setattr(settings, "KIWI_SLOWDOWN_MODE", slowdown.BEFORE)
+    monkeypatch.setattr(slowdown, "durations", slowdown.DurationEstimator(alpha=1))
+    sleep = []
+    monkeypatch.setattr(uut.time, "sleep", sleep.append)
+    app = uut.user_agent_middleware(create_app())
+
+    with freeze_time("2019-07-26"):
+        slowdown.durations.record("GET /", 0.5)
+        res = get_response(BaseRequest.blank("/"), app)
+
+    assert res.status_code == 200
+    assert sleep == [0.5]
+    assert slowdown.durations.estimate("GET /") == 0
+
+
+def test_user_agent_middleware__slowdown_before__route_key(monkeypatch):
+    monkeypatch.setattr(settings, "KIWI_SLOWDOWN_MODE", slowdown.BEFORE)
+    monkeypatch.setattr(slowdown, "durations", slowdown.DurationEstimator(alpha=1))
+    monkeypatch.setattr(uut.time, "sleep", lambda seconds: None)
+
+    def route_key(environ):
+        return "GET /users/{id}"
+
+    app = uut.user_agent_middleware(create_app(), route_key=route_key)
+    with freeze_time("2019-07-26"):
+        for user_id in range(3):
+            get_response(BaseRequest.blank("/users/{}".format(user_id)), app)
+
+    assert len(slowdown.durations) == 1
+    assert slowdown.durations.estimate("GET /users/{id}") >= 0
+
+
+def test_user_agent_middleware__slowdown_held_bytes(monkeypatch):
+    monkeypatch.setattr(slowdown, "held_bytes", slowdown.HeldBytes(limit=1))
+    sleep = []
+    monkeypatch.setattr(uut.time, "sleep", sleep.append)
+    app = uut.user_agent_middleware(create_app())
+
+    with freeze_time("2019-07-26"):
+        before = counters.get("user_agent.slowdown_skipped")
+        res = get_response(BaseRequest.blank("/"), app)
+
+    assert res.status_code == 200
+    assert sleep == []
+    assert counters.get("user_agent.slowdown_skipped") == before + 1
+    assert slowdown.held_bytes.held == 0
+
+
+def test_user_agent_middleware__slowdown_held_bytes__content_length(monkeypatch):
+    monkeypatch.setattr(slowdown, "held_bytes", slowdown.HeldBytes(limit=10))
+    sleep = []
+    monkeypatch.setattr(uut.time, "sleep", sleep.append)
+
+    class ClosingIterator(object):
+        """Body of frameworks like werkzeug, not a list of chunks."""
+
+        def __init__(self, chunks):
+            self.chunks = chunks
+
+        def __iter__(self):
+            return iter(self.chunks)
+
+        def close(self):
+            pass
+
+    def framework_app(environ, start_response):
+        body = b"x" * 10000
+        start_response("200 OK", [("Content-Length", str(len(body)))])
+        return ClosingIterator([body])
+
+    app = uut.user_agent_middleware(framework_app)
+    with freeze_time("2019-07-26"):
+        before = counters.get("user_agent.slowdown_skipped")
+        res = get_response(BaseRequest.blank("/"), app)
+
+    assert res.status_code == 200
+    assert sleep == []
+    assert counters.get("user_agent.slowdown_skipped") == before + 1
+    assert slowdown.held_bytes.held == 0
+
+
+def test_user_agent_middleware__slowdown_generator():
+    closed = []
+
+    def generator_app(environ, start_response):
+        try:
+            time.sleep(0.1)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            yield b"first"
+            yield b"second"
+        finally:
+            closed.append(True)
+
+    app = uut.user_agent_middleware(generator_app)
+    req = BaseRequest.blank("/")
+    req.user_agent = "invalid"
+
+    with freeze_time("2019-07-26", tick=True):
+        before_time = time.time()
+        res = get_response(req, app)
+        request_time = time.time() - before_time
+
+    assert res.status_code == 200
+    assert res.body == b"firstsecond"
+    assert request_time >= 0.2
+    assert closed == [True]
+
+
+def test_user_agent_middleware__refusal(monkeypatch):
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_CLOSE_CONNECTION", True)
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_RETRY_AFTER", 60)
+    app = uut.user_agent_middleware(create_app())
+
+    with freeze_time("2020-01-01"):
+        res = BaseRequest.blank("/").get_response(app)
+
+    assert res.status_code == 400
+    assert res.json == {"message": settings.KIWI_RESTRICT_USER_AGENT_MESSAGE}
+    assert res.headers["Retry-After"] == "60"
+    assert "Connection" not in res.headers
+
+
+def test_user_agent_middleware__refusal__wsgiref(monkeypatch):
+    monkeypatch.setattr(settings, "KIWI_REFUSAL_CLOSE_CONNECTION", True)
+    app = uut.user_agent_middleware(create_app())
+    environ = BaseRequest.blank("/").environ
+    stdout = io.BytesIO()
+    handler = SimpleHandler(io.BytesIO(), stdout, io.StringIO(), environ)
+
+    with freeze_time("2020-01-01"):
+        handler.run(app)
+
+    status_line = stdout.getvalue().split(b"\r\n")[0]
+    assert status_line.endswith(b" 400 Bad Request")
+
+
+def test_profiling_middleware(monkeypatch):
+    monkeypatch.setattr(profiling, "enabled", True)
+    monkeypatch.setattr(uut.time, "sleep", lambda seconds: None)
+    app = uut.profiling_middleware(uut.user_agent_middleware(create_app()))
+
+    with freeze_time("2019-07-26"):
+        res = get_response(BaseRequest.blank("/"), app)
+
+    assert res.status_code == 200
+    timings = res.headers["Server-Timing"].split(", ")
+    names = [timing.split(";")[0] for timing in timings]
+    assert names == [profiling.SLOWDOWN, profiling.VALIDATE]
+
+
+def test_profiling_middleware__disabled():
+    app = uut.profiling_middleware(uut.user_agent_middleware(create_app()))
+
+    res = get_response(BaseRequest.blank("/"), app)
+
+    assert "Server-Timing" not in res.headers
+
+
+def test_user_agent_middleware__streaming(mocker):
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            yield b"chunk"
+
+        def close(self):
+            closed.append(True)
+
+    body = Body()
+
+    def streaming_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return body
+
+    environ = {"HTTP_USER_AGENT": "mambo/1a (Kiwi.com dev)"}
+    start_response = mocker.Mock()
+
+    assert uut.user_agent_middleware(streaming_app)(environ, start_response) is body
+
+    monitor = LoadMonitor(restrict_in_flight=10)
+    app_iter = uut.adaptive_user_agent_middleware(streaming_app, monitor)(
+        environ, start_response
+    )
+    assert monitor.in_flight == 1
+    assert list(app_iter) == [b"chunk"]
+    app_iter.close()
+    assert monitor.in_flight == 0
+    assert closed == [True]
+
+
+def test_sunset_middleware():
+    sunsets = SunsetRegistry()
+    sunsets.register(
+        "/old", when=datetime(2019, 8, 5, 5, 10, 0), info_url="https://example.com"
+    )
+    app = uut.sunset_middleware(create_app(), sunsets)
+
+    res = BaseRequest.blank("/old").get_response(app)
+
+    assert res.headers["Sunset"] == "Mon, 05 Aug 2019 05:10:00 GMT"
+    assert res.headers["Link"] == '<https://example.com>;rel="sunset"'
+    assert res.body == b"OK"
+
+    res = BaseRequest.blank("/new").get_response(app)
+
+    assert "Sunset" not in res.headers
+    assert "Link" not in res.headers
+
+
+def test_deprecation_middleware():
+    deprecations = DeprecationRegistry()
+    deprecations.register("/old", "Parameter 'sort' is deprecated", parameters=["sort"])
+    app = uut.deprecation_middleware(create_app(), deprecations)
+
+    req = BaseRequest.blank("/old?sort=")
+    req.user_agent = "mambo/1a (Kiwi.com dev)"
+    res = req.get_response(app)
+
+    assert res.headers["Deprecated-Usage"] == "Parameter 'sort' is deprecated"
+    assert res.body == b"OK"
+    assert deprecations.usage() == [("/old", "mambo", 1, 0)]
+
+    for path in ("/old?page=1", "/new?sort=name"):
+        res = BaseRequest.blank(path).get_response(app)
+        assert "Deprecated-Usage" not in res.headers
+
+
+def test_adaptive_user_agent_middleware():
+    monitor = LoadMonitor(restrict_in_flight=2)
+    app = uut.adaptive_user_agent_middleware(create_app(), monitor)
+
+    req = BaseRequest.blank("/")
+    req.user_agent = "invalid"
+
+    with freeze_time("2020-01-01", tick=True):
+        assert get_response(req, app).status_code == 200
+
+        monitor.request_started()
+        monitor.request_started()
+        assert monitor.level == RESTRICT
+
+        assert get_response(req, app).status_code == 400
+
+        req.user_agent = "mambo/1a (Kiwi.com dev)"
+        assert get_response(req, app).status_code == 200
+
+    assert monitor.in_flight == 2
+
+
+def test_deadline_middleware(mocker):
+    budgets = []
+
+    def budget_app(environ, start_response):
+        budgets.append(deadline.remaining())
+        return create_app()(environ, start_response)
+
+    app = uut.deadline_middleware(budget_app)
+
+    req = BaseRequest.blank("/")
+    req.headers["X-Request-Deadline-Ms"] = "1500"
+    resp = req.get_response(app)
+    assert resp.status_code == 200
+    # The deadline is kept until the server closes the response
+    assert deadline.remaining() is not None
+    resp.app_iter.close()
+
+    mocker.patch("kw.platform.settings.KIWI_DEFAULT_REQUEST_BUDGET", 3.0)
+    resp = BaseRequest.blank("/").get_response(app)
+    assert resp.status_code == 200
+    resp.app_iter.close()
+
+    assert 1.4 < budgets[0] <= 1.5
+    assert 2.9 < budgets[1] <= 3.0
+    assert deadline.remaining() is None
+
+
+def test_deadline_middleware__streamed_body():
+    budgets = []
+
+    def streaming_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        budgets.append(deadline.remaining())
+        yield b"Hello"
+        budgets.append(deadline.remaining())
+        yield b"World"
+
+    app = uut.deadline_middleware(streaming_app)
+    environ = BaseRequest.blank("/", headers={"X-Request-Deadline-Ms": "1500"}).environ
+
+    app_iter = app(environ, lambda status, headers, exc_info=None: None)
+    assert b"".join(app_iter) == b"HelloWorld"
+    assert deadline.remaining() is not None
+    app_iter.close()
+
+    assert all(1.4 < budget <= 1.5 for budget in budgets)
+    assert len(budgets) == 2
+    assert deadline.remaining() is None